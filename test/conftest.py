@@ -1,11 +1,20 @@
+import http.server
+import json
 import os
 import pathlib
 import pytest
+import socketserver
+import struct
 import subprocess
 import shutil
+import sys
+import threading
+import urllib.parse
 
 
+from tuxmake.agent import AgentClient
 from tuxmake.arch import Architecture
+from tuxmake.runtime import Runtime
 
 if pytest.__version__ < "3.9":
 
@@ -36,6 +45,12 @@ def home(monkeypatch, tmp_path):
     return h
 
 
+@pytest.fixture(autouse=True)
+def download_file(mocker):
+    # never download kernel.org toolchains from the tests
+    return mocker.patch("tuxmake.build.download_file")
+
+
 @pytest.fixture(scope="session")
 def linux(test_directory, tmpdir_factory):
     src = test_directory / "fakelinux"
@@ -54,6 +69,41 @@ def linux_rw(tmp_path):
     return dst
 
 
+def run_git(directory, *args):
+    subprocess.check_call(
+        [
+            "git",
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            *args,
+        ],
+        cwd=str(directory),
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@pytest.fixture
+def git():
+    return run_git
+
+
+@pytest.fixture
+def linux_git(linux_rw):
+    run_git(linux_rw, "init", "--quiet")
+    run_git(linux_rw, "add", ".")
+    run_git(linux_rw, "commit", "--quiet", "--message=initial")
+    return linux_rw
+
+
+@pytest.fixture
+def image_id(mocker):
+    return mocker.patch(
+        "tuxmake.runtime.Runtime.get_image_id", return_value="sha256:0123"
+    )
+
+
 @pytest.fixture(autouse=True, scope="session")
 def fake_cross_compilers(tmpdir_factory):
     missing = {}
@@ -78,3 +128,148 @@ def Popen(mocker):
         mocker.MagicMock(),
     )
     return _Popen
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Minimal implementation of the docker engine API, for testing. Commands
+    "executed in containers" are run locally.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(str(path), FakeEngineHandler)
+        self.requests = []
+        self.images = {
+            "tuxmake/x86_64_gcc": {
+                "Id": "sha256:0123456789abcdef",
+                "RepoDigests": ["tuxmake/x86_64_gcc@sha256:fedcba9876543210"],
+                "RepoTags": ["tuxmake/x86_64_gcc:latest", "tuxmake/x86_64_gcc:20"],
+                "Size": 1234567,
+            }
+        }
+        self.pulled = []
+        self.stopped = []
+        self.execs = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.serve_forever, args=(0.01,), daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeEngineHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return "fake-engine"
+
+    def reply(self, status, body=b"", content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        engine = self.server
+        engine.requests.append(("GET", self.path))
+        if self.path == "/_ping":
+            self.reply(200, b"OK", "text/plain")
+        elif self.path == "/version":
+            self.reply(200, {"Version": "20.10.5", "GitCommit": "55c4c88"})
+        elif self.path.startswith("/images/"):
+            name = urllib.parse.unquote(self.path.split("/", 2)[2].rsplit("/", 1)[0])
+            if name in engine.images:
+                self.reply(200, engine.images[name])
+            else:
+                self.reply(404, {"message": f"No such image: {name}"})
+        elif self.path.startswith("/exec/"):
+            exec_id = self.path.split("/")[2]
+            self.reply(200, {"ExitCode": engine.execs[exec_id]["ExitCode"]})
+        else:
+            self.reply(404, {"message": "not found"})
+
+    def do_POST(self):
+        engine = self.server
+        engine.requests.append(("POST", self.path))
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or "null")
+        url = urllib.parse.urlparse(self.path)
+        parts = url.path.split("/")
+        if url.path == "/images/create":
+            query = urllib.parse.parse_qs(url.query)
+            image = query["fromImage"][0] + ":" + query["tag"][0]
+            if image.startswith("invalid"):
+                progress = {"error": "manifest unknown"}
+            else:
+                progress = {"status": "Downloaded newer image"}
+                engine.pulled.append(image)
+            self.reply(200, json.dumps(progress).encode() + b"\n")
+        elif parts[1] == "containers" and parts[3] == "exec":
+            if parts[2] == "missing":
+                self.reply(404, {"message": "No such container"})
+                return
+            with engine.lock:
+                exec_id = f"exec{len(engine.execs)}"
+                engine.execs[exec_id] = {"Cmd": body["Cmd"], "ExitCode": None}
+            self.reply(201, {"Id": exec_id})
+        elif parts[1] == "exec" and parts[3] == "start":
+            if parts[2] not in engine.execs:
+                self.reply(404, {"message": "No such exec instance"})
+                return
+            self.start_exec(engine.execs[parts[2]])
+        elif parts[1] == "containers" and parts[3] == "stop":
+            engine.stopped.append(parts[2])
+            self.reply(204)
+        else:
+            self.reply(404, {"message": "not found"})
+
+    def start_exec(self, exec_instance):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.docker.multiplexed-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        proc = subprocess.run(
+            exec_instance["Cmd"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        for stream, data in ((1, proc.stdout), (2, proc.stderr)):
+            if data:
+                self.wfile.write(struct.pack(">B3xI", stream, len(data)) + data)
+        exec_instance["ExitCode"] = proc.returncode
+        self.close_connection = True
+
+
+@pytest.fixture
+def fake_engine(tmp_path, monkeypatch):
+    path = tmp_path / "engine.sock"
+    engine = FakeEngine(path)
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{path}")
+    monkeypatch.setenv("TUXMAKE_ENGINE_API", "true")
+    yield engine
+    engine.stop()
+
+
+@pytest.fixture
+def local_agent(tmp_path):
+    """
+    A command agent running on the host, as it would inside of a container.
+    """
+    client = AgentClient(tmp_path / "agent.sock")
+    process = subprocess.Popen(
+        [sys.executable, str(Runtime.bindir / "tuxmake-agent"), str(client.socket_path)]
+    )
+    assert client.wait()
+    yield client
+    process.terminate()
+    process.wait()
@@ -0,0 +1,91 @@
+import socket
+import struct
+import pytest
+
+from tuxmake.agent import AgentClient
+from tuxmake.agent import AgentError
+
+
+@pytest.fixture
+def agent(local_agent):
+    return local_agent
+
+
+def run(agent, cmd, **kwargs):
+    output = []
+    code = agent.run(agent.connect(), cmd, lambda k, d: output.append(d), **kwargs)
+    return code, b"".join(output)
+
+
+class TestAgent:
+    def test_output_and_exit_code(self, agent):
+        code, output = run(agent, ["sh", "-c", "echo foo; echo bar >&2; exit 2"])
+        assert code == 2
+        assert output == b"foo\nbar\n"
+
+    def test_cwd(self, agent, tmp_path):
+        _, output = run(agent, ["pwd"], cwd=tmp_path)
+        assert output.decode().strip() == str(tmp_path)
+
+    def test_env(self, agent):
+        _, output = run(agent, ["sh", "-c", "echo $FOO"], env={"FOO": "BAR"})
+        assert output == b"BAR\n"
+
+    def test_command_not_found(self, agent):
+        code, output = run(agent, ["/does/not/exist"])
+        assert code == 127
+        assert b"No such file or directory" in output
+
+    def test_killed_by_signal(self, agent):
+        code, _ = run(agent, ["sh", "-c", "kill -9 $$"])
+        assert code == 137
+
+    def test_invalid_request(self, agent):
+        sock = agent.connect()
+        sock.sendall(b"garbage\n")
+        data = sock.makefile("rb").read()
+        sock.close()
+        assert b"invalid request" in data
+        assert data.endswith(struct.pack(">B3xIi", 3, 4, 255))
+
+    def test_concurrent_commands(self, agent):
+        first = agent.connect()
+        second = agent.connect()
+        assert agent.run(second, ["true"], lambda k, d: None) == 0
+        assert agent.run(first, ["true"], lambda k, d: None) == 0
+
+    def test_connect_failure(self, tmp_path):
+        with pytest.raises(AgentError):
+            AgentClient(tmp_path / "missing.sock").connect()
+
+    def test_wait_timeout(self, tmp_path):
+        assert not AgentClient(tmp_path / "missing.sock").wait(timeout=0.05)
+
+    def test_no_exit_code(self, tmp_path):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(tmp_path / "agent.sock"))
+        server.listen()
+        client = AgentClient(tmp_path / "agent.sock")
+        sock = client.connect()
+        conn, _ = server.accept()
+        conn.shutdown(socket.SHUT_WR)
+        with pytest.raises(AgentError) as exc:
+            client.run(sock, ["true"], lambda k, d: None)
+        assert "did not report the exit code" in str(exc.value)
+        conn.close()
+        server.close()
+
+    def test_lost_connection(self, agent):
+        sock = agent.connect()
+        sock.close()
+        with pytest.raises(AgentError):
+            agent.run(sock, ["true"], lambda k, d: None)
+
+
+class TestCreate:
+    def test_create_and_cleanup(self):
+        client = AgentClient.create()
+        assert client.directory.is_dir()
+        assert client.socket_path.parent == client.directory
+        client.cleanup()
+        assert not client.directory.exists()
@@ -0,0 +1,247 @@
+import errno
+import hashlib
+import os
+import time
+
+import pytest
+
+from tuxmake.artifact_store import ArtifactStore
+from tuxmake.artifact_store import GC_STAMP
+from tuxmake.artifact_store import copy_file
+from tuxmake.artifact_store import enabled
+from tuxmake.artifact_store import get_hash_algorithms
+from tuxmake.artifact_store import get_store_dir
+from tuxmake.build import Build
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(tmp_path / "store")
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    src = tmp_path / "headers.tar.xz"
+    src.write_bytes(b"headers" * 1000)
+    return src
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestSettings:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_ARTIFACT_STORE", raising=False)
+        assert not enabled()
+
+    def test_enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE", "true")
+        assert enabled()
+
+    def test_store_dir(self, home, monkeypatch):
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        monkeypatch.delenv("TUXMAKE_ARTIFACT_STORE_DIR", raising=False)
+        assert get_store_dir() == home / ".cache" / "tuxmake" / "artifacts"
+
+    def test_store_dir_from_environment(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE_DIR", str(tmp_path))
+        assert get_store_dir() == tmp_path
+
+
+class TestGetHashAlgorithms:
+    def test_default(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_ARTIFACT_HASHES", raising=False)
+        assert get_hash_algorithms() == ["sha256"]
+
+    def test_extra(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_HASHES", "BLAKE2b, sha256,invalid")
+        assert get_hash_algorithms() == ["sha256", "blake2b"]
+
+    def test_variable_length(self, monkeypatch, artifact, tmp_path):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_HASHES", "shake_128,shake_256,sha512")
+        algorithms = get_hash_algorithms()
+        assert algorithms == ["sha256", "sha512"]
+        assert "sha512" in copy_file(artifact, tmp_path / "copy", algorithms)
+
+
+class TestCopyFile:
+    def test_copy_to_path(self, artifact, tmp_path):
+        dest = tmp_path / "copy"
+        checksums = copy_file(artifact, dest)
+        assert dest.read_bytes() == artifact.read_bytes()
+        assert checksums == {"size": 7000, "sha256": sha256(artifact.read_bytes())}
+
+    def test_copy_to_file(self, artifact, tmp_path):
+        dest = tmp_path / "copy"
+        with dest.open("wb") as f:
+            copy_file(artifact, f)
+            assert not f.closed
+        assert dest.read_bytes() == artifact.read_bytes()
+
+    def test_multiple_chunks(self, artifact, tmp_path, mocker):
+        mocker.patch("tuxmake.artifact_store.CHUNK_SIZE", 1024)
+        dest = tmp_path / "copy"
+        checksums = copy_file(artifact, dest, ["sha256", "blake2b"])
+        data = artifact.read_bytes()
+        assert dest.read_bytes() == data
+        assert checksums["blake2b"] == hashlib.blake2b(data).hexdigest()
+        assert checksums["sha256"] == sha256(data)
+
+    def test_does_not_write_to_existing_link(self, store, artifact, tmp_path):
+        dest = tmp_path / "out"
+        checksum = store.publish(artifact, dest)
+        new = tmp_path / "new"
+        new.write_bytes(b"new")
+        copy_file(new, dest)
+        assert dest.read_bytes() == b"new"
+        assert store.blob(checksum["sha256"]).read_bytes() == artifact.read_bytes()
+
+    def test_empty(self, tmp_path):
+        src = tmp_path / "empty"
+        src.touch()
+        assert copy_file(src, tmp_path / "copy")["size"] == 0
+
+
+class TestPublish:
+    def test_links_blob(self, store, artifact, tmp_path):
+        dest = tmp_path / "out"
+        checksum = store.publish(artifact, dest)
+        assert checksum == {"sha256": sha256(artifact.read_bytes()), "size": 7000}
+        blob = store.blob(checksum["sha256"])
+        assert os.path.samefile(str(blob), str(dest))
+        assert blob.stat().st_nlink == 2
+        assert blob.stat().st_mode & 0o777 == 0o444
+
+    def test_deduplicates(self, store, artifact, tmp_path):
+        a = tmp_path / "a"
+        b = tmp_path / "b"
+        store.publish(artifact, a)
+        store.publish(artifact, b)
+        assert os.path.samefile(str(a), str(b))
+        assert len(list(store.blobs.glob("*/*"))) == 1
+        assert list(store.directory.glob(".tmp-*")) == []
+
+    def test_replaces_existing_destination(self, store, artifact, tmp_path):
+        dest = tmp_path / "out"
+        dest.write_text("old")
+        store.publish(artifact, dest)
+        assert dest.read_bytes() == artifact.read_bytes()
+
+    def test_extra_hashes(self, tmp_path, artifact):
+        store = ArtifactStore(tmp_path / "store", ["sha256", "blake2b"])
+        checksums = store.publish(artifact, tmp_path / "out")
+        assert (
+            checksums["blake2b"] == hashlib.blake2b(artifact.read_bytes()).hexdigest()
+        )
+
+    def test_cross_device(self, store, artifact, tmp_path, mocker):
+        mocker.patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device"))
+        dest = tmp_path / "out"
+        checksum = store.publish(artifact, dest)
+        assert dest.read_bytes() == artifact.read_bytes()
+        assert not os.path.samefile(str(dest), str(store.blob(checksum["sha256"])))
+
+    def test_other_link_errors(self, store, artifact, tmp_path, mocker):
+        mocker.patch("os.link", side_effect=OSError(errno.ENOSPC, "no space"))
+        with pytest.raises(OSError):
+            store.publish(artifact, tmp_path / "out")
+
+    def test_missing_source(self, store, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            store.publish(tmp_path / "missing", tmp_path / "out")
+        assert list(store.directory.glob(".tmp-*")) == []
+
+
+class TestGarbageCollection:
+    def test_removes_unreferenced_blobs(self, store, artifact, tmp_path):
+        dest = tmp_path / "out"
+        checksum = store.publish(artifact, dest)
+        assert store.collect_garbage() == 0
+        dest.unlink()
+        assert store.collect_garbage() == 7000
+        assert not store.blob(checksum["sha256"]).exists()
+
+    def test_removes_stale_temporary_files(self, store):
+        store.directory.mkdir()
+        stale = store.directory / ".tmp-stale"
+        stale.write_text("x")
+        os.utime(str(stale), (0, 0))
+        fresh = store.directory / ".tmp-fresh"
+        fresh.write_text("y")
+        assert store.collect_garbage() == 1
+        assert not stale.exists()
+        assert fresh.exists()
+
+    def test_empty_store(self, store):
+        assert store.collect_garbage() == 0
+
+    def test_blob_removed_concurrently(self, store, mocker):
+        store.directory.mkdir()
+        missing = store.blobs / "00" / "00missing"
+        mocker.patch("pathlib.Path.glob", side_effect=[[], [missing]])
+        assert store.collect_garbage() == 0
+
+    def test_maybe_collect_garbage(self, store, mocker):
+        store.directory.mkdir()
+        collect_garbage = mocker.spy(store, "collect_garbage")
+        store.maybe_collect_garbage()
+        assert collect_garbage.call_count == 1
+        store.maybe_collect_garbage()
+        assert collect_garbage.call_count == 1
+        old = time.time() - 7200
+        os.utime(str(store.directory / GC_STAMP), (old, old))
+        store.maybe_collect_garbage()
+        assert collect_garbage.call_count == 2
+
+
+class TestBuild:
+    @pytest.fixture(autouse=True)
+    def artifact_store(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE", "true")
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE_DIR", str(tmp_path / "store"))
+
+    def test_disabled(self, linux, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE", "false")
+        build = Build(tree=linux, targets=["config"])
+        build.run()
+        config = build.output_dir / "config"
+        assert config.stat().st_nlink == 1
+        assert build.metadata["results"]["artifact_checksums"] == [
+            {
+                "name": "config",
+                "size": config.stat().st_size,
+                "sha256": sha256(config.read_bytes()),
+            }
+        ]
+
+    def test_reused_output_dir(self, linux, tmp_path, monkeypatch):
+        output_dir = tmp_path / "output"
+        first = Build(tree=linux, targets=["config"], output_dir=output_dir)
+        first.run()
+        config = (output_dir / "config").read_bytes()
+        assert (output_dir / "config").stat().st_nlink == 2
+        monkeypatch.setenv("TUXMAKE_ARTIFACT_STORE", "false")
+        second = Build(
+            tree=linux, targets=["config"], kconfig="tinyconfig", output_dir=output_dir
+        )
+        second.run()
+        assert second.passed
+        assert (output_dir / "config").stat().st_nlink == 1
+        (blob,) = (tmp_path / "store" / "blobs").glob("*/*")
+        assert blob.read_bytes() == config
+
+    def test_artifacts_are_shared(self, linux, tmp_path):
+        first = Build(tree=linux, targets=["config"], kconfig="tinyconfig")
+        first.run()
+        second = Build(tree=linux, targets=["config"], kconfig="tinyconfig")
+        second.run()
+        assert os.path.samefile(
+            str(first.output_dir / "config"), str(second.output_dir / "config")
+        )
+        checksums = second.metadata["results"]["artifact_checksums"]
+        assert checksums == first.metadata["results"]["artifact_checksums"]
+        config = (second.output_dir / "config").read_bytes()
+        assert checksums == [
+            {"name": "config", "sha256": sha256(config), "size": len(config)}
+        ]
@@ -2,11 +2,12 @@ import json
 from pathlib import Path
 import os
 import pytest
+import threading
 import re
 import subprocess
 import shutil
 import urllib
-from tuxmake.arch import Architecture, Native
+from tuxmake.arch import Architecture, Native, native_arch
 from tuxmake.toolchain import Toolchain
 from tuxmake.build import build
 from tuxmake.build import Build
@@ -18,6 +19,10 @@ from tuxmake.build import DEFAULT_CONTAINER_REGISTRY
 from tuxmake.target import Command
 from tuxmake.target import default_compression
 import tuxmake.exceptions
+from tuxmake import cache
+from tuxmake.jobserver import JobserverError
+from tuxmake.jobserver import get_jobserver_dir
+from tuxmake.jobs import peak_rss_key
 from tuxmake.exceptions import DecodeStacktraceMissingVariable
 from unittest.mock import patch, MagicMock
 
@@ -98,6 +103,80 @@ class TestBasicFunctionality:
             build(tree=linux, targets=["unknown-target"])
 
 
+class TestBuildDirBackend:
+    @pytest.fixture(autouse=True)
+    def collect_metadata(self):
+        # these tests need the actual metadata
+        pass
+
+    @pytest.fixture
+    def tmpfs(self, monkeypatch, tmp_path):
+        d = tmp_path / "shm"
+        d.mkdir()
+        monkeypatch.setenv("TUXMAKE_TMPFS_DIR", str(d))
+        return d
+
+    def test_tmpfs(self, linux, tmpfs, output_dir, kernel):
+        b = Build(tree=linux, output_dir=output_dir, build_dir_backend="tmpfs")
+        cache.set(b.build_dir_size_key, 2**20)
+        assert b.build_dir.parent == tmpfs
+        b.run()
+        assert b.passed
+        assert (output_dir / kernel).exists()
+        assert not (output_dir / "build").exists()
+        assert b.metadata["build"]["build_dir_backend"] == "tmpfs"
+        assert cache.get(b.build_dir_size_key) > 0
+
+    def test_first_build_on_disk(self, linux, tmpfs, tmp_path):
+        first = build(
+            tree=linux,
+            output_dir=tmp_path / "first",
+            build_dir_backend="tmpfs",
+            targets=["config"],
+        )
+        assert first.metadata["build"]["build_dir_backend"] == "disk"
+        second = build(
+            tree=linux,
+            output_dir=tmp_path / "second",
+            build_dir_backend="tmpfs",
+            targets=["config"],
+        )
+        assert second.metadata["build"]["build_dir_backend"] == "tmpfs"
+        assert list(tmpfs.iterdir()) == []
+
+    def test_fallback_to_disk(self, linux, tmpfs, output_dir):
+        b = Build(tree=linux, output_dir=output_dir, build_dir_backend="tmpfs")
+        cache.set(b.build_dir_size_key, 2**60)
+        assert b.build_dir == output_dir / "build"
+        b.run()
+        assert b.metadata["build"]["build_dir_backend"] == "disk"
+        assert cache.get(b.build_dir_size_key) < 2**60
+
+    def test_disk(self, linux, output_dir):
+        b = build(tree=linux, output_dir=output_dir, targets=["config"])
+        assert b.metadata["build"]["build_dir_backend"] == "disk"
+        assert cache.get(b.build_dir_size_key) is None
+
+    def test_explicit_build_dir(self, linux, tmpfs, tmp_path):
+        b = build(
+            tree=linux,
+            build_dir=tmp_path / "build",
+            build_dir_backend="tmpfs",
+            targets=["config"],
+        )
+        assert b.build_dir == tmp_path / "build"
+        assert cache.get(b.build_dir_size_key) is None
+
+    def test_no_size_available(self, linux, tmpfs, mocker):
+        b = Build(tree=linux, build_dir_backend="tmpfs")
+        b.record_build_dir_size()
+        assert cache.get(b.build_dir_size_key) is None
+
+    def test_invalid(self, linux):
+        with pytest.raises(tuxmake.exceptions.UnsupportedBuildDirBackend):
+            Build(tree=linux, build_dir_backend="nfs")
+
+
 class TestKconfig:
     def test_kconfig_default(self, linux, Popen):
         b = Build(tree=linux, targets=["config"])
@@ -128,6 +207,38 @@ class TestKconfig:
         config = output_dir / "config"
         assert "CONFIG_FOO=y\nCONFIG_BAR=y\n" in config.read_text()
 
+    def test_kconfig_url_prefetched(self, linux, mocker):
+        response = mocker.MagicMock()
+        response.read.return_value = b"CONFIG_FOO=y\n"
+        urlopen = mocker.patch("urllib.request.urlopen", return_value=response)
+        b = Build(
+            tree=linux, targets=["config"], kconfig="https://example.com/config.txt"
+        )
+        b.targets[0].prefetch()
+        b.targets[0].prefetch()
+        b.build(b.targets[0])
+        assert urlopen.call_count == 1
+        assert (b.build_dir / ".config").read_text() == "CONFIG_FOO=y\n"
+
+    def test_kconfig_url_not_prefetched(self, linux, mocker, Popen):
+        response = mocker.MagicMock()
+        response.read.return_value = b"CONFIG_FOO=y\n"
+        mocker.patch("urllib.request.urlopen", return_value=response)
+        b = Build(
+            tree=linux, targets=["config"], kconfig="https://example.com/config.txt"
+        )
+        b.build(b.targets[0])
+        assert (b.build_dir / ".config").read_text() == "CONFIG_FOO=y\n"
+
+    def test_kconfig_prefetch_skipped_with_existing_config(self, linux, mocker):
+        urlopen = mocker.patch("urllib.request.urlopen")
+        b = Build(
+            tree=linux, targets=["config"], kconfig="https://example.com/config.txt"
+        )
+        (b.build_dir / ".config").write_text("CONFIG_FOO=y\n")
+        b.targets[0].prefetch()
+        assert urlopen.call_count == 0
+
     def test_kconfig_url_not_found(self, linux, mocker):
         mocker.patch(
             "urllib.request.urlopen",
@@ -306,6 +417,105 @@ def test_concurrency_set(linux, Popen):
     assert "--jobs=99" in args(Popen)
 
 
+def test_concurrency_auto(linux, Popen, mocker):
+    mocker.patch("tuxmake.jobs.get_cpus", return_value=16)
+    mocker.patch("tuxmake.jobs.get_memory", return_value=4 * 2**30)
+    b = Build(tree=linux, targets=["config"], jobs="auto:mem-per-job=1G")
+    b.build(b.targets[0])
+    assert "--jobs=4" in args(Popen)
+    assert b.jobs_plan.limited_by == "memory"
+
+
+def test_concurrency_auto_uses_peak_rss(linux, mocker):
+    mocker.patch("tuxmake.jobs.get_cpus", return_value=16)
+    mocker.patch("tuxmake.jobs.get_memory", return_value=10 * 2**30)
+    cache.set(["peak-rss", "gcc", "x86_64"], 2**30)
+    b = Build(tree=linux, target_arch="x86_64", toolchain="gcc", jobs="auto")
+    assert b.jobs == 8
+
+
+def test_concurrency_invalid(linux):
+    with pytest.raises(tuxmake.exceptions.InvalidJobs):
+        Build(tree=linux, jobs="lots")
+
+
+class TestHostJobserver:
+    @pytest.fixture
+    def make_version(self, mocker):
+        return mocker.patch(
+            "tuxmake.build.Build.get_command_output", return_value="GNU Make 4.4.1"
+        )
+
+    @pytest.fixture
+    def join(self, mocker):
+        return mocker.patch("tuxmake.jobserver.HostJobserver.join")
+
+    def test_uses_jobserver(self, linux, make_version, join, Popen, mocker):
+        leave = mocker.patch("tuxmake.jobserver.HostJobserver.leave")
+        b = Build(tree=linux, targets=["config"], jobs=8, host_jobserver=True)
+        b.prepare()
+        join.assert_called_with(8)
+        b.build(b.targets[0])
+        cmd = args(Popen)
+        assert f"--jobserver-auth=fifo:{get_jobserver_dir()}/fifo" in cmd
+        assert "--jobs=8" not in cmd
+        b.cleanup()
+        leave.assert_called()
+
+    def test_mounts_jobserver_dir(self, linux, make_version, join, mocker):
+        add_volume = mocker.patch("tuxmake.runtime.Runtime.add_volume")
+        b = Build(tree=linux, targets=["config"], host_jobserver=True)
+        b.prepare()
+        volumes = [call[0][0] for call in add_volume.call_args_list]
+        assert get_jobserver_dir() in volumes
+
+    def test_old_make(self, linux, make_version, join, Popen):
+        make_version.return_value = "GNU Make 4.3"
+        b = Build(tree=linux, targets=["config"], jobs=8, host_jobserver=True)
+        b.prepare()
+        join.assert_not_called()
+        b.build(b.targets[0])
+        assert "--jobs=8" in args(Popen)
+
+    def test_jobserver_fails(self, linux, make_version, join, Popen):
+        join.side_effect = JobserverError("failed")
+        b = Build(tree=linux, targets=["config"], jobs=8, host_jobserver=True)
+        b.prepare()
+        b.build(b.targets[0])
+        assert "--jobs=8" in args(Popen)
+
+    def test_not_used_by_default(self, linux, join):
+        b = Build(tree=linux, targets=["config"])
+        b.prepare()
+        join.assert_not_called()
+
+
+class TestPressureThrottling:
+    @pytest.fixture(autouse=True)
+    def collect_metadata(self):
+        # these tests need the actual metadata
+        pass
+
+    def test_disabled_by_default(self, linux, mocker):
+        monitor = mocker.patch("tuxmake.pressure.PressureMonitor")
+        build = Build(tree=linux, targets=["config"])
+        build.run()
+        monitor.assert_not_called()
+        assert "pressure" not in build.metadata
+
+    def test_monitors_build(self, linux, monkeypatch, mocker):
+        monkeypatch.setenv("TUXMAKE_PRESSURE_THROTTLE", "true")
+        monkeypatch.setenv("TUXMAKE_PRESSURE_THRESHOLD", "20")
+        monitor = mocker.patch("tuxmake.pressure.PressureMonitor")
+        monitor.return_value.get_metadata.return_value = {"episodes": []}
+        build = Build(tree=linux, targets=["config"], jobs=4)
+        build.run()
+        monitor.assert_called_with(build.runtime, jobserver=None, jobs=4, threshold=20)
+        monitor.return_value.__enter__.assert_called()
+        monitor.return_value.__exit__.assert_called()
+        assert build.metadata["pressure"] == {"episodes": []}
+
+
 def test_fail_fast(linux, mocker, Popen):
     b = Build(tree=linux, targets=["config"], fail_fast=True)
     b.build(b.targets[0])
@@ -507,7 +717,9 @@ class TestToolchain:
         assert all(["CC=" not in arg for arg in cmdline])
         assert "CROSS_COMPILE=aarch64-linux-gnu-" in cmdline
 
-    def test_korg_gcc_14(self, linux, Popen):
+    def test_korg_gcc_14(self, linux, Popen, mocker):
+        mocker.patch("tuxmake.build.Build.prepare_korg_gcc_toolchain")
+        mocker.patch("tuxmake.build.Build.download_korg_gcc_toolchain")
         b = Build(tree=linux, targets=["config"], toolchain="korg-gcc-14")
         b.prepare()
         assert b.prepare_korg_gcc is True
@@ -821,6 +1033,197 @@ class TestCompilerWrappers:
         volumes = [call[0] for call in add_volume.call_args_list]
         assert ("/path/to/sccache", "/usr/local/bin/sccache") in volumes
 
+    def test_stacked_with_path(self, linux, mocker, Popen):
+        add_volume = mocker.patch("tuxmake.runtime.Runtime.add_volume")
+        b = Build(tree=linux, wrapper="timing,/path/to/sccache")
+        b.prepare()
+        volumes = [call[0] for call in add_volume.call_args_list]
+        assert ("/path/to/sccache", "/usr/local/bin/sccache") in volumes
+
+    def test_timing_with_container_runtime(self, linux, Popen, mocker):
+        b = Build(
+            tree=linux, targets=["config"], wrapper="timing,ccache", runtime="podman"
+        )
+        mocker.patch("tuxmake.runtime.ContainerRuntime.prepare")
+        mocker.patch("tuxmake.wrapper.Wrapper.prepare_runtime")
+        b.prepare()
+        timing_file = b.runtime.environment["TUXMAKE_TIMING_FILE"]
+        assert timing_file == f"{b.build_dir}/.tuxmake-timing"
+        assert b.makevars["CC"] == "/tuxmake/tuxmake-timing ccache gcc"
+
+
+class TestSharedCache:
+    @pytest.fixture(autouse=True)
+    def shared(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE", "true")
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE_DIR", str(tmp_path / "shared"))
+
+    def test_per_build_cache(self, linux, mocker):
+        mocker.patch("tuxmake.wrapper.Wrapper.prepare_runtime")
+        b = Build(tree=linux, targets=["config"], wrapper="ccache")
+        b.prepare()
+        assert b.runtime.environment["CCACHE_DIR"] == f"{b.build_dir}/.ccache"
+        assert (b.build_dir / ".ccache").exists()
+
+    def test_mounts_shared_dir(self, linux, mocker, tmp_path):
+        mocker.patch("tuxmake.runtime.ContainerRuntime.prepare")
+        mocker.patch("tuxmake.build.Build.prepare_wrapper")
+        b = Build(tree=linux, targets=["config"], wrapper="ccache", runtime="podman")
+        b.prepare()
+        shared_dir = str(tmp_path / "shared")
+        assert (shared_dir, shared_dir, False, False) in b.runtime.volumes
+
+    def test_evicts_on_cleanup(self, linux, mocker, tmp_path):
+        evict = mocker.patch("tuxmake.wrapper.evict")
+        mocker.patch("tuxmake.wrapper.Wrapper.prepare_runtime")
+        b = Build(tree=linux, targets=["config"], wrapper="ccache")
+        b.prepare()
+        b.cleanup()
+        evict.assert_called_with(tmp_path / "shared", 10 * 2**30)
+
+
+class TestDistributedWrapper:
+    @pytest.fixture(autouse=True)
+    def collect_metadata(self):
+        # these tests need the actual metadata
+        pass
+
+    @pytest.fixture(autouse=True)
+    def hosts(self, monkeypatch):
+        monkeypatch.setenv("DISTCC_HOSTS", "build1/16 build2/16 build3/16")
+        monkeypatch.setattr(defaults, "jobs", 4)
+
+    def test_jobs(self, linux):
+        assert Build(tree=linux, wrapper="distcc").jobs == 48
+
+    def test_explicit_jobs(self, linux):
+        assert Build(tree=linux, wrapper="distcc", jobs=8).jobs == 8
+
+    def test_more_local_cpus(self, linux, monkeypatch):
+        monkeypatch.setattr(defaults, "jobs", 64)
+        assert Build(tree=linux, wrapper="distcc").jobs == 64
+
+    def test_hosts_passed_to_container(self, linux, home, monkeypatch, mocker):
+        mocker.patch("tuxmake.runtime.DockerRuntime.prepare")
+        monkeypatch.delenv("DISTCC_HOSTS")
+        (home / ".distcc").mkdir(parents=True)
+        (home / ".distcc" / "hosts").write_text("build1/16\nbuild2/16\n")
+        build = Build(
+            tree=linux, targets=["config"], wrapper="distcc", runtime="docker"
+        )
+        build.prepare()
+        assert build.jobs == 32
+        assert build.runtime.environment["DISTCC_HOSTS"] == "build1/16 build2/16"
+
+    def test_not_offline(self, linux, mocker):
+        run_cmd = mocker.patch("tuxmake.runtime.Runtime.run_cmd", return_value=True)
+        build = Build(tree=linux, targets=["config"], wrapper="distcc")
+        build.run()
+        assert run_cmd.call_args[1]["offline"] is False
+
+    def test_metadata(self, linux, mocker):
+        mocker.patch("tuxmake.runtime.Runtime.run_cmd", return_value=True)
+        build = Build(tree=linux, targets=["config"], wrapper="distcc")
+        build.run()
+        assert build.metadata["distributed"] == {
+            "wrapper": "distcc",
+            "jobs": 48,
+            "hosts": [
+                {"host": "build1", "slots": 16},
+                {"host": "build2", "slots": 16},
+                {"host": "build3", "slots": 16},
+            ],
+            "slots": 48,
+            "local_fallbacks": 0,
+        }
+
+    def test_no_metadata_without_distributed_wrapper(self, linux, mocker):
+        mocker.patch("tuxmake.runtime.Runtime.run_cmd", return_value=True)
+        build = Build(tree=linux, targets=["config"])
+        build.run()
+        assert "distributed" not in build.metadata
+
+
+class TestTimingWrapper:
+    @pytest.fixture(autouse=True)
+    def collect_metadata(self):
+        # these tests need the actual metadata
+        pass
+
+    def test_metadata(self, linux):
+        build = Build(tree=linux, targets=["config", "kernel"], wrapper="timing")
+        build.run()
+        timing = build.metadata["timing"]
+        assert timing["invocations"] >= 1
+        files = [f["file"] for f in timing["slowest_files"]]
+        assert "vmlinux.o" in files
+        peak_rss = cache.get(peak_rss_key(build.toolchain, build.target_arch))
+        assert peak_rss == timing["peak_rss"]
+
+    def test_no_timing(self, linux):
+        build = Build(tree=linux, targets=["config"])
+        build.run()
+        assert "timing" not in build.metadata
+
+
+FAKE_CCACHE = """#!/bin/sh
+if [ "$1" = --print-stats ]; then
+  printf 'direct_cache_hit\\t%s\\ncache_miss\\t1\\n' $(wc -l < {calls})
+  exit
+fi
+echo "$@" >> {calls}
+exec "$@"
+"""
+
+
+class TestCacheStats:
+    @pytest.fixture(autouse=True)
+    def collect_metadata(self):
+        # these tests need the actual metadata
+        pass
+
+    @pytest.fixture
+    def ccache(self, tmp_path, monkeypatch):
+        bindir = tmp_path / "bin"
+        bindir.mkdir()
+        calls = tmp_path / "calls"
+        calls.touch()
+        ccache = bindir / "ccache"
+        ccache.write_text(FAKE_CCACHE.format(calls=calls))
+        ccache.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bindir}:{os.environ['PATH']}")
+        monkeypatch.setenv("CCACHE_DIR", str(tmp_path / "ccache"))
+        return ccache
+
+    def test_metadata(self, linux, ccache):
+        build = Build(tree=linux, targets=["config", "kernel"], wrapper="ccache")
+        build.run()
+        stats = build.metadata["ccache"]
+        assert stats["cache_hits"] > 0
+        assert stats["cache_misses"] == 0
+        targets = stats["targets"]
+        assert stats["cache_hits"] == sum(t["cache_hits"] for t in targets.values())
+        assert targets["default"]["cache_hits"] > 0
+        assert targets["kernel"]["cache_hits"] == 0
+
+    def test_skipped_targets(self, linux, ccache):
+        build = Build(
+            tree=linux,
+            targets=["config", "kernel"],
+            wrapper="ccache",
+            environment={"FAIL": "kernel"},
+            kconfig="tinyconfig",
+        )
+        build.fail_fast = True
+        build.run()
+        assert build.status["kernel"].skipped
+        assert list(build.metadata["ccache"]["targets"]) == ["config", "default"]
+
+    def test_no_stats(self, linux):
+        build = Build(tree=linux, targets=["config"])
+        build.run()
+        assert "ccache" not in build.metadata
+
 
 @pytest.mark.skipif(
     [int(n) for n in pytest.__version__.split(".")] < [3, 10], reason="old pytest"
@@ -948,6 +1351,60 @@ class TestPrepare:
         build.prepare()
         assert order == ["wrapper_host", "runtime", "wrapper_runtime"]
 
+    def test_prepare_downloads_while_preparing_runtime(self, linux, mocker):
+        downloading = threading.Event()
+        mocker.patch(
+            "tuxmake.runtime.NullRuntime.prepare",
+            side_effect=lambda: downloading.wait(5) or pytest.fail("no overlap"),
+        )
+        mocker.patch(
+            "tuxmake.target.Config.prefetch", side_effect=lambda: downloading.set()
+        )
+        build = Build(tree=linux, targets=["config"])
+        build.prepare()
+
+    def test_prepare_step_durations(self, linux, mocker):
+        mocker.patch("tuxmake.build.Build.prepare_korg_gcc_toolchain")
+        mocker.patch("tuxmake.build.Build.download_korg_gcc_toolchain")
+        build = Build(tree=linux, targets=["config"], toolchain="korg-gcc")
+        build.prepare()
+        durations = build.__durations__
+        for step in [
+            "target_files",
+            "kconfig",
+            "runtime",
+            "wrapper",
+            "korg_gcc_download",
+            "korg_gcc",
+        ]:
+            assert f"prepare_{step}" in durations
+
+    def test_prepare_downloads_korg_gcc_while_preparing_runtime(self, linux, mocker):
+        downloading = threading.Event()
+        mocker.patch(
+            "tuxmake.runtime.NullRuntime.prepare",
+            side_effect=lambda: downloading.wait(5) or pytest.fail("no overlap"),
+        )
+        mocker.patch(
+            "tuxmake.build.Build.download_korg_gcc_toolchain",
+            side_effect=lambda: downloading.set(),
+        )
+        prepare = mocker.patch("tuxmake.build.Build.prepare_korg_gcc_toolchain")
+        build = Build(tree=linux, targets=["config"], toolchain="korg-gcc")
+        build.prepare()
+        prepare.assert_called_once()
+
+    def test_prepare_records_durations_on_failure(self, linux, mocker):
+        mocker.patch(
+            "tuxmake.runtime.NullRuntime.prepare", side_effect=RuntimeError("FAIL")
+        )
+        build = Build(tree=linux, targets=["config"])
+        with pytest.raises(RuntimeError):
+            build.prepare()
+        durations = build.__durations__
+        assert "prepare_runtime" in durations
+        assert "prepare_wrapper" not in durations
+
 
 class TestMissingArtifacts:
     def test_missing_kernel(self, linux_rw, mocker):
@@ -1033,7 +1490,7 @@ class TestCheckEnvironment:
     def test_basics(self, linux, get_command_output, run_cmd):
         build = Build(tree=linux, target_arch="arm64")
         ccc = "arm-linux-gnu-"
-        get_command_output.return_value = ccc
+        get_command_output.return_value = f"CROSS_COMPILE_COMPAT\0{ccc}\0"
         build.check_environment()
         cmdline = args(run_cmd)
         assert cmdline[0].endswith("/tuxmake-check-environment")
@@ -1043,7 +1500,7 @@ class TestCheckEnvironment:
 
     def test_CROSS_COMPILE_COMPAT_not_found(self, linux, run_cmd, get_command_output):
         build = Build(tree=linux, target_arch="arm64")
-        get_command_output.return_value = ""
+        get_command_output.return_value = "CROSS_COMPILE_COMPAT\0\0"
         build.check_environment()
         assert args(run_cmd)[3] == ""
 
@@ -1167,6 +1624,60 @@ class TestCustomCrossCompile:
         assert "CROSS_COMPILE_COMPAT=foo-" in args(Popen)
 
 
+class TestDynamicMakeVariables:
+    @pytest.fixture
+    def get_command_output(self, mocker):
+        return mocker.patch(
+            "tuxmake.build.Build.get_command_output",
+            return_value="CROSS_COMPILE_COMPAT\0arm-linux-gnueabihf-\0",
+        )
+
+    @pytest.fixture
+    def get_image_id(self, mocker):
+        return mocker.patch(
+            "tuxmake.runtime.Runtime.get_image_id", return_value="sha256:0123"
+        )
+
+    def test_single_command(self, linux, get_command_output):
+        build = Build(tree=linux, target_arch="arm64")
+        build.dynamic_make_variables["FOO"] = "echo foo"
+        build.get_dynamic_makevars()
+        assert get_command_output.call_count == 1
+        script = get_command_output.call_args[0][0]
+        assert "CROSS_COMPILE_COMPAT" in script
+        assert "$(echo foo)" in script
+        assert build.make_variables["CROSS_COMPILE_COMPAT"] == "arm-linux-gnueabihf-"
+        assert build.make_variables["FOO"] == ""
+
+    def test_real_probe(self, linux):
+        build = Build(tree=linux, target_arch="arm64")
+        build.dynamic_make_variables = {"FOO": "echo foo", "BAR": "echo ' bar '"}
+        build.get_dynamic_makevars()
+        assert build.make_variables["FOO"] == "foo"
+        assert build.make_variables["BAR"] == "bar"
+
+    def test_nothing_to_probe(self, linux, get_command_output):
+        build = Build(tree=linux)
+        build.get_dynamic_makevars()
+        get_command_output.assert_not_called()
+
+    def test_no_cache_without_image_id(self, linux, get_command_output):
+        Build(tree=linux, target_arch="arm64").get_dynamic_makevars()
+        Build(tree=linux, target_arch="arm64").get_dynamic_makevars()
+        assert get_command_output.call_count == 2
+
+    def test_cached_per_image(self, linux, get_command_output, get_image_id):
+        Build(tree=linux, target_arch="arm64").get_dynamic_makevars()
+        build = Build(tree=linux, target_arch="arm64")
+        build.get_dynamic_makevars()
+        assert get_command_output.call_count == 1
+        assert build.make_variables["CROSS_COMPILE_COMPAT"] == "arm-linux-gnueabihf-"
+
+        get_image_id.return_value = "sha256:4567"
+        Build(tree=linux, target_arch="arm64").get_dynamic_makevars()
+        assert get_command_output.call_count == 2
+
+
 class TestBinDebPkg:
     def test_bindeb_pkg(self, linux):
         build = Build(tree=linux, targets=["bindeb-pkg"])
@@ -1255,6 +1766,7 @@ class TestKorgGCC:
 
     def test_prepare_korg_gcc_toolchain_called(self, mocker, linux):
         mocker.patch("tuxmake.build.Build.prepare_korg_gcc_toolchain")
+        mocker.patch("tuxmake.build.Build.download_korg_gcc_toolchain")
         b = Build(tree=linux, toolchain="korg-gcc", target_arch="arm64")
         b.run()
         assert b.prepare_korg_gcc_toolchain.call_count == 1
@@ -1298,6 +1810,43 @@ class TestKorgGCC:
         assert b.korg_toolchains_dir == tmp_path
 
 
+class TestKorgGccDownload:
+    @pytest.fixture
+    def build(self, linux, tmp_path, mocker):
+        mocker.patch(
+            "tuxmake.runtime.Runtime.get_toolchain_full_version", return_value="14.2.0"
+        )
+        return Build(
+            tree=linux,
+            toolchain="korg-gcc",
+            target_arch="arm64",
+            korg_toolchains_dir=tmp_path / "korg",
+        )
+
+    def test_downloads_archive_and_signature(self, build, download_file, tmp_path):
+        build.download_korg_gcc_toolchain()
+        host = native_arch.name
+        name = f"{host}-gcc-14.2.0-nolibc-aarch64-linux"
+        url = f"https://mirrors.edge.kernel.org/pub/tools/crosstool/files/bin/{host}/14.2.0/{name}"
+        korg = tmp_path / "korg"
+        assert [c[0] for c in download_file.call_args_list] == [
+            (f"{url}.tar.gz", korg / f"{name}.tar.gz"),
+            (f"{url}.tar.sign", korg / "signatures" / f"{name}.tar.sign"),
+        ]
+
+    def test_skips_existing_files(self, build, download_file, tmp_path):
+        name = f"{native_arch.name}-gcc-14.2.0-nolibc-aarch64-linux"
+        (build.korg_toolchains_dir / f"{name}.tar.gz").write_bytes(b"")
+        build.download_korg_gcc_toolchain()
+        assert download_file.call_count == 1
+        assert download_file.call_args[0][1].name == f"{name}.tar.sign"
+
+    def test_failure_is_left_to_the_container(self, build, download_file):
+        download_file.side_effect = OSError("network unreachable")
+        build.download_korg_gcc_toolchain()
+        assert download_file.call_count == 1
+
+
 class TestKorgGccDownloadAll:
     @pytest.fixture
     def get_command_output(self, mocker):
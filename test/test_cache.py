@@ -1,3 +1,4 @@
+from concurrent import futures
 from tuxmake import cache
 
 
@@ -12,3 +13,11 @@ class TestCache:
     def test_composite_key(self):
         cache.set(["foo", "bar"], "baz")
         assert cache.get(["foo", "bar"]) == "baz"
+
+    def test_concurrent_access(self):
+        def work(i):
+            cache.set(["key", str(i)], i)
+            return cache.get(["key", str(i)])
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(work, range(50))) == list(range(50))
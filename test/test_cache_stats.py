@@ -0,0 +1,150 @@
+import json
+
+import pytest
+
+from tuxmake.cache_stats import CacheStats
+from tuxmake.cache_stats import diff
+from tuxmake.cache_stats import parse_ccache
+from tuxmake.cache_stats import parse_sccache
+from tuxmake.wrapper import Wrapper
+
+
+def ccache_output(hits=0, misses=0, uncacheable=0, size=0):
+    return (
+        "stats_updated_timestamp\t1700000000\n"
+        f"direct_cache_hit\t{hits}\n"
+        "preprocessed_cache_hit\t1\n"
+        f"cache_miss\t{misses}\n"
+        f"called_for_link\t{uncacheable}\n"
+        "compile_failed\t3\n"
+        f"cache_size_kibibyte\t{size}\n"
+    )
+
+
+def sccache_output(hits=0, misses=0, size=0):
+    return json.dumps(
+        {
+            "stats": {
+                "cache_hits": {"counts": {"C/C++": hits, "Rust": 1}},
+                "cache_misses": {"counts": {"C/C++": misses}},
+                "non_cacheable_compilations": 2,
+                "non_cacheable_calls": 5,
+            },
+            "cache_size": size,
+        }
+    )
+
+
+class TestParseCcache:
+    def test_basics(self):
+        assert parse_ccache(ccache_output(10, 5, 2, 4)) == {
+            "cache_hits": 11,
+            "cache_misses": 5,
+            "uncacheable": 2,
+            "cache_size": 4096,
+        }
+
+    def test_unsupported(self):
+        assert parse_ccache("ccache: invalid option -- 'print-stats'") is None
+
+    def test_empty(self):
+        assert parse_ccache("") is None
+
+
+class TestParseSccache:
+    def test_basics(self):
+        assert parse_sccache(sccache_output(10, 5, 1024)) == {
+            "cache_hits": 11,
+            "cache_misses": 5,
+            "uncacheable": 7,
+            "cache_size": 1024,
+        }
+
+    def test_no_counts(self):
+        output = json.dumps({"stats": {"cache_hits": {"counts": {}}}})
+        assert parse_sccache(output) == {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "uncacheable": 0,
+            "cache_size": 0,
+        }
+
+    @pytest.mark.parametrize("output", ["", "not json", "[]", "{}"])
+    def test_invalid(self, output):
+        assert parse_sccache(output) is None
+
+
+class TestDiff:
+    def test_basics(self):
+        before = parse_ccache(ccache_output(10, 5, 2, 4))
+        after = parse_ccache(ccache_output(13, 6, 2, 8))
+        assert diff(after, before) == {
+            "cache_hits": 3,
+            "cache_misses": 1,
+            "uncacheable": 0,
+            "cache_size_delta": 4096,
+            "hit_rate": 0.75,
+        }
+
+    def test_no_lookups(self):
+        stats = parse_ccache(ccache_output())
+        assert diff(stats, stats)["hit_rate"] is None
+
+
+class FakeBuild:
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.commands = []
+
+    def get_command_output(self, cmd):
+        self.commands.append(cmd)
+        return self.outputs.pop(0)
+
+
+class TestCacheStats:
+    def test_create(self):
+        stats = CacheStats.create(Wrapper("ccache"))
+        assert stats.name == "ccache"
+        assert stats.command.startswith("ccache --print-stats")
+        assert stats.parser is parse_ccache
+
+    def test_create_without_stats(self):
+        assert CacheStats.create(Wrapper("timing")) is None
+
+    def test_per_target(self):
+        stats = CacheStats.create(Wrapper("ccache"))
+        build = FakeBuild(
+            ccache_output(100, 50),
+            ccache_output(100, 60, size=10),
+            ccache_output(130, 60, size=10),
+        )
+        stats.start(build)
+        stats.record(build, "kernel")
+        stats.record(build, "modules")
+        metadata = stats.get_metadata()
+        assert metadata["cache_hits"] == 30
+        assert metadata["cache_misses"] == 10
+        assert metadata["cache_size_delta"] == 10240
+        assert metadata["hit_rate"] == 0.75
+        assert metadata["targets"]["kernel"]["cache_misses"] == 10
+        assert metadata["targets"]["kernel"]["cache_hits"] == 0
+        assert metadata["targets"]["modules"]["cache_hits"] == 30
+        assert build.commands == [stats.command] * 3
+
+    def test_not_supported(self):
+        stats = CacheStats.create(Wrapper("ccache"))
+        build = FakeBuild("")
+        stats.start(build)
+        stats.record(build, "kernel")
+        assert stats.get_metadata() is None
+        assert len(build.commands) == 1
+
+    def test_snapshot_failure_during_build(self):
+        stats = CacheStats.create(Wrapper("sccache"))
+        build = FakeBuild(sccache_output(1, 1), "", sccache_output(2, 1))
+        stats.start(build)
+        stats.record(build, "config")
+        stats.record(build, "kernel")
+        metadata = stats.get_metadata()
+        assert list(metadata["targets"]) == ["kernel"]
+        assert metadata["targets"]["kernel"]["cache_hits"] == 1
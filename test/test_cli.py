@@ -122,6 +122,16 @@ class TestJobs:
         tuxmake("--jobs=300")
         assert args(builder).jobs == 300
 
+    def test_jobs_auto(self, builder):
+        tuxmake("--jobs=auto:mem-per-job=2G")
+        assert args(builder).jobs == "auto:mem-per-job=2G"
+
+    def test_jobs_invalid(self, builder, capsys):
+        with pytest.raises(SystemExit):
+            tuxmake("--jobs=lots")
+        _, err = capsys.readouterr()
+        assert "invalid number of jobs" in err
+
 
 class TestRuntime:
     def test_docker(self, builder):
@@ -335,6 +345,10 @@ class TestBuildDir:
         tuxmake("--build-dir=/path/to/build")
         assert args(builder).build_dir == Path("/path/to/build")
 
+    def test_build_dir_backend(self, builder):
+        tuxmake("--build-dir-backend=tmpfs")
+        assert args(builder).build_dir_backend == "tmpfs"
+
 
 class TestOptionsFromEnvironment:
     def test_options_from_environment(self, builder, monkeypatch):
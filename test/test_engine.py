@@ -0,0 +1,217 @@
+import io
+import socket
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import pytest
+
+from tuxmake.engine import EngineClient
+from tuxmake.engine import EngineError
+from tuxmake.engine import LineDecoder
+from tuxmake.engine import get_socket_path
+from tuxmake.engine import split_image_name
+
+
+class TestGetSocketPath:
+    def test_docker_default(self, monkeypatch):
+        monkeypatch.delenv("DOCKER_HOST", raising=False)
+        assert str(get_socket_path("docker")) == "/var/run/docker.sock"
+
+    def test_docker_host(self, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "unix:///path/to/docker.sock")
+        assert str(get_socket_path("docker")) == "/path/to/docker.sock"
+
+    def test_docker_host_tcp(self, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "tcp://127.0.0.1:2375")
+        assert get_socket_path("docker") is None
+
+    def test_podman_rootless(self, monkeypatch, mocker):
+        monkeypatch.delenv("CONTAINER_HOST", raising=False)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+        mocker.patch("os.getuid", return_value=1000)
+        assert str(get_socket_path("podman")) == "/run/user/1000/podman/podman.sock"
+
+    def test_podman_root(self, monkeypatch, mocker):
+        monkeypatch.delenv("CONTAINER_HOST", raising=False)
+        mocker.patch("os.getuid", return_value=0)
+        assert str(get_socket_path("podman")) == "/run/podman/podman.sock"
+
+    def test_container_host(self, monkeypatch):
+        monkeypatch.setenv("CONTAINER_HOST", "unix:///path/to/podman.sock")
+        assert str(get_socket_path("podman")) == "/path/to/podman.sock"
+
+
+class TestSplitImageName:
+    def test_no_tag(self):
+        assert split_image_name("tuxmake/gcc") == ("tuxmake/gcc", "latest")
+
+    def test_tag(self):
+        assert split_image_name("tuxmake/gcc:10") == ("tuxmake/gcc", "10")
+
+    def test_registry_with_port(self):
+        assert split_image_name("localhost:5000/gcc") == (
+            "localhost:5000/gcc",
+            "latest",
+        )
+
+    def test_digest(self):
+        assert split_image_name("tuxmake/gcc@sha256:0123") == (
+            "tuxmake/gcc",
+            "sha256:0123",
+        )
+
+
+@pytest.fixture
+def client(fake_engine):
+    client = EngineClient.connect("docker")
+    yield client
+    client.close()
+
+
+class TestEngineClient:
+    def test_connect(self, client):
+        assert client
+
+    def test_connect_no_socket(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/missing.sock")
+        assert EngineClient.connect("docker") is None
+
+    def test_connect_not_an_engine(self, monkeypatch, tmp_path):
+        path = tmp_path / "broken.sock"
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(path))
+        monkeypatch.setenv("DOCKER_HOST", f"unix://{path}")
+        try:
+            assert EngineClient.connect("docker") is None
+        finally:
+            sock.close()
+
+    def test_persistent_connection(self, client, fake_engine):
+        [connection] = client.connections
+        sock = connection.sock
+        client.version()
+        client.inspect_image("tuxmake/x86_64_gcc")
+        assert client.connections == [connection]
+        assert connection.sock is sock
+
+    def test_reconnect(self, client):
+        client.connections[0].sock.close()
+        assert client.version()["Version"] == "20.10.5"
+
+    def test_concurrent_requests(self, client, fake_engine):
+        def run(n):
+            output = []
+            exec_id = client.create_exec("mycontainer", ["echo", str(n)])
+            assert client.start_exec(exec_id, lambda s, d: output.append(d)) == 0
+            return b"".join(output)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(run, range(8)))
+        assert results == [f"{n}\n".encode() for n in range(8)]
+        assert 1 <= len(client.connections) <= 4
+
+    def test_close(self, client):
+        [connection] = client.connections
+        client.close()
+        assert client.connections == []
+        assert connection.sock is None
+
+    def test_inspect_image(self, client):
+        image = client.inspect_image("tuxmake/x86_64_gcc")
+        assert image["Id"] == "sha256:0123456789abcdef"
+
+    def test_inspect_missing_image(self, client):
+        with pytest.raises(EngineError) as exc:
+            client.inspect_image("tuxmake/missing")
+        assert "No such image" in str(exc.value)
+
+    def test_pull(self, client, fake_engine):
+        client.pull("tuxmake/x86_64_gcc")
+        assert fake_engine.pulled == ["tuxmake/x86_64_gcc:latest"]
+
+    def test_pull_ignores_garbage(self, client, mocker):
+        mocker.patch.object(
+            client, "request", return_value=b'garbage\n{"status": "done"}\n'
+        )
+        client.pull("tuxmake/x86_64_gcc")
+
+    def test_pull_error(self, client):
+        with pytest.raises(EngineError) as exc:
+            client.pull("invalid/image")
+        assert "manifest unknown" in str(exc.value)
+
+    def test_exec(self, client):
+        output = []
+        exec_id = client.create_exec("mycontainer", ["sh", "-c", "echo out; exit 3"])
+        exit_code = client.start_exec(exec_id, lambda s, d: output.append((s, d)))
+        assert exit_code == 3
+        assert output == [(1, b"out\n")]
+
+    def test_exec_stderr(self, client):
+        output = []
+        exec_id = client.create_exec("mycontainer", ["sh", "-c", "echo err >&2"])
+        assert client.start_exec(exec_id, lambda s, d: output.append((s, d))) == 0
+        assert output == [(2, b"err\n")]
+
+    def test_exec_missing_container(self, client):
+        with pytest.raises(EngineError):
+            client.create_exec("missing", ["true"])
+
+    def test_start_missing_exec(self, client, fake_engine, mocker):
+        mocker.patch.object(fake_engine, "execs", {})
+        with pytest.raises(EngineError) as exc:
+            client.start_exec("exec0", lambda s, d: None)
+        assert "No such exec instance" in str(exc.value)
+
+    def test_start_exec_connection_error(self, client, tmp_path):
+        exec_id = client.create_exec("mycontainer", ["true"])
+        client.socket_path = tmp_path / "gone.sock"
+        with pytest.raises(EngineError):
+            client.start_exec(exec_id, lambda s, d: None)
+
+    def test_stop(self, client, fake_engine):
+        client.stop("mycontainer")
+        assert fake_engine.stopped == ["mycontainer"]
+
+    def test_invalid_json(self, client, mocker):
+        mocker.patch.object(client, "request", return_value=b"not json")
+        with pytest.raises(EngineError):
+            client.version()
+
+    def test_error_message_not_json(self):
+        assert EngineClient.get_message(b"oops\n") == "oops"
+
+
+class TestDemultiplex:
+    def frame(self, stream, data):
+        return struct.pack(">B3xI", stream, len(data)) + data
+
+    def test_frames(self):
+        output = []
+        stream = io.BytesIO(self.frame(1, b"foo") + self.frame(2, b"bar"))
+        EngineClient.demultiplex(stream, lambda s, d: output.append((s, d)))
+        assert output == [(1, b"foo"), (2, b"bar")]
+
+    def test_truncated(self):
+        output = []
+        stream = io.BytesIO(self.frame(1, b"foobar")[:-3])
+        EngineClient.demultiplex(stream, lambda s, d: output.append((s, d)))
+        assert output == [(1, b"foo")]
+
+
+class TestLineDecoder:
+    def test_lines(self):
+        lines = []
+        decoder = LineDecoder(lines.append)
+        decoder.feed(b"foo\nb")
+        decoder.feed(b"ar\r\nbaz")
+        decoder.close()
+        assert lines == ["foo\n", "bar\n", "baz"]
+
+    def test_split_utf8(self):
+        lines = []
+        decoder = LineDecoder(lines.append)
+        data = "ç\n".encode("utf-8")
+        decoder.feed(data[:1])
+        decoder.feed(data[1:])
+        decoder.close()
+        assert lines == ["ç\n"]
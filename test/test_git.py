@@ -0,0 +1,149 @@
+import mmap
+import os
+import struct
+import subprocess
+import pytest
+
+from tuxmake import git
+
+
+def run(repo, *args, **kwargs):
+    return subprocess.check_output(
+        ["git", *args], cwd=repo, encoding="utf-8", **kwargs
+    ).strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    run(repo, "init", "--quiet")
+    run(repo, "config", "user.name", "Foo Bar")
+    run(repo, "config", "user.email", "foo@bar.com")
+    env = dict(os.environ)
+    for i, date in enumerate(["2021-05-13 12:00 -0300", "2021-05-14 12:00 -0300"]):
+        (repo / "README.md").write_text(f"HELLO WORLD {i}")
+        run(repo, "add", "README.md")
+        env["GIT_COMMITTER_DATE"] = date
+        run(repo, "commit", "--quiet", f"--message=commit {i}", env=env)
+    return repo
+
+
+class TestResolveRef:
+    def test_head(self, repo):
+        gitdir = git.find_git_dir(repo)
+        assert git.resolve_ref(gitdir) == run(repo, "rev-parse", "HEAD")
+
+    def test_detached_head(self, repo):
+        run(repo, "checkout", "--quiet", "HEAD~1")
+        gitdir = git.find_git_dir(repo)
+        assert git.resolve_ref(gitdir) == run(repo, "rev-parse", "HEAD")
+
+    def test_packed_refs(self, repo):
+        run(repo, "pack-refs", "--all")
+        gitdir = git.find_git_dir(repo)
+        assert git.resolve_ref(gitdir) == run(repo, "rev-parse", "HEAD")
+
+    def test_missing_ref(self, repo):
+        gitdir = git.find_git_dir(repo)
+        assert git.resolve_ref(gitdir, "refs/heads/missing") is None
+
+    def test_symbolic_ref_loop(self, repo):
+        gitdir = git.find_git_dir(repo)
+        (gitdir / "refs/heads/loop").write_text("ref: refs/heads/loop\n")
+        assert git.resolve_ref(gitdir, "refs/heads/loop") is None
+
+    def test_worktree(self, repo, tmp_path):
+        worktree = tmp_path / "worktree"
+        run(repo, "worktree", "add", "--quiet", "--detach", str(worktree), "HEAD~1")
+        gitdir = git.find_git_dir(worktree)
+        assert git.resolve_ref(gitdir) == run(worktree, "rev-parse", "HEAD")
+
+
+class TestFindGitDir:
+    def test_not_a_repository(self, tmp_path):
+        assert git.find_git_dir(tmp_path) is None
+
+    def test_invalid_gitfile(self, tmp_path):
+        (tmp_path / ".git").write_text("garbage")
+        assert git.find_git_dir(tmp_path) is None
+
+
+class TestReadCommit:
+    def test_loose(self, repo):
+        gitdir = git.find_git_dir(repo)
+        head = git.resolve_ref(gitdir)
+        commit = git.read_commit(gitdir, head)
+        assert commit["tree"] == run(repo, "rev-parse", "HEAD^{tree}")
+        assert git.get_commit_timestamp(gitdir, head) == "1621004400"
+
+    def test_packed(self, repo):
+        run(repo, "gc", "--quiet")
+        gitdir = git.find_git_dir(repo)
+        assert not list((gitdir / "objects").glob("??/*"))
+        head = git.resolve_ref(gitdir)
+        assert git.get_commit_timestamp(gitdir, head) == "1621004400"
+        parent = run(repo, "rev-parse", "HEAD~1")
+        assert git.get_commit_timestamp(gitdir, parent) == "1620918000"
+
+    def test_many_objects(self, repo):
+        for i in range(300):
+            (repo / f"file{i}").write_text(f"{i}\n")
+        run(repo, "add", ".")
+        run(repo, "commit", "--quiet", "--message=many files")
+        run(repo, "gc", "--quiet")
+        gitdir = git.find_git_dir(repo)
+        for line in run(repo, "rev-list", "--objects", "--all").splitlines():
+            sha = line.split()[0]
+            assert git.read_object(gitdir, sha)[0] == run(repo, "cat-file", "-t", sha)
+
+    def test_missing_object(self, repo):
+        run(repo, "gc", "--quiet")
+        gitdir = git.find_git_dir(repo)
+        assert git.read_commit(gitdir, "0" * 40) is None
+        assert git.read_commit(gitdir, "f" * 40) is None
+
+    def test_not_a_commit(self, repo):
+        gitdir = git.find_git_dir(repo)
+        tree = run(repo, "rev-parse", "HEAD^{tree}")
+        assert git.read_commit(gitdir, tree) is None
+        assert git.get_commit_timestamp(gitdir, tree) is None
+
+    def test_deltified_object(self, repo, mocker):
+        run(repo, "gc", "--quiet")
+        gitdir = git.find_git_dir(repo)
+        mocker.patch("tuxmake.git.OBJECT_TYPES", {})
+        assert git.read_commit(gitdir, git.resolve_ref(gitdir)) is None
+
+    def test_truncated_pack(self, repo):
+        run(repo, "gc", "--quiet")
+        gitdir = git.find_git_dir(repo)
+        head = git.resolve_ref(gitdir)
+        idx = next((gitdir / "objects/pack").glob("*.idx"))
+        pack = idx.with_suffix(".pack")
+        with idx.open("rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                offset = git.find_in_pack_index(m, head)
+        os.chmod(pack, 0o644)
+        with pack.open("r+b") as f:
+            f.truncate(offset + 4)
+        assert git.read_commit(gitdir, head) is None
+
+
+class TestFindInPackIndex:
+    def test_unsupported_version(self):
+        assert git.find_in_pack_index(b"\377tOc\0\0\0\3", "0" * 40) is None
+
+    def test_large_offsets(self):
+        sha = bytes.fromhex("ab" * 20)
+        fanout = b"".join(struct.pack(">I", 0 if i < 0xAB else 1) for i in range(256))
+        idx = (
+            b"\377tOc"
+            + struct.pack(">I", 2)
+            + fanout
+            + sha
+            + b"\0" * 4
+            + struct.pack(">I", 0x80000000)
+            + struct.pack(">Q", 2**33)
+        )
+        assert git.find_in_pack_index(idx, "ab" * 20) == 2**33
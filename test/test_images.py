@@ -0,0 +1,232 @@
+import subprocess
+import pytest
+
+from tuxmake.arch import Architecture
+from tuxmake.cli import main as tuxmake
+from tuxmake.images import PullResult
+from tuxmake.images import format_size
+from tuxmake.images import get_images
+from tuxmake.images import pull_images
+from tuxmake.images import schedule
+from tuxmake.runtime import DockerRuntime
+from tuxmake.toolchain import Toolchain
+
+
+@pytest.fixture(autouse=True)
+def version_check(mocker):
+    return mocker.patch("tuxmake.images.get_command_version")
+
+
+@pytest.fixture(autouse=True)
+def native(mocker):
+    mocker.patch("tuxmake.images.native_arch", Architecture("x86_64"))
+    mocker.patch("tuxmake.runtime.native_arch", Architecture("x86_64"))
+
+
+@pytest.fixture
+def check_call(mocker):
+    return mocker.patch("subprocess.check_call")
+
+
+@pytest.fixture(autouse=True)
+def image_size(mocker):
+    return mocker.patch(
+        "tuxmake.runtime.ContainerRuntime.get_image_size", return_value=3 * 2**30
+    )
+
+
+def pulled(check_call):
+    return [c[0][0][-1] for c in check_call.call_args_list]
+
+
+class TestGetImages:
+    def test_resolve_like_builds(self):
+        images = get_images(
+            DockerRuntime(),
+            [Architecture("x86_64"), Architecture("arm64")],
+            [Toolchain("gcc-12")],
+        )
+        assert images == [
+            "docker.io/tuxmake/x86_64_gcc-12",
+            "docker.io/tuxmake/arm64_gcc-12",
+        ]
+
+    def test_dedupe(self):
+        images = get_images(
+            DockerRuntime(),
+            [Architecture("x86_64"), Architecture("arm64")],
+            [Toolchain("clang-16")],
+        )
+        assert len(images) == len(set(images))
+
+    def test_registry_and_tag(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_IMAGE_REGISTRY", "myregistry.com")
+        monkeypatch.setenv("TUXMAKE_IMAGE_TAG", "20230101")
+        images = get_images(
+            DockerRuntime(), [Architecture("x86_64")], [Toolchain("gcc-12")]
+        )
+        assert images == ["myregistry.com/tuxmake/x86_64_gcc-12:20230101"]
+
+    def test_unsupported_combination(self):
+        runtime = DockerRuntime()
+        assert get_images(runtime, [Architecture("x86_64")], [Toolchain("gcc-1")]) == []
+
+
+class TestSchedule:
+    def test_one_image_per_base_first(self):
+        runtime = DockerRuntime()
+        images = [
+            "docker.io/tuxmake/x86_64_gcc-12",
+            "docker.io/tuxmake/arm64_gcc-12",
+            "docker.io/tuxmake/x86_64_gcc-11",
+            "docker.io/tuxmake/arm64_gcc-11",
+        ]
+        first, rest = schedule(runtime, images)
+        bases = {runtime.toolchain_images_map[i[10:]].base for i in first}
+        assert len(bases) == len(first)
+        assert sorted(first + rest) == sorted(images)
+
+    def test_unknown_images(self):
+        first, rest = schedule(DockerRuntime(), ["foo/bar", "foo/baz:1"])
+        assert first == ["foo/bar", "foo/baz:1"]
+        assert rest == []
+
+
+class TestPullImages:
+    def test_pull(self, check_call):
+        images = ["docker.io/tuxmake/x86_64_gcc-12", "docker.io/tuxmake/x86_64_gcc-11"]
+        results = pull_images(DockerRuntime(), images, jobs=2)
+        assert sorted(pulled(check_call)) == sorted(images)
+        assert all(r.status == "pulled" for r in results)
+        assert all("--quiet" in c[0][0] for c in check_call.call_args_list)
+
+    def test_records_freshness(self, check_call):
+        runtime = DockerRuntime()
+        pull_images(runtime, ["docker.io/tuxmake/x86_64_gcc-12"])
+        assert runtime.pulled_recently("docker.io/tuxmake/x86_64_gcc-12")
+        results = pull_images(runtime, ["docker.io/tuxmake/x86_64_gcc-12"])
+        assert results[0].status == "up-to-date"
+        assert check_call.call_count == 1
+
+    def test_force(self, check_call):
+        runtime = DockerRuntime()
+        pull_images(runtime, ["docker.io/tuxmake/x86_64_gcc-12"])
+        pull_images(runtime, ["docker.io/tuxmake/x86_64_gcc-12"], force=True)
+        assert check_call.call_count == 2
+
+    def test_failure(self, check_call, mocker):
+        mocker.patch("tuxmake.utils.time.sleep")
+        check_call.side_effect = subprocess.CalledProcessError(1, ["docker"])
+        results = pull_images(DockerRuntime(), ["docker.io/tuxmake/x86_64_gcc-12"])
+        assert results[0].status == "fail"
+
+    def test_runtime_missing(self, check_call):
+        check_call.side_effect = FileNotFoundError("docker")
+        results = pull_images(DockerRuntime(), ["docker.io/tuxmake/x86_64_gcc-12"])
+        assert results[0].status == "fail"
+
+    def test_programming_errors_are_not_hidden(self, check_call):
+        check_call.side_effect = TypeError("oops")
+        with pytest.raises(TypeError):
+            pull_images(DockerRuntime(), ["docker.io/tuxmake/x86_64_gcc-12"])
+
+    def test_pull_via_engine_api(self, fake_engine):
+        fake_engine.images = {}
+        images = [f"tuxmake/x86_64_gcc-{v}" for v in range(8, 14)]
+        results = pull_images(DockerRuntime(), images, jobs=4)
+        assert [r.status for r in results] == ["pulled"] * len(images)
+        assert sorted(fake_engine.pulled) == sorted(f"{i}:latest" for i in images)
+
+    def test_unknown_size(self, check_call, image_size):
+        image_size.side_effect = subprocess.CalledProcessError(1, ["docker"])
+        results = pull_images(DockerRuntime(), ["docker.io/tuxmake/x86_64_gcc-12"])
+        assert results[0].image_size is None
+        assert "unknown size" in str(results[0])
+
+
+class TestPullResult:
+    def test_str(self):
+        assert str(PullResult("foo", "pulled", 62, 2**20)) == (
+            "foo: pulled in 0:01:02 (image size: 1.0 MiB)"
+        )
+        assert str(PullResult("foo", "up-to-date")) == "foo: up to date"
+        assert str(PullResult("foo", "fail", error="boom")) == "foo: failed (boom)"
+
+    def test_format_size(self):
+        assert format_size(100) == "100 B"
+        assert format_size(1536) == "1.5 KiB"
+        assert format_size(5 * 2**40) == "5120.0 GiB"
+
+
+class TestCommandLine:
+    def test_pull(self, check_call, capsys):
+        tuxmake("images", "pull", "--target-arch=arm64,x86_64", "--toolchain=gcc-12")
+        assert sorted(pulled(check_call)) == [
+            "docker.io/tuxmake/arm64_gcc-12",
+            "docker.io/tuxmake/x86_64_gcc-12",
+        ]
+        _, stderr = capsys.readouterr()
+        assert "docker.io/tuxmake/arm64_gcc-12: pulled in" in stderr
+        assert "(image size: 3.0 GiB)" in stderr
+        assert (
+            "2 image(s) pulled (image size: 6.0 GiB), 0 up to date, 0 failed" in stderr
+        )
+
+    def test_defaults(self, check_call):
+        tuxmake("images", "pull")
+        assert pulled(check_call) == ["docker.io/tuxmake/x86_64_gcc"]
+
+    def test_podman(self, check_call):
+        tuxmake("images", "pull", "--runtime=podman", "-t", "gcc-12")
+        assert check_call.call_args[0][0][0] == "podman"
+
+    def test_all(self, check_call):
+        tuxmake("images", "pull", "--all", "--quiet")
+        runtime = DockerRuntime()
+        assert len(pulled(check_call)) > len(runtime.toolchains)
+
+    def test_failure(self, check_call, mocker, capsys):
+        mocker.patch("tuxmake.utils.time.sleep")
+        check_call.side_effect = subprocess.CalledProcessError(1, ["docker"])
+        with pytest.raises(SystemExit) as exit:
+            tuxmake("images", "pull")
+        assert exit.value.code == 2
+        _, stderr = capsys.readouterr()
+        assert "E: docker.io/tuxmake/x86_64_gcc: failed" in stderr
+
+    def test_jobs(self, check_call, mocker):
+        pull = mocker.patch("tuxmake.images.pull_images", return_value=[])
+        tuxmake("images", "pull", "--jobs=2")
+        assert pull.call_args[1]["jobs"] == 2
+
+    @pytest.mark.parametrize("jobs", ["0", "-1", "x"])
+    def test_invalid_jobs(self, check_call, capsys, jobs):
+        with pytest.raises(SystemExit) as exit:
+            tuxmake("images", "pull", f"--jobs={jobs}")
+        assert exit.value.code == 2
+        _, stderr = capsys.readouterr()
+        assert f"invalid positive integer: {jobs}" in stderr
+        check_call.assert_not_called()
+
+    def test_no_subcommand(self, capsys):
+        with pytest.raises(SystemExit) as exit:
+            tuxmake("images")
+        assert exit.value.code == 1
+
+    def test_null_runtime(self, capsys):
+        with pytest.raises(SystemExit) as exit:
+            tuxmake("images", "pull", "--runtime=null")
+        assert exit.value.code == 1
+        _, stderr = capsys.readouterr()
+        assert "does not pull images" in stderr
+
+    def test_local_runtime(self, capsys):
+        with pytest.raises(SystemExit):
+            tuxmake("images", "pull", "--runtime=docker-local")
+
+    def test_no_images(self, capsys):
+        with pytest.raises(SystemExit) as exit:
+            tuxmake("images", "pull", "--toolchain=gcc-1")
+        assert exit.value.code == 1
+        _, stderr = capsys.readouterr()
+        assert "No images to pull" in stderr
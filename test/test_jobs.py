@@ -0,0 +1,142 @@
+import pytest
+
+from tuxmake import jobs
+from tuxmake.jobs import JobPlan
+
+
+@pytest.fixture
+def cgroupfs(tmp_path, mocker):
+    root = tmp_path / "cgroup"
+    cgroup = root / "system.slice" / "builder.service"
+    cgroup.mkdir(parents=True)
+    proc_self_cgroup = tmp_path / "cgroup.proc"
+    proc_self_cgroup.write_text("0::/system.slice/builder.service\n")
+    mocker.patch("tuxmake.jobs.CGROUP_ROOT", root)
+    mocker.patch("tuxmake.jobs.PROC_SELF_CGROUP", proc_self_cgroup)
+    mocker.patch("tuxmake.jobs.get_available_memory", return_value=64 * 2**30)
+    mocker.patch("os.sched_getaffinity", return_value=set(range(32)))
+    return root
+
+
+class TestCgroup:
+    def test_hierarchy(self, cgroupfs):
+        assert jobs.get_cgroup_hierarchy() == [
+            cgroupfs / "system.slice" / "builder.service",
+            cgroupfs / "system.slice",
+            cgroupfs,
+        ]
+
+    def test_no_cgroup_v2(self, cgroupfs, tmp_path):
+        (tmp_path / "cgroup.proc").write_text("1:cpu:/foo\n")
+        assert jobs.get_cgroup_hierarchy() == []
+
+    def test_other_process(self, cgroupfs, tmp_path, mocker):
+        proc = tmp_path / "proc"
+        (proc / "1234").mkdir(parents=True)
+        (proc / "1234" / "cgroup").write_text("0::/machine.slice/libpod-abc.scope\n")
+        mocker.patch("tuxmake.jobs.PROC", proc)
+        assert jobs.get_cgroup("1234") == cgroupfs / "machine.slice/libpod-abc.scope"
+
+    def test_no_proc(self, cgroupfs, tmp_path):
+        (tmp_path / "cgroup.proc").unlink()
+        assert jobs.get_cgroup() is None
+
+
+class TestGetCpus:
+    def test_affinity(self, cgroupfs):
+        assert jobs.get_cpus() == 32
+
+    def test_no_affinity(self, cgroupfs, mocker):
+        mocker.patch("os.sched_getaffinity", side_effect=AttributeError)
+        mocker.patch("os.cpu_count", return_value=4)
+        assert jobs.get_cpus() == 4
+
+    def test_cpu_quota(self, cgroupfs):
+        (cgroupfs / "system.slice" / "cpu.max").write_text("max 100000\n")
+        (cgroupfs / "system.slice" / "builder.service" / "cpu.max").write_text(
+            "250000 100000\n"
+        )
+        assert jobs.get_cpus() == 3
+
+    def test_tightest_quota(self, cgroupfs):
+        (cgroupfs / "system.slice" / "cpu.max").write_text("100000 100000\n")
+        (cgroupfs / "system.slice" / "builder.service" / "cpu.max").write_text(
+            "800000 100000\n"
+        )
+        assert jobs.get_cpus() == 1
+
+    def test_invalid_quota(self, cgroupfs):
+        (cgroupfs / "cpu.max").write_text("foo bar\n")
+        assert jobs.get_cpus() == 32
+
+
+class TestGetMemory:
+    def test_mem_available(self, cgroupfs):
+        assert jobs.get_memory() == 64 * 2**30
+
+    def test_memory_max(self, cgroupfs):
+        slice = cgroupfs / "system.slice"
+        (slice / "memory.max").write_text(f"{16 * 2**30}\n")
+        (slice / "memory.current").write_text(f"{4 * 2**30}\n")
+        (slice / "builder.service" / "memory.max").write_text("max\n")
+        assert jobs.get_memory() == 12 * 2**30
+
+    def test_no_mem_available(self, cgroupfs, mocker):
+        mocker.patch("tuxmake.jobs.get_available_memory", return_value=None)
+        (cgroupfs / "memory.max").write_text(f"{2**30}\n")
+        assert jobs.get_memory() == 2**30
+
+    def test_invalid(self, cgroupfs):
+        (cgroupfs / "memory.max").write_text("foo\n")
+        assert jobs.get_memory() == 64 * 2**30
+
+
+class TestParse:
+    def test_number(self):
+        assert jobs.parse("8") == 8
+        assert jobs.parse(8) == 8
+
+    def test_auto(self):
+        assert jobs.parse("auto") == {"mem_per_job": None}
+
+    def test_mem_per_job(self):
+        assert jobs.parse("auto:mem-per-job=1G") == {"mem_per_job": 2**30}
+
+    @pytest.mark.parametrize("spec", ["0", "foo", "auto:foo=1", "auto:mem-per-job=x"])
+    def test_invalid(self, spec):
+        with pytest.raises(ValueError):
+            jobs.parse(spec)
+
+
+class TestPlan:
+    def test_cpu_only(self, cgroupfs):
+        plan = jobs.plan()
+        assert plan.jobs == 32
+        assert plan.limited_by == "cpu"
+
+    def test_mem_per_job(self, cgroupfs):
+        plan = jobs.plan(mem_per_job=4 * 2**30)
+        assert plan.jobs == 16
+        assert plan.limited_by == "memory"
+
+    def test_enough_memory(self, cgroupfs):
+        plan = jobs.plan(mem_per_job=2**20)
+        assert plan.jobs == 32
+        assert plan.limited_by == "cpu"
+
+    def test_peak_rss(self, cgroupfs):
+        plan = jobs.plan(peak_rss=4 * 2**30)
+        assert plan.mem_per_job == 5 * 2**30
+        assert plan.jobs == 12
+
+    def test_at_least_one_job(self, cgroupfs):
+        assert jobs.plan(mem_per_job=2**40).jobs == 1
+
+    def test_as_dict(self):
+        assert JobPlan(4, 8, 2**30, 2**28, "memory").as_dict() == {
+            "jobs": 4,
+            "cpus": 8,
+            "memory": 2**30,
+            "mem_per_job": 2**28,
+            "limited_by": "memory",
+        }
@@ -0,0 +1,198 @@
+import fcntl
+import itertools
+import os
+import runpy
+import sys
+import threading
+import time
+import pytest
+
+import tuxmake.jobserver
+from tuxmake.jobserver import HostJobserver
+from tuxmake.jobserver import JobserverError
+from tuxmake.jobserver import get_jobserver_dir
+from tuxmake.jobserver import main
+from tuxmake.jobserver import serve
+
+
+@pytest.fixture
+def fast(mocker):
+    mocker.patch("tuxmake.jobserver.POLL_INTERVAL", 0.01)
+    mocker.patch("tuxmake.jobserver.IDLE_TIMEOUT", 0.05)
+
+
+class FakeProcess:
+    """
+    Runs the jobserver in a thread instead of in a separate process.
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.thread = threading.Thread(target=serve, args=(cmd[-2], int(cmd[-1])))
+        self.thread.start()
+
+    def poll(self):
+        return None
+
+
+@pytest.fixture
+def popen(mocker, fast):
+    return mocker.patch("subprocess.Popen", side_effect=FakeProcess)
+
+
+def read_tokens(fifo):
+    fd = os.open(str(fifo), os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        return os.read(fd, 1024)
+    except BlockingIOError:
+        return b""
+    finally:
+        os.close(fd)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class TestHostJobserver:
+    def test_default_directory(self, home):
+        assert HostJobserver().directory == get_jobserver_dir()
+        assert str(get_jobserver_dir()).startswith(str(home))
+
+    def test_auth(self, tmp_path):
+        jobserver = HostJobserver(tmp_path)
+        assert jobserver.auth == f"fifo:{tmp_path}/fifo"
+
+    def test_join_creates_jobserver(self, tmp_path, popen):
+        jobserver = HostJobserver(tmp_path)
+        jobserver.join(4)
+        assert jobserver.running()
+        assert read_tokens(jobserver.fifo) == b"+++"
+        jobserver.leave()
+        wait_for(lambda: not jobserver.fifo.exists())
+        assert not jobserver.running()
+
+    def test_join_existing(self, tmp_path, popen):
+        first = HostJobserver(tmp_path)
+        first.join(4)
+        second = HostJobserver(tmp_path)
+        second.join(8)
+        assert popen.call_count == 1
+        first.leave()
+        time.sleep(0.1)
+        assert second.running()
+        second.leave()
+        wait_for(lambda: not second.running())
+
+    def test_takes_a_token_for_the_implicit_slot(self, tmp_path, popen):
+        first = HostJobserver(tmp_path)
+        first.join(2)
+        second = HostJobserver(tmp_path)
+        second.join(2)
+        assert read_tokens(first.fifo) == b""
+        second.leave()
+        assert read_tokens(first.fifo) == b"+"
+        first.leave()
+
+    def test_waits_for_a_free_slot(self, tmp_path, popen):
+        first = HostJobserver(tmp_path)
+        first.join(1)
+        second = HostJobserver(tmp_path)
+        thread = threading.Thread(target=second.join, args=(1,))
+        thread.start()
+        time.sleep(0.1)
+        assert thread.is_alive()
+        first.leave()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert second.clients
+        second.leave()
+
+    def test_lost_tokens_reclaimed_while_waiting(self, tmp_path, popen):
+        first = HostJobserver(tmp_path)
+        first.join(2)
+        # a make takes the remaining token, and is killed before returning it
+        assert read_tokens(first.fifo) == b"+"
+        # and then the build itself is killed
+        first.clients.close()
+        os.close(first.slot)
+        second = HostJobserver(tmp_path)
+        second.join(2)
+        assert read_tokens(second.fifo) == b"+"
+        second.leave()
+
+    def test_leave_without_join(self, tmp_path):
+        HostJobserver(tmp_path).leave()
+
+    def test_not_running_stale_pid(self, tmp_path):
+        (tmp_path / "fifo").touch()
+        (tmp_path / "pid").write_text("999999999")
+        assert not HostJobserver(tmp_path).running()
+
+    def test_running_other_user(self, tmp_path, mocker):
+        mocker.patch("os.kill", side_effect=PermissionError())
+        (tmp_path / "fifo").touch()
+        (tmp_path / "pid").write_text("1")
+        assert HostJobserver(tmp_path).running()
+
+    def test_start_failure(self, tmp_path, mocker):
+        process = mocker.patch("subprocess.Popen").return_value
+        process.poll.return_value = 1
+        with pytest.raises(JobserverError):
+            HostJobserver(tmp_path).join(4)
+
+    def test_actual_process(self, tmp_path):
+        jobserver = HostJobserver(tmp_path)
+        jobserver.join(2)
+        try:
+            assert read_tokens(jobserver.fifo) == b"+"
+        finally:
+            jobserver.leave()
+            os.kill(int((tmp_path / "pid").read_text()), 15)
+
+
+class TestServe:
+    def test_waits_for_clients(self, tmp_path, fast):
+        os.mkfifo(str(tmp_path / "fifo"))
+        clients = (tmp_path / "clients").open("a")
+        fcntl.flock(clients, fcntl.LOCK_SH)
+        thread = threading.Thread(target=serve, args=(tmp_path, 2))
+        thread.start()
+        time.sleep(0.2)
+        assert thread.is_alive()
+        clients.close()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert not (tmp_path / "fifo").exists()
+        assert not (tmp_path / "pid").exists()
+
+    def test_reclaims_lost_tokens(self, tmp_path, fast):
+        os.mkfifo(str(tmp_path / "fifo"))
+        reader = os.open(str(tmp_path / "fifo"), os.O_RDONLY | os.O_NONBLOCK)
+        clients = (tmp_path / "clients").open("a")
+        fcntl.flock(clients, fcntl.LOCK_SH)
+        thread = threading.Thread(target=serve, args=(tmp_path, 4))
+        thread.start()
+        wait_for(lambda: (tmp_path / "pid").exists())
+        # a make takes two tokens, and is killed before returning them
+        assert os.read(reader, 2) == b"++"
+        clients.close()
+        thread.join(5)
+        assert os.read(reader, 1024) == b"++++"
+        os.close(reader)
+
+    def test_main(self, monkeypatch, mocker):
+        serve = mocker.patch("tuxmake.jobserver.serve")
+        monkeypatch.setattr(sys, "argv", ["", "/path/to/jobserver", "8"])
+        main()
+        serve.assert_called_with("/path/to/jobserver", 8)
+
+    def test_run_as_script(self, tmp_path, monkeypatch, mocker):
+        os.mkfifo(str(tmp_path / "fifo"))
+        monkeypatch.setattr(sys, "argv", ["", str(tmp_path), "2"])
+        mocker.patch("time.sleep")
+        mocker.patch("time.time", side_effect=itertools.count(0, 60))
+        runpy.run_path(tuxmake.jobserver.__file__, run_name="__main__")
+        assert not (tmp_path / "fifo").exists()
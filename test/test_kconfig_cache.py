@@ -0,0 +1,206 @@
+import os
+
+import pytest
+
+from tuxmake.build import Build
+from tuxmake.kconfig_cache import KconfigCache
+from tuxmake.kconfig_cache import enabled
+from tuxmake.kconfig_cache import get_cache_dir
+from tuxmake.kconfig_cache import get_max_size
+from tuxmake.result_cache import get_config_input
+from tuxmake.result_cache import get_tree_hash
+
+
+class TestSettings:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_KCONFIG_CACHE", raising=False)
+        assert not enabled()
+
+    def test_enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_KCONFIG_CACHE", "true")
+        assert enabled()
+
+    def test_cache_dir(self, home, monkeypatch):
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        monkeypatch.delenv("TUXMAKE_KCONFIG_CACHE_DIR", raising=False)
+        assert get_cache_dir() == home / ".cache" / "tuxmake" / "kconfig"
+
+    def test_cache_dir_from_environment(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_KCONFIG_CACHE_DIR", str(tmp_path))
+        assert get_cache_dir() == tmp_path
+
+    def test_max_size(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_KCONFIG_CACHE_SIZE", raising=False)
+        assert get_max_size() == 100 * 2**20
+
+
+class TestGetTreeHashPathspec:
+    def test_glob(self, linux_git, git):
+        first = get_tree_hash(linux_git, [":(glob)**/Kconfig*"])
+        (linux_git / "vmlinux.c").write_text("/* changed */\n")
+        assert get_tree_hash(linux_git, [":(glob)**/Kconfig*"]) == first
+        (linux_git / "Kconfig").write_text("# changed\n")
+        assert get_tree_hash(linux_git, [":(glob)**/Kconfig*"]) is None
+        git(linux_git, "commit", "--quiet", "--all", "--message=change")
+        assert get_tree_hash(linux_git, [":(glob)**/Kconfig*"]) != first
+
+
+class TestGetConfigInputInTree:
+    def test_in_tree_file(self, linux):
+        spec = "vmlinux.c"
+        assert get_config_input(spec, {}) == spec
+        assert get_config_input(spec, {}, linux) != spec
+
+
+class TestGetKey:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return KconfigCache(tmp_path / "cache")
+
+    def key(self, cache, tree, **kwargs):
+        build = Build(tree=tree, targets=["config"], **kwargs)
+        return cache.get_key(build, {})
+
+    def test_basics(self, cache, linux_git, image_id):
+        assert len(self.key(cache, linux_git)) == 64
+
+    def test_same_inputs(self, cache, linux_git, image_id):
+        assert self.key(cache, linux_git) == self.key(cache, linux_git)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"target_arch": "arm64"},
+            {"kconfig": "tinyconfig"},
+            {"kconfig_add": ["CONFIG_FOO=y"]},
+            {"make_variables": {"LLVM": "1"}},
+        ],
+    )
+    def test_different_inputs(self, cache, linux_git, image_id, kwargs):
+        assert self.key(cache, linux_git) != self.key(cache, linux_git, **kwargs)
+
+    def test_different_image(self, cache, linux_git, image_id):
+        first = self.key(cache, linux_git)
+        image_id.return_value = "sha256:4567"
+        assert self.key(cache, linux_git) != first
+
+    def test_ignores_other_source_changes(self, cache, linux_git, image_id, git):
+        first = self.key(cache, linux_git)
+        (linux_git / "vmlinux.c").write_text("/* changed */\n")
+        git(linux_git, "commit", "--quiet", "--all", "--message=change")
+        assert self.key(cache, linux_git) == first
+
+    def test_downloaded_fragment(self, cache, linux_git, image_id):
+        url = "https://example.com/fragment.config"
+        build = Build(tree=linux_git, targets=["config"], kconfig_add=[url])
+        a = cache.get_key(build, {url: "CONFIG_FOO=y\n"})
+        b = cache.get_key(build, {url: "CONFIG_FOO=n\n"})
+        assert a != b
+
+    def test_interactive(self, cache, linux_git, image_id):
+        assert self.key(cache, linux_git, kconfig_add=["imake:menuconfig"]) is None
+
+    def test_no_image_id(self, cache, linux_git):
+        assert self.key(cache, linux_git) is None
+
+    def test_dirty_tree(self, cache, linux_git, image_id):
+        (linux_git / "Kconfig").write_text("# changed\n")
+        assert self.key(cache, linux_git) is None
+
+
+class TestKconfigCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return KconfigCache(tmp_path / "cache", max_size=2**20)
+
+    @pytest.fixture
+    def config(self, tmp_path):
+        config = tmp_path / ".config"
+        config.write_text("CONFIG_FOO=y\n")
+        return config
+
+    def test_miss(self, cache, tmp_path):
+        assert not cache.restore("abc", tmp_path / "new")
+        assert not (tmp_path / "new").exists()
+
+    def test_store_and_restore(self, cache, config, tmp_path):
+        cache.store("abc", config)
+        os.utime(str(cache.entry("abc")), (0, 0))
+        new = tmp_path / "new"
+        assert cache.restore("abc", new)
+        assert new.read_text() == "CONFIG_FOO=y\n"
+        assert cache.entry("abc").stat().st_mtime > 0
+
+    def test_store_failure(self, cache, tmp_path):
+        cache.store("abc", tmp_path / "missing")
+        assert list(cache.directory.iterdir()) == []
+
+    def test_store_failure_after_tmp_removed(self, cache, config, mocker):
+        def copyfile(src, dest):
+            os.unlink(dest)
+            raise OSError("disk full")
+
+        mocker.patch("shutil.copyfile", side_effect=copyfile)
+        cache.store("abc", config)
+        assert list(cache.directory.iterdir()) == []
+
+    def test_store_failure_before_tmp_created(self, cache, config, mocker):
+        mocker.patch("tempfile.mkstemp", side_effect=PermissionError("denied"))
+        cache.store("abc", config)
+        assert list(cache.directory.iterdir()) == []
+
+    def test_evicts(self, cache, config, mocker):
+        evict = mocker.patch("tuxmake.kconfig_cache.evict")
+        cache.store("abc", config)
+        evict.assert_called_with(cache.directory, 2**20)
+
+
+class TestBuild:
+    @pytest.fixture(autouse=True)
+    def kconfig_cache(self, monkeypatch, tmp_path, image_id):
+        monkeypatch.setenv("TUXMAKE_KCONFIG_CACHE", "true")
+        monkeypatch.setenv("TUXMAKE_KCONFIG_CACHE_DIR", str(tmp_path / "kconfig"))
+
+    def test_disabled(self, linux_git, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_KCONFIG_CACHE", "false")
+        build = Build(tree=linux_git, targets=["config"])
+        build.run()
+        assert build.passed
+        assert "kconfig_cache" not in build.metadata
+
+    def test_miss_then_hit(self, linux_git, mocker, tmp_path):
+        kwargs = {"kconfig_add": ["CONFIG_FOO=y"]}
+        first = Build(tree=linux_git, targets=["config"], **kwargs)
+        first.run()
+        assert first.passed
+        assert first.metadata["kconfig_cache"]["cache"] == "miss"
+        assert len(list(get_cache_dir().glob("*.config"))) == 1
+
+        second = Build(tree=linux_git, targets=["config"], **kwargs)
+        run_cmd = mocker.spy(second, "run_cmd")
+        second.run()
+        assert second.passed
+        assert second.metadata["kconfig_cache"] == {
+            "cache": "hit",
+            "key": first.metadata["kconfig_cache"]["key"],
+        }
+        assert [c for c in run_cmd.call_args_list if "olddefconfig" in c[0][0]] == []
+        assert (second.output_dir / "config").read_text() == (
+            first.output_dir / "config"
+        ).read_text()
+
+    def test_failed_config_is_not_stored(self, linux_git):
+        build = Build(
+            tree=linux_git, targets=["config"], environment={"FAIL": "defconfig"}
+        )
+        build.run()
+        assert build.failed
+        assert build.metadata["kconfig_cache"]["cache"] == "miss"
+        assert not list(get_cache_dir().glob("*.config"))
+
+    def test_uncacheable(self, linux_git, image_id):
+        image_id.return_value = None
+        build = Build(tree=linux_git, targets=["config"])
+        build.run()
+        assert build.passed
+        assert "kconfig_cache" not in build.metadata
@@ -1,8 +1,20 @@
+import os
+import time
 import pytest
 
+from tuxmake import trash
 from tuxmake.output import get_default_output_basedir
 from tuxmake.output import get_new_output_dir
+from tuxmake.output import parse_size
+from tuxmake.output import record_output_dir_size
+from tuxmake.output import release_output_dir
+from tuxmake.output import RetentionPolicy
+from tuxmake.output import GC_BATCH_SIZE
 from tuxmake.output import get_default_korg_toolchains_dir
+from tuxmake.output import get_available_memory
+from tuxmake.output import create_tmpfs_dir
+from tuxmake.output import release_tmpfs_dir
+from tuxmake.output import sweep_tmpfs_dirs
 
 
 def test_default_output_basedir_xdg_cache_home(mocker, tmp_path):
@@ -46,6 +58,213 @@ def test_get_new_output_dir_race_condition(basedir, mocker):
     assert get_new_output_dir().name == "2"
 
 
+def test_get_new_output_dir_continues_existing_sequence(basedir, tmp_path):
+    (tmp_path / "5").mkdir()
+    (tmp_path / "7").mkdir()
+    assert get_new_output_dir().name == "8"
+    # the sequence file is used from now on
+    (tmp_path / "7").rmdir()
+    assert get_new_output_dir().name == "9"
+
+
+def test_get_new_output_dir_does_not_list_builds_dir(basedir, mocker):
+    get_new_output_dir()
+    glob = mocker.patch("pathlib.Path.glob")
+    get_new_output_dir()
+    glob.assert_not_called()
+
+
+def test_get_new_output_dir_invalid_sequence_file(basedir, tmp_path):
+    (tmp_path / "3").mkdir()
+    (tmp_path / ".sequence").write_text("garbage")
+    assert get_new_output_dir().name == "4"
+
+
+class TestParseSize:
+    def test_bytes(self):
+        assert parse_size("1000") == 1000
+
+    def test_units(self):
+        assert parse_size("2K") == 2048
+        assert parse_size("1M") == 2**20
+        assert parse_size("3G") == 3 * 2**30
+        assert parse_size("1TB") == 2**40
+        assert parse_size("1gib") == 2**30
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_size("lots")
+
+
+class TestRetentionPolicy:
+    def test_disabled_by_default(self):
+        assert not RetentionPolicy.from_environment().enabled
+
+    def test_from_environment(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_BUILDS_MAX_AGE", "2")
+        monkeypatch.setenv("TUXMAKE_BUILDS_MAX_COUNT", "10")
+        monkeypatch.setenv("TUXMAKE_BUILDS_MAX_SIZE", "1G")
+        policy = RetentionPolicy.from_environment()
+        assert policy.enabled
+        assert policy.max_age == 2 * 24 * 60 * 60
+        assert policy.max_count == 10
+        assert policy.max_size == 2**30
+
+
+class TestGarbageCollection:
+    @pytest.fixture(autouse=True)
+    def sync_cleanup(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_ASYNC_CLEANUP", "false")
+
+    def existing(self, base):
+        return sorted(int(d.name) for d in base.iterdir() if d.name.isdigit())
+
+    def finished_build(self, size=0, policy=RetentionPolicy()):
+        d = get_new_output_dir()
+        if size:
+            (d / "artifact").write_bytes(b"x" * size)
+        record_output_dir_size(d, policy)
+        release_output_dir(d)
+        return d
+
+    def test_max_count(self, basedir, tmp_path):
+        for _ in range(4):
+            self.finished_build()
+        get_new_output_dir(RetentionPolicy(max_count=3))
+        assert self.existing(tmp_path) == [3, 4, 5]
+        assert not list(tmp_path.glob(".*.removed"))
+
+    def test_max_age(self, basedir, tmp_path):
+        self.finished_build()
+        self.finished_build()
+        old = time.time() - 3600
+        os.utime(tmp_path / "1", (old, old))
+        get_new_output_dir(RetentionPolicy(max_age=60))
+        assert self.existing(tmp_path) == [2, 3]
+
+    def test_max_size(self, basedir, tmp_path):
+        policy = RetentionPolicy(max_size=2500)
+        for _ in range(3):
+            self.finished_build(1000, policy)
+        get_new_output_dir(policy)
+        assert self.existing(tmp_path) == [2, 3, 4]
+        assert (tmp_path / ".sizes").read_text() == "2 1000\n3 1000\n"
+
+    def test_never_removes_new_directory(self, basedir, tmp_path):
+        self.finished_build()
+        d = get_new_output_dir(RetentionPolicy(max_age=-1))
+        assert self.existing(tmp_path) == [2]
+        assert d.exists()
+
+    def test_never_removes_directories_in_use(self, basedir, tmp_path):
+        self.finished_build()
+        running = get_new_output_dir()
+        self.finished_build()
+        release_output_dir(get_new_output_dir(RetentionPolicy(max_count=1)))
+        assert self.existing(tmp_path) == [2, 3, 4]
+        release_output_dir(running)
+        get_new_output_dir(RetentionPolicy(max_count=1))
+        assert self.existing(tmp_path) == [5]
+
+    def test_removes_directories_of_killed_builds(self, basedir, tmp_path):
+        self.finished_build()
+        # a lock file that is not held by anyone
+        (tmp_path / "2").mkdir()
+        (tmp_path / ".2.lock").touch()
+        (tmp_path / ".sequence").write_text('{"next": 3, "oldest": 1}')
+        get_new_output_dir(RetentionPolicy(max_count=1))
+        assert self.existing(tmp_path) == [3]
+        assert not (tmp_path / ".2.lock").exists()
+
+    def test_removal_after_releasing_lock(self, basedir, tmp_path, mocker):
+        self.finished_build()
+        discard = mocker.patch("tuxmake.trash.discard")
+        get_new_output_dir(RetentionPolicy(max_count=1))
+        discard.assert_called_once_with(tmp_path / ".1.removed")
+        assert (tmp_path / ".1.removed").exists()
+        assert self.existing(tmp_path) == [2]
+
+    def test_max_count_counts_existing_directories(self, basedir, tmp_path):
+        for _ in range(5):
+            self.finished_build()
+        for n in (2, 3, 4):
+            (tmp_path / str(n)).rmdir()
+        get_new_output_dir(RetentionPolicy(max_count=3))
+        assert self.existing(tmp_path) == [1, 5, 6]
+
+    def test_skips_directories_removed_manually(self, basedir, tmp_path):
+        for _ in range(3):
+            self.finished_build()
+        (tmp_path / "1").rmdir()
+        (tmp_path / "2").rmdir()
+        get_new_output_dir(RetentionPolicy(max_count=1))
+        assert self.existing(tmp_path) == [4]
+
+    def test_incremental(self, basedir, tmp_path):
+        for _ in range(GC_BATCH_SIZE + 10):
+            self.finished_build()
+        release_output_dir(get_new_output_dir(RetentionPolicy(max_count=1)))
+        assert len(self.existing(tmp_path)) == 11
+        get_new_output_dir(RetentionPolicy(max_count=1))
+        assert self.existing(tmp_path) == [GC_BATCH_SIZE + 12]
+
+    def test_ignores_invalid_sizes_entries(self, basedir, tmp_path):
+        (tmp_path / ".sizes").write_text("garbage\n")
+        self.finished_build(10, RetentionPolicy(max_size=1))
+        get_new_output_dir(RetentionPolicy(max_size=1))
+        assert self.existing(tmp_path) == [2]
+
+
+class TestReleaseOutputDir:
+    def test_releases_directory(self, basedir, tmp_path):
+        d = get_new_output_dir()
+        assert (tmp_path / ".1.lock").exists()
+        release_output_dir(d)
+        assert not (tmp_path / ".1.lock").exists()
+
+    def test_does_not_record_size(self, basedir, tmp_path, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_BUILDS_MAX_SIZE", "1G")
+        release_output_dir(get_new_output_dir())
+        assert not (tmp_path / ".sizes").exists()
+
+    def test_not_allocated(self, basedir, tmp_path):
+        d = tmp_path / "1"
+        d.mkdir()
+        release_output_dir(d)
+
+
+class TestRecordOutputDirSize:
+    def test_does_not_release_directory(self, basedir, tmp_path):
+        d = get_new_output_dir()
+        record_output_dir_size(d, RetentionPolicy(max_size=1))
+        assert (tmp_path / ".1.lock").exists()
+
+    def test_no_size_without_limit(self, basedir, tmp_path, mocker):
+        get_directory_size = mocker.patch("tuxmake.output.get_directory_size")
+        record_output_dir_size(get_new_output_dir(), RetentionPolicy(max_count=1))
+        get_directory_size.assert_not_called()
+        assert not (tmp_path / ".sizes").exists()
+
+    def test_size_limit_from_environment(self, basedir, tmp_path, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_BUILDS_MAX_SIZE", "1G")
+        record_output_dir_size(get_new_output_dir())
+        assert (tmp_path / ".sizes").read_text() == "1 0\n"
+
+    def test_appends_under_lock(self, basedir, tmp_path, mocker):
+        locked = mocker.patch("tuxmake.output.locked")
+        d = tmp_path / "1"
+        d.mkdir()
+        record_output_dir_size(d, RetentionPolicy(max_size=1))
+        locked.assert_called_once_with(tmp_path)
+
+
+def test_record_output_dir_size_ignores_other_directories(basedir, tmp_path):
+    d = tmp_path / "elsewhere" / "output"
+    d.mkdir(parents=True)
+    record_output_dir_size(d)
+    assert not (tmp_path / ".sizes").exists()
+
+
 def test_default_korg_toolchains_xdg_cache_home(mocker, monkeypatch, tmp_path):
     monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
     assert get_default_korg_toolchains_dir() == (
@@ -57,3 +276,91 @@ def test_default_korg_toolchains_dir(mocker, home):
     assert get_default_korg_toolchains_dir() == (
         home / ".cache/tuxmake/korg_toolchains"
     )
+
+
+@pytest.fixture
+def tmpfs(monkeypatch, tmp_path, mocker):
+    d = tmp_path / "shm"
+    d.mkdir()
+    monkeypatch.setenv("TUXMAKE_TMPFS_DIR", str(d))
+    usage = mocker.patch("shutil.disk_usage")
+    usage.return_value.free = 10 * 2**30
+    mocker.patch("tuxmake.output.get_available_memory", return_value=4 * 2**30)
+    return d
+
+
+class TestCreateTmpfsDir:
+    def test_no_estimate(self, tmpfs):
+        assert create_tmpfs_dir("tuxmake-build-", None) is None
+        assert list(tmpfs.iterdir()) == []
+
+    def test_fits(self, tmpfs):
+        path = create_tmpfs_dir("tuxmake-build-", 3 * 2**30)
+        assert path.parent == tmpfs
+        assert path.name.startswith("tuxmake-build-")
+        assert path.is_dir()
+
+    def test_locked_until_released(self, tmpfs):
+        path = create_tmpfs_dir("tuxmake-build-", 2**30)
+        assert trash.lock(path) is None
+        release_tmpfs_dir(path)
+        fd = trash.lock(path)
+        assert fd is not None
+        os.close(fd)
+        release_tmpfs_dir(path)  # no-op
+
+    def test_sweeps_stale_directories(self, tmpfs, mocker):
+        discard = mocker.patch("tuxmake.trash.discard")
+        stale = tmpfs / "tuxmake-build-stale"
+        trashed = tmpfs / ".tuxmake-build-old.trash-0123"
+        recent = tmpfs / "tuxmake-build-recent"
+        other = tmpfs / "something-else"
+        for d in (stale, trashed, recent, other):
+            d.mkdir()
+        for d in (stale, trashed, other):
+            os.utime(d, (0, 0))
+        create_tmpfs_dir("tuxmake-build-", 2**30)
+        assert sorted(c[0][0] for c in discard.call_args_list) == [trashed, stale]
+
+    def test_does_not_sweep_directories_in_use(self, tmpfs):
+        in_use = create_tmpfs_dir("tuxmake-build-", 2**30)
+        os.utime(in_use, (0, 0))
+        create_tmpfs_dir("tuxmake-build-", 2**30)
+        assert in_use.exists()
+
+    def test_sweep_entry_vanishes(self, tmpfs, mocker):
+        gone = tmpfs / "tuxmake-build-gone"
+        mocker.patch("pathlib.Path.glob", side_effect=[[gone], []])
+        discard = mocker.patch("tuxmake.trash.discard")
+        sweep_tmpfs_dirs(tmpfs, "tuxmake-build-")
+        discard.assert_not_called()
+
+    def test_does_not_fit_in_memory(self, tmpfs):
+        assert create_tmpfs_dir("tuxmake-build-", int(3.5 * 2**30)) is None
+
+    def test_does_not_fit_in_tmpfs(self, tmpfs, mocker):
+        mocker.patch("tuxmake.output.get_available_memory", return_value=None)
+        shutil_disk_usage = mocker.patch("shutil.disk_usage")
+        shutil_disk_usage.return_value.free = 2**30
+        assert create_tmpfs_dir("tuxmake-build-", 2**30) is None
+
+    def test_no_tmpfs(self, tmpfs, mocker):
+        mocker.patch("shutil.disk_usage", side_effect=FileNotFoundError())
+        assert create_tmpfs_dir("tuxmake-build-", 2**30) is None
+
+
+class TestGetAvailableMemory:
+    def test_meminfo(self, mocker):
+        mocker.patch(
+            "builtins.open",
+            mocker.mock_open(read_data="MemTotal: 2048 kB\nMemAvailable: 1024 kB\n"),
+        )
+        assert get_available_memory() == 1024 * 1024
+
+    def test_no_meminfo(self, mocker):
+        mocker.patch("builtins.open", side_effect=FileNotFoundError())
+        assert get_available_memory() is None
+
+    def test_no_mem_available(self, mocker):
+        mocker.patch("builtins.open", mocker.mock_open(read_data="MemTotal: 1 kB\n"))
+        assert get_available_memory() is None
@@ -0,0 +1,67 @@
+import threading
+import pytest
+
+from tuxmake.pipeline import Pipeline
+
+
+class TestPipeline:
+    def test_dependencies(self):
+        order = []
+        pipeline = Pipeline()
+        pipeline.add("a", lambda: order.append("a"))
+        pipeline.add("b", lambda: order.append("b"), after=["a"])
+        pipeline.add("c", lambda: order.append("c"), after=["b"])
+        pipeline.run()
+        assert order == ["a", "b", "c"]
+
+    def test_concurrent(self):
+        started = threading.Barrier(2, timeout=5)
+        pipeline = Pipeline()
+        pipeline.add("a", started.wait)
+        pipeline.add("b", started.wait)
+        pipeline.run()
+
+    def test_durations(self):
+        pipeline = Pipeline()
+        pipeline.add("a", lambda: None)
+        pipeline.add("b", lambda: None, after=["a"])
+        pipeline.run()
+        assert set(pipeline.durations) == {"a", "b"}
+
+    def test_unknown_dependency(self):
+        pipeline = Pipeline()
+        with pytest.raises(ValueError):
+            pipeline.add("b", lambda: None, after=["a"])
+
+    def test_failure_skips_dependents(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError("FAIL")
+
+        pipeline = Pipeline()
+        pipeline.add("a", fail)
+        pipeline.add("b", lambda: ran.append("b"), after=["a"])
+        with pytest.raises(RuntimeError):
+            pipeline.run()
+        assert ran == []
+        assert "b" not in pipeline.durations
+
+    def test_failure_waits_for_running_steps(self):
+        finished = []
+        release = threading.Event()
+
+        def fail():
+            release.set()
+            raise RuntimeError("FAIL")
+
+        def slow():
+            release.wait(5)
+            finished.append("slow")
+
+        pipeline = Pipeline()
+        pipeline.add("slow", slow)
+        pipeline.add("fail", fail)
+        with pytest.raises(RuntimeError):
+            pipeline.run()
+        assert finished == ["slow"]
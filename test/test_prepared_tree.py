@@ -0,0 +1,180 @@
+import os
+import tarfile
+import time
+
+import pytest
+
+from tuxmake.build import Build
+from tuxmake.prepared_tree import PreparedTreeCache
+from tuxmake.prepared_tree import enabled
+from tuxmake.prepared_tree import get_cache_dir
+from tuxmake.prepared_tree import get_key
+from tuxmake.prepared_tree import get_max_size
+from tuxmake.result_cache import get_tree_hash
+
+
+class TestSettings:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_PREPARED_TREE_CACHE", raising=False)
+        assert not enabled()
+
+    def test_enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_PREPARED_TREE_CACHE", "true")
+        assert enabled()
+
+    def test_cache_dir(self, home, monkeypatch):
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        monkeypatch.delenv("TUXMAKE_PREPARED_TREE_CACHE_DIR", raising=False)
+        assert get_cache_dir() == home / ".cache" / "tuxmake" / "prepared-trees"
+
+    def test_cache_dir_from_environment(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_PREPARED_TREE_CACHE_DIR", str(tmp_path))
+        assert get_cache_dir() == tmp_path
+
+    def test_max_size(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_PREPARED_TREE_CACHE_SIZE", raising=False)
+        assert get_max_size() == 5 * 2**30
+
+
+class TestGetTreeHashPaths:
+    def test_only_given_paths(self, linux_git):
+        first = get_tree_hash(linux_git, ["Makefile", "scripts"])
+        assert len(first) == 64
+        (linux_git / "vmlinux.c").write_text("/* changed */\n")
+        assert get_tree_hash(linux_git, ["Makefile", "scripts"]) == first
+
+    def test_dirty_path(self, linux_git):
+        (linux_git / "Makefile").write_text("# changed\n")
+        assert get_tree_hash(linux_git, ["Makefile", "scripts"]) is None
+
+
+class TestGetKey:
+    @pytest.fixture
+    def build(self, linux_git, image_id):
+        build = Build(tree=linux_git, targets=["config"])
+        build.build_dir.mkdir(parents=True, exist_ok=True)
+        (build.build_dir / ".config").write_text("CONFIG_FOO=y\n")
+        return build
+
+    def test_basics(self, build):
+        assert len(get_key(build)) == 64
+
+    def test_depends_on_config(self, build):
+        first = get_key(build)
+        (build.build_dir / ".config").write_text("CONFIG_FOO=n\n")
+        assert get_key(build) != first
+
+    def test_depends_on_image(self, build, image_id):
+        first = get_key(build)
+        image_id.return_value = "sha256:4567"
+        assert get_key(build) != first
+
+    def test_no_config(self, build):
+        (build.build_dir / ".config").unlink()
+        assert get_key(build) is None
+
+    def test_no_image_id(self, build, image_id):
+        image_id.return_value = None
+        assert get_key(build) is None
+
+
+class TestPreparedTreeCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return PreparedTreeCache(tmp_path / "cache", max_size=2**20)
+
+    @pytest.fixture
+    def prepared(self, tmp_path):
+        build_dir = tmp_path / "build"
+        (build_dir / "scripts" / "basic").mkdir(parents=True)
+        (build_dir / "scripts" / "basic" / "fixdep").write_text("fixdep")
+        (build_dir / "include" / "generated").mkdir(parents=True)
+        (build_dir / "include" / "generated" / "autoconf.h").write_text("#define")
+        (build_dir / "include" / "generated" / "link").symlink_to("autoconf.h")
+        (build_dir / "vmlinux.o").write_text("not part of the prepared tree")
+        return build_dir
+
+    def test_miss(self, cache, tmp_path):
+        assert not cache.restore("abc", tmp_path / "build")
+
+    def test_store_and_restore(self, cache, prepared, tmp_path):
+        cache.store("abc", prepared, "x86")
+        with tarfile.open(str(cache.archive("abc"))) as tar:
+            names = tar.getnames()
+        assert "scripts/basic/fixdep" in names
+        assert "include/generated/autoconf.h" in names
+        assert "vmlinux.o" not in names
+
+        new = tmp_path / "new"
+        start = time.time() - 1
+        assert cache.restore("abc", new)
+        fixdep = new / "scripts" / "basic" / "fixdep"
+        assert fixdep.read_text() == "fixdep"
+        assert fixdep.stat().st_mtime >= start
+        assert os.readlink(str(new / "include" / "generated" / "link")) == "autoconf.h"
+
+    def test_store_failure(self, cache, prepared, mocker):
+        mocker.patch("tarfile.TarFile.add", side_effect=PermissionError())
+        cache.store("abc", prepared, "x86")
+        assert list(cache.directory.iterdir()) == []
+
+    def test_evicts(self, cache, prepared, mocker):
+        evict = mocker.patch("tuxmake.prepared_tree.evict")
+        cache.store("abc", prepared, "x86")
+        evict.assert_called_with(cache.directory, 2**20)
+
+
+class TestBuild:
+    @pytest.fixture(autouse=True)
+    def prepared_tree_cache(self, monkeypatch, tmp_path, image_id):
+        monkeypatch.setenv("TUXMAKE_PREPARED_TREE_CACHE", "true")
+        monkeypatch.setenv(
+            "TUXMAKE_PREPARED_TREE_CACHE_DIR", str(tmp_path / "prepared-trees")
+        )
+
+    def test_disabled(self, linux_git, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_PREPARED_TREE_CACHE", "false")
+        build = Build(tree=linux_git, targets=["config", "default"])
+        build.run()
+        assert "prepared_tree" not in build.metadata
+
+    def test_miss_then_hit(self, linux_git, mocker, tmp_path):
+        first = Build(tree=linux_git, targets=["config", "default"])
+        first.run()
+        assert first.passed
+        assert first.metadata["prepared_tree"]["cache"] == "miss"
+        assert len(list(get_cache_dir().glob("*.tar"))) == 1
+
+        second = Build(
+            tree=linux_git, targets=["config", "default"], build_dir=tmp_path / "b"
+        )
+        run_cmd = mocker.spy(second, "run_cmd")
+        second.run()
+        assert second.passed
+        assert second.metadata["prepared_tree"]["cache"] == "hit"
+        assert second.metadata["prepared_tree"]["key"] == (
+            first.metadata["prepared_tree"]["key"]
+        )
+        assert ["{make}", "prepare"] not in [c[0][0] for c in run_cmd.call_args_list]
+        assert (second.build_dir / "include" / "generated" / "utsrelease.h").exists()
+
+    def test_prepare_fails(self, linux_git):
+        build = Build(
+            tree=linux_git,
+            targets=["config", "default"],
+            environment={"FAIL": "prepare"},
+        )
+        build.run()
+        assert build.metadata["prepared_tree"]["cache"] == "failed"
+        assert not list(get_cache_dir().glob("*.tar"))
+
+    def test_only_before_default(self, linux_git):
+        build = Build(tree=linux_git, targets=["config"])
+        build.run()
+        assert "prepared_tree" not in build.metadata
+
+    def test_uncacheable(self, linux_git, image_id):
+        image_id.return_value = None
+        build = Build(tree=linux_git, targets=["config", "default"])
+        build.run()
+        assert "prepared_tree" not in build.metadata
@@ -0,0 +1,213 @@
+import os
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from tuxmake import pressure
+from tuxmake.pressure import Episode
+from tuxmake.pressure import PressureMonitor
+from tuxmake.pressure import read_memory_events
+from tuxmake.pressure import read_psi
+
+
+def psi_text(full):
+    return (
+        "some avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+        f"full avg10={full:.2f} avg60=0.00 avg300=0.00 total=0\n"
+    )
+
+
+@pytest.fixture
+def psi(tmp_path, mocker):
+    path = tmp_path / "memory"
+    path.write_text(psi_text(0))
+    mocker.patch("tuxmake.pressure.PSI_MEMORY", path)
+    return path
+
+
+@pytest.fixture
+def cgroup(tmp_path):
+    path = tmp_path / "cgroup"
+    path.mkdir()
+    (path / "memory.events").write_text("low 0\nhigh 0\nmax 0\noom 0\noom_kill 0\n")
+    return path
+
+
+@pytest.fixture
+def runtime(cgroup):
+    runtime = MagicMock()
+    runtime.pause.return_value = True
+    runtime.get_cgroup.return_value = cgroup
+    return runtime
+
+
+@pytest.fixture
+def monitor(psi, cgroup, runtime):
+    monitor = PressureMonitor(runtime, sustain=2, pause_duration=0)
+    monitor.events = read_memory_events(cgroup)
+    return monitor
+
+
+class TestEnabled:
+    def test_default(self):
+        assert not pressure.enabled()
+
+    def test_enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_PRESSURE_THROTTLE", "true")
+        assert pressure.enabled()
+
+    def test_threshold(self, monkeypatch):
+        assert pressure.get_threshold() == 10
+        monkeypatch.setenv("TUXMAKE_PRESSURE_THRESHOLD", "2.5")
+        assert pressure.get_threshold() == 2.5
+
+
+class TestReadPsi:
+    def test_parse(self, psi):
+        psi.write_text(psi_text(12.5))
+        assert read_psi()["full"]["avg10"] == 12.5
+        assert read_psi()["some"]["total"] == 0
+
+    def test_invalid_field(self, psi):
+        psi.write_text("full avg10=foo avg60=1.00\n")
+        assert read_psi() == {"full": {"avg60": 1.0}}
+
+    def test_not_available(self, tmp_path):
+        assert read_psi(tmp_path / "missing") is None
+
+
+class TestReadMemoryEvents:
+    def test_parse(self, cgroup):
+        (cgroup / "memory.events").write_text("max 3\noom_kill 1\nfoo bar\n")
+        assert read_memory_events(cgroup) == {"max": 3, "oom_kill": 1}
+
+    def test_no_cgroup(self):
+        assert read_memory_events(None) == {}
+
+
+class TestPressureMonitor:
+    def test_no_throttling_without_pressure(self, monitor, runtime):
+        for _ in range(5):
+            monitor.check()
+        runtime.pause.assert_not_called()
+        assert monitor.get_metadata() == {"episodes": [], "throttled_time": 0}
+
+    def test_sustained_pressure(self, monitor, psi, runtime):
+        psi.write_text(psi_text(30))
+        monitor.check()
+        runtime.pause.assert_not_called()
+        monitor.check()
+        runtime.pause.assert_called()
+        runtime.resume.assert_called()
+        assert monitor.episode.action == "pause"
+        assert monitor.episode.peak == 30
+
+    def test_release(self, monitor, psi):
+        psi.write_text(psi_text(30))
+        monitor.check()
+        monitor.check()
+        psi.write_text(psi_text(40))
+        monitor.check()
+        psi.write_text(psi_text(1))
+        monitor.check()
+        assert monitor.episode
+        monitor.check()
+        assert not monitor.episode
+        [episode] = monitor.get_metadata()["episodes"]
+        assert episode["action"] == "pause"
+        assert episode["peak_full_avg10"] == 40
+
+    def test_moderate_pressure_keeps_throttling(self, monitor, psi):
+        psi.write_text(psi_text(30))
+        monitor.check()
+        monitor.check()
+        psi.write_text(psi_text(8))
+        for _ in range(3):
+            monitor.check()
+        assert monitor.episode
+
+    def test_cgroup_of_the_runtime(self, monitor, cgroup):
+        assert monitor.cgroup == cgroup
+
+    def test_memory_limit(self, monitor, cgroup, runtime):
+        (cgroup / "memory.events").write_text("max 1\n")
+        monitor.check()
+        runtime.pause.assert_called()
+
+    def test_pause_not_supported(self, monitor, psi, runtime):
+        runtime.pause.return_value = False
+        psi.write_text(psi_text(30))
+        monitor.check()
+        monitor.check()
+        runtime.resume.assert_not_called()
+        assert monitor.episode.action == "none"
+
+    def test_thread(self, psi, cgroup, runtime):
+        psi.write_text(psi_text(30))
+        with PressureMonitor(
+            runtime, interval=0.01, sustain=1, pause_duration=0
+        ) as monitor:
+            deadline = time.time() + 5
+            while not runtime.pause.called:
+                assert time.time() < deadline
+                time.sleep(0.01)
+        assert monitor.thread is None
+        [episode] = monitor.get_metadata()["episodes"]
+        assert episode["duration"] >= 0
+
+
+class TestJobserverThrottling:
+    @pytest.fixture
+    def jobserver(self, tmp_path):
+        jobserver = MagicMock()
+        jobserver.fifo = tmp_path / "fifo"
+        os.mkfifo(str(jobserver.fifo))
+        fd = os.open(str(jobserver.fifo), os.O_RDWR | os.O_NONBLOCK)
+        os.write(fd, b"+" * 7)
+        yield jobserver
+        os.close(fd)
+
+    @pytest.fixture
+    def monitor(self, psi, cgroup, runtime, jobserver):
+        monitor = PressureMonitor(runtime, jobserver=jobserver, jobs=8, sustain=1)
+        monitor.events = {}
+        psi.write_text(psi_text(30))
+        return monitor
+
+    def test_withholds_slots(self, monitor, runtime):
+        monitor.check()
+        assert monitor.held == 3
+        monitor.check()
+        assert monitor.held == 5
+        runtime.pause.assert_not_called()
+        assert monitor.episode.action == "jobserver"
+
+    def test_keeps_one_slot(self, monitor):
+        for _ in range(10):
+            monitor.check()
+        assert monitor.held == 7
+
+    def test_slots_in_use(self, monitor):
+        os.read(os.open(str(monitor.jobserver.fifo), os.O_RDWR), 7)
+        monitor.check()
+        assert monitor.held == 0
+
+    def test_returns_slots_on_stop(self, monitor):
+        monitor.check()
+        fifo = monitor.fifo
+        monitor.stop()
+        assert monitor.held == 0
+        assert monitor.fifo is None
+        fd = os.open(str(monitor.jobserver.fifo), os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            assert os.read(fd, 1024) == b"+" * 7
+        finally:
+            os.close(fd)
+        with pytest.raises(OSError):
+            os.close(fifo)
+
+
+def test_episode_in_progress():
+    episode = Episode(time.time() - 2, "pause")
+    assert episode.as_dict(episode.start)["duration"] >= 2
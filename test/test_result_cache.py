@@ -0,0 +1,320 @@
+import json
+import os
+
+import pytest
+
+from tuxmake import result_cache
+from tuxmake.build import Build
+from tuxmake.result_cache import ResultCache
+from tuxmake.result_cache import enabled
+from tuxmake.result_cache import fingerprint
+from tuxmake.result_cache import get_cache_dir
+from tuxmake.result_cache import get_config_input
+from tuxmake.result_cache import get_max_size
+from tuxmake.result_cache import get_tree_hash
+
+
+@pytest.fixture
+def repo(linux_git):
+    return linux_git
+
+
+class TestSettings:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_RESULT_CACHE", raising=False)
+        assert not enabled()
+
+    def test_enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE", "true")
+        assert enabled()
+
+    def test_cache_dir(self, home, monkeypatch):
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        monkeypatch.delenv("TUXMAKE_RESULT_CACHE_DIR", raising=False)
+        assert get_cache_dir() == home / ".cache" / "tuxmake" / "results"
+
+    def test_cache_dir_from_environment(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE_DIR", str(tmp_path))
+        assert get_cache_dir() == tmp_path
+
+    def test_max_size(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_RESULT_CACHE_SIZE", raising=False)
+        assert get_max_size() == 20 * 2**30
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE_SIZE", "1M")
+        assert get_max_size() == 2**20
+
+
+class TestGetTreeHash:
+    def test_clean(self, repo):
+        tree = get_tree_hash(repo)
+        assert len(tree) == 40
+
+    def test_modified(self, repo):
+        (repo / "Makefile").write_text("# modified\n")
+        assert get_tree_hash(repo) is None
+
+    def test_untracked(self, repo):
+        (repo / "new.c").write_text("int x;\n")
+        assert get_tree_hash(repo) is None
+
+    def test_not_a_git_repository(self, tmp_path):
+        assert get_tree_hash(tmp_path) is None
+
+    def test_no_git(self, repo, mocker):
+        mocker.patch("subprocess.check_output", side_effect=FileNotFoundError())
+        assert get_tree_hash(repo) is None
+
+
+class TestGetConfigInput:
+    def test_make_target(self):
+        assert get_config_input("defconfig", {}) == "defconfig"
+
+    def test_local_file(self, tmp_path):
+        config = tmp_path / "config"
+        config.write_text("CONFIG_FOO=y\n")
+        first = get_config_input(str(config), {})
+        config.write_text("CONFIG_FOO=n\n")
+        assert get_config_input(str(config), {}) != first
+
+    def test_download(self):
+        url = "https://example.com/config"
+        a = get_config_input(url, {url: "CONFIG_FOO=y\n"})
+        b = get_config_input(url, {url: "CONFIG_FOO=n\n"})
+        assert a != b
+
+
+class TestFingerprint:
+    def test_basics(self, repo, image_id):
+        build = Build(tree=repo, targets=["config"])
+        assert len(fingerprint(build)) == 64
+
+    def test_same_inputs(self, repo, image_id):
+        a = Build(tree=repo, targets=["config"])
+        b = Build(tree=repo, targets=["config"])
+        assert a.build_dir != b.build_dir
+        assert fingerprint(a) == fingerprint(b)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"targets": ["config", "kernel"]},
+            {"target_arch": "arm64"},
+            {"kconfig": "tinyconfig"},
+            {"kconfig_add": ["CONFIG_FOO=y"]},
+            {"make_variables": {"W": "1"}},
+            {"environment": {"FOO": "bar"}},
+            {"compression_type": "none"},
+            {"kernel_image": "Image"},
+        ],
+    )
+    def test_different_inputs(self, repo, image_id, kwargs):
+        base = Build(tree=repo, targets=["config"])
+        other = Build(tree=repo, **{"targets": ["config"], **kwargs})
+        assert fingerprint(base) != fingerprint(other)
+
+    def test_different_image(self, repo, image_id):
+        build = Build(tree=repo, targets=["config"])
+        first = fingerprint(build)
+        image_id.return_value = "sha256:4567"
+        assert fingerprint(build) != first
+
+    def test_different_tree(self, repo, image_id, git):
+        build = Build(tree=repo, targets=["config"])
+        first = fingerprint(build)
+        (repo / "Makefile").write_text("# modified\n")
+        git(repo, "commit", "--quiet", "--all", "--message=change")
+        assert fingerprint(build) != first
+
+    def test_no_image_id(self, repo):
+        assert fingerprint(Build(tree=repo, targets=["config"])) is None
+
+    def test_dirty_tree(self, repo, image_id):
+        (repo / "Makefile").write_text("# modified\n")
+        assert fingerprint(Build(tree=repo, targets=["config"])) is None
+
+    def test_existing_config(self, repo, image_id, tmp_path):
+        build_dir = tmp_path / "build"
+        build_dir.mkdir()
+        (build_dir / ".config").touch()
+        build = Build(tree=repo, targets=["config"], build_dir=build_dir)
+        assert fingerprint(build) is None
+
+
+def make_result(output_dir, artifacts):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, content in artifacts.items():
+        (output_dir / name).write_text(content)
+    metadata = {
+        "results": {
+            "artifacts": {"log": ["build.log"], "config": list(artifacts)},
+        }
+    }
+    (output_dir / "build.log").write_text("log\n")
+    (output_dir / "metadata.json").write_text(json.dumps(metadata))
+    return output_dir
+
+
+class TestResultCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ResultCache(tmp_path / "cache", max_size=2**20)
+
+    def test_miss(self, cache, tmp_path):
+        assert cache.restore("abc", tmp_path / "output") is None
+
+    def test_store_and_restore(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "CONFIG_FOO=y\n"})
+        cache.store("abc", tmp_path / "build")
+        output = tmp_path / "output"
+        output.mkdir()
+        metadata = cache.restore("abc", output)
+        assert metadata["results"]["artifacts"]["config"] == ["config"]
+        assert (output / "config").read_text() == "CONFIG_FOO=y\n"
+        assert not (output / "build.log").exists()
+
+    def test_store_existing(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "1"})
+        cache.store("abc", tmp_path / "build")
+        make_result(tmp_path / "build", {"config": "2"})
+        cache.store("abc", tmp_path / "build")
+        cache.restore("abc", tmp_path)
+        assert (tmp_path / "config").read_text() == "1"
+
+    def test_store_failure(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "1"})
+        (tmp_path / "build" / "config").unlink()
+        cache.store("abc", tmp_path / "build")
+        assert list(cache.directory.iterdir()) == []
+
+    def test_restore_failure(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "1"})
+        cache.store("abc", tmp_path / "build")
+        (cache.directory / "abc" / "config").unlink()
+        assert cache.restore("abc", tmp_path / "output") is None
+
+    def test_restore_updates_mtime(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "1"})
+        cache.store("abc", tmp_path / "build")
+        entry = cache.directory / "abc"
+        os.utime(str(entry), (0, 0))
+        cache.restore("abc", tmp_path / "output")
+        assert entry.stat().st_mtime > 0
+
+    def test_evicts_least_recently_used(self, cache, tmp_path):
+        cache.max_size = 2500
+        for mtime, key in enumerate(("b", "a", "c")):
+            make_result(tmp_path / key, {"config": "x" * 1000})
+            cache.store(key, tmp_path / key)
+            os.utime(str(cache.directory / key), (mtime, mtime))
+        remaining = sorted(e.name for e in cache.directory.iterdir() if e.is_dir())
+        assert remaining == ["a", "c"]
+
+    def test_does_not_evict_new_result(self, cache, tmp_path):
+        cache.max_size = 2500
+        future = 2**32
+        for mtime, key in enumerate(("a", "b")):
+            make_result(tmp_path / key, {"config": "x" * 1000})
+            cache.store(key, tmp_path / key)
+            os.utime(str(cache.directory / key), (future + mtime, future + mtime))
+        make_result(tmp_path / "c", {"config": "x" * 1000})
+        cache.store("c", tmp_path / "c")
+        remaining = sorted(e.name for e in cache.directory.iterdir() if e.is_dir())
+        assert remaining == ["b", "c"]
+
+    def test_evict_uses_recorded_sizes(self, cache, tmp_path, mocker):
+        make_result(tmp_path / "a", {"config": "x" * 1000})
+        cache.store("a", tmp_path / "a")
+        assert int((cache.directory / "a" / ".size").read_text()) > 1000
+        get_directory_size = mocker.spy(result_cache, "get_directory_size")
+        make_result(tmp_path / "b", {"config": "x" * 1000})
+        cache.store("b", tmp_path / "b")
+        # only for the new entry
+        get_directory_size.assert_called_once()
+
+    def test_evict_entry_without_recorded_size(self, cache, tmp_path):
+        cache.max_size = 1500
+        make_result(tmp_path / "a", {"config": "x" * 1000})
+        cache.store("a", tmp_path / "a")
+        (cache.directory / "a" / ".size").unlink()
+        os.utime(str(cache.directory / "a"), (0, 0))
+        make_result(tmp_path / "b", {"config": "x" * 1000})
+        cache.store("b", tmp_path / "b")
+        remaining = sorted(e.name for e in cache.directory.iterdir() if e.is_dir())
+        assert remaining == ["b"]
+
+    def test_evict_under_limit(self, cache, tmp_path):
+        make_result(tmp_path / "build", {"config": "1"})
+        cache.store("abc", tmp_path / "build")
+        cache.evict()
+        assert (cache.directory / "abc").exists()
+
+
+class TestBuild:
+    @pytest.fixture(autouse=True)
+    def result_cache(self, monkeypatch, tmp_path, image_id):
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE", "true")
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE_DIR", str(tmp_path / "results"))
+
+    def test_disabled(self, repo, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_RESULT_CACHE", "false")
+        build = Build(tree=repo, targets=["config"])
+        assert not build.result_cache
+
+    def test_miss_then_hit(self, repo, mocker):
+        first = Build(tree=repo, targets=["config", "kernel"])
+        first.run()
+        assert first.passed
+        assert first.metadata["results"]["cached"] is False
+
+        second = Build(tree=repo, targets=["config", "kernel"])
+        build_all_targets = mocker.spy(second, "build_all_targets")
+        second.run()
+        build_all_targets.assert_not_called()
+        assert second.passed
+        assert second.status["kernel"].passed
+        results = second.metadata["results"]
+        assert results["cached"] is True
+        assert results["fingerprint"] == first.fingerprint
+        assert results["artifacts"]["kernel"] == first.artifacts["kernel"]
+        assert results["artifacts"]["log"] == ["build.log", "build-debug.log"]
+        for name in first.artifacts["kernel"]:
+            assert (second.output_dir / name).read_bytes() == (
+                first.output_dir / name
+            ).read_bytes()
+        saved = json.loads((second.output_dir / "metadata.json").read_text())
+        assert saved["results"]["cached"] is True
+
+    def test_hit_does_not_start_runtime(self, repo, mocker):
+        download = mocker.patch("tuxmake.build.Build.download_korg_gcc_toolchain")
+        prepare = mocker.patch("tuxmake.build.Build.prepare_korg_gcc_toolchain")
+
+        first = Build(tree=repo, targets=["config"])
+        first.prepare_korg_gcc = True
+        start = mocker.spy(first.runtime, "start")
+        first.run()
+        start.assert_called_once()
+        assert download.call_count == prepare.call_count == 1
+
+        second = Build(tree=repo, targets=["config"])
+        second.prepare_korg_gcc = True
+        start = mocker.spy(second.runtime, "start")
+        second.run()
+        assert second.cached
+        start.assert_not_called()
+        assert download.call_count == prepare.call_count == 1
+        assert "prepare_image" in second.metadata["results"]["duration"]
+
+    def test_failed_builds_are_not_stored(self, repo):
+        build = Build(
+            tree=repo, targets=["config", "kernel"], environment={"FAIL": "kernel"}
+        )
+        build.run()
+        assert build.failed
+        assert not list((get_cache_dir()).glob("[0-9a-f]*"))
+
+    def test_uncacheable(self, repo, mocker):
+        mocker.patch("tuxmake.result_cache.get_tree_hash", return_value=None)
+        build = Build(tree=repo, targets=["config"])
+        build.run()
+        assert build.fingerprint is None
+        assert not get_cache_dir().exists()
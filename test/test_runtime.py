@@ -1,11 +1,22 @@
+import json
+import os
 import re
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import pytest
 
+from tuxmake import cache
+from tuxmake.agent import AgentError
 from tuxmake.build import Build
+from tuxmake.engine import EngineClient
+from tuxmake.engine import EngineError
 from tuxmake.exceptions import InvalidRuntimeError
 from tuxmake.exceptions import RuntimePreparationFailed
 from tuxmake.exceptions import RuntimeNotFoundError
+from tuxmake.exceptions import UnsupportedOverlayBackend
 from tuxmake.runtime import Runtime
 from tuxmake.runtime import NullRuntime
 from tuxmake.runtime import DockerRuntime
@@ -13,6 +24,8 @@ from tuxmake.runtime import DockerLocalRuntime
 from tuxmake.runtime import PodmanRuntime
 from tuxmake.runtime import PodmanLocalRuntime
 from tuxmake.runtime import Terminated
+from tuxmake.runtime import get_command_version
+from tuxmake.runtime import read_sysctl
 
 
 @pytest.fixture
@@ -91,6 +104,18 @@ class TestNullRuntime:
         runtime = NullRuntime()
         assert "gcc" in runtime.toolchains
 
+    def test_no_image_id(self):
+        assert NullRuntime().get_image_id() is None
+
+    def test_no_pause(self):
+        runtime = NullRuntime()
+        assert not runtime.pause()
+        runtime.resume()
+
+    def test_cgroup(self, mocker):
+        mocker.patch("tuxmake.runtime.get_cgroup", return_value=Path("/cg"))
+        assert NullRuntime().get_cgroup() == Path("/cg")
+
 
 @pytest.fixture
 def container_id():
@@ -132,37 +157,126 @@ class TestGetImage:
 
 @pytest.fixture()
 def version_check(mocker):
-    return mocker.patch("subprocess.run")
+    return mocker.patch(
+        "tuxmake.runtime.get_command_version",
+        return_value="Docker version 20.10.5, build 55c4c88",
+    )
+
+
+@pytest.fixture
+def tmpfs(monkeypatch, tmp_path):
+    d = tmp_path / "shm"
+    d.mkdir()
+    monkeypatch.setenv("TUXMAKE_TMPFS_DIR", str(d))
+    monkeypatch.setenv("TUXMAKE_OVERLAY_SIZE", "1M")
+    return d
+
+
+def inspect_output(image_id="sha256:0123", digests=None, tags=None):
+    return json.dumps(
+        {"Id": image_id, "RepoDigests": digests, "RepoTags": tags}
+    ).encode()
 
 
 class TestDockerRuntime(TestContainerRuntime):
     def test_docker_not_installed(self, get_image, mocker):
         get_image.return_value = "tuxmake/theimage"
-        mocker.patch(
-            "subprocess.run",
-            side_effect=FileNotFoundError(),
-        )
+        mocker.patch("shutil.which", return_value=None)
         with pytest.raises(RuntimeNotFoundError) as exc:
             DockerRuntime().prepare()
         assert "docker" in str(exc)
 
-    def test_get_metadata(self, get_image, mocker):
+    def test_get_metadata(self, get_image, mocker, version_check):
         get_image.return_value = "tuxmake/theimage"
         mocker.patch(
             "subprocess.check_output",
-            return_value=b'["tuxmake/theimage@sha256:deadbeef"]||["tuxmake:latest", "tuxmake:test-tag"]\n',
+            return_value=inspect_output(
+                digests=["tuxmake/theimage@sha256:deadbeef"],
+                tags=["tuxmake:latest", "tuxmake:test-tag"],
+            ),
         )
         metadata = DockerRuntime().get_metadata()
+        assert metadata["version"] == "Docker version 20.10.5, build 55c4c88"
         assert metadata["image_name"] == "tuxmake/theimage"
         assert metadata["image_digest"] == "tuxmake/theimage@sha256:deadbeef"
         assert metadata["image_tag"] == "tuxmake:test-tag"
 
+    def test_get_image_id(self, get_image, mocker):
+        get_image.return_value = "myimage"
+        check_output = mocker.patch(
+            "subprocess.check_output", return_value=inspect_output()
+        )
+        runtime = Runtime.get("docker")
+        assert runtime.get_image_id() == "sha256:0123"
+        assert runtime.get_image_id() == "sha256:0123"
+        assert check_output.call_count == 1
+        assert check_output.call_args[0][0][0:3] == ["docker", "image", "inspect"]
+
+    def test_image_inspection_not_cached_across_builds(self, get_image, mocker):
+        get_image.return_value = "myimage"
+        cache.set(["docker", "pull", "myimage"], 1614000983)
+        check_output = mocker.patch(
+            "subprocess.check_output", return_value=inspect_output()
+        )
+        assert DockerRuntime().get_image_id() == "sha256:0123"
+        # the tag now points to a different image, e.g. rebuilt locally
+        check_output.return_value = inspect_output("sha256:4567")
+        assert DockerRuntime().get_image_id() == "sha256:4567"
+
+    def test_get_image_size(self, mocker):
+        check_output = mocker.patch(
+            "subprocess.check_output", return_value=b"1234567\n"
+        )
+        assert DockerRuntime().get_image_size("myimage") == 1234567
+        assert "--format={{.Size}}" in check_output.call_args[0][0]
+
+    def test_quiet_pull(self, mocker):
+        check_call = mocker.patch("subprocess.check_call")
+        DockerRuntime().pull_image("myimage", quiet=True)
+        check_call.assert_called_with(
+            ["docker", "pull", "--quiet", "myimage"], stdout=subprocess.DEVNULL
+        )
+
+    def test_get_metadata_without_digests_or_tags(self, get_image, mocker):
+        get_image.return_value = "myimage"
+        mocker.patch("subprocess.check_output", return_value=inspect_output())
+        mocker.patch("tuxmake.runtime.get_command_version", return_value="docker")
+        metadata = DockerRuntime().get_metadata()
+        assert metadata["image_digest"] is None
+        assert metadata["image_tag"] is None
+
+    def test_get_image_id_missing_image(self, get_image, mocker):
+        get_image.return_value = "myimage"
+        mocker.patch(
+            "subprocess.check_output",
+            side_effect=subprocess.CalledProcessError(1, ["docker"]),
+        )
+        assert Runtime.get("docker").get_image_id() is None
+
     def test_prepare(self, get_image, mocker, version_check):
         get_image.return_value = "myimage"
         check_call = mocker.patch("subprocess.check_call")
         DockerRuntime().prepare()
         check_call.assert_called_with(["docker", "pull", "myimage"])
 
+    def test_setup_does_not_start_container(self, get_image, mocker, version_check):
+        get_image.return_value = "myimage"
+        check_call = mocker.patch("subprocess.check_call")
+        start_container = mocker.patch("tuxmake.runtime.DockerRuntime.start_container")
+        DockerRuntime().setup()
+        check_call.assert_called_with(["docker", "pull", "myimage"])
+        start_container.assert_not_called()
+
+    def test_start_failure(self, get_image, mocker):
+        get_image.return_value = "myimage"
+        mocker.patch(
+            "tuxmake.runtime.DockerRuntime.start_container",
+            side_effect=subprocess.CalledProcessError(1, ["docker"]),
+        )
+        with pytest.raises(RuntimePreparationFailed) as exc:
+            DockerRuntime().start()
+        assert "myimage" in str(exc)
+
     def test_prepare_pull_only_once_a_day(self, get_image, mocker, version_check):
         get_image.return_value = "myimage"
         check_call = mocker.patch("subprocess.check_call")
@@ -205,6 +319,55 @@ class TestDockerRuntime(TestContainerRuntime):
         assert runtime.container_id is None
         runtime.cleanup()  # if this doesn't crash we are good
 
+    def test_pause(self, container_id, mocker):
+        call = mocker.patch("subprocess.call", return_value=0)
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert runtime.pause()
+        assert call.call_args[0][0] == ["docker", "pause", container_id]
+        runtime.resume()
+        assert call.call_args[0][0] == ["docker", "unpause", container_id]
+
+    def test_pause_fails(self, container_id, mocker):
+        mocker.patch("subprocess.call", return_value=1)
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert not runtime.pause()
+
+    def test_pause_before_container_exists(self):
+        assert not DockerRuntime().pause()
+
+    def test_cgroup(self, container_id, mocker):
+        check_output = mocker.patch("subprocess.check_output", return_value="4321\n")
+        get_cgroup = mocker.patch(
+            "tuxmake.runtime.get_cgroup", return_value=Path("/cg")
+        )
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert runtime.get_cgroup() == Path("/cg")
+        cmd = check_output.call_args[0][0]
+        assert cmd[0:2] == ["docker", "inspect"]
+        assert cmd[-1] == container_id
+        get_cgroup.assert_called_with("4321")
+
+    def test_cgroup_before_container_exists(self):
+        assert DockerRuntime().get_cgroup() is None
+
+    def test_cgroup_container_not_running(self, container_id, mocker):
+        mocker.patch("subprocess.check_output", return_value="0\n")
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert runtime.get_cgroup() is None
+
+    def test_cgroup_inspect_fails(self, container_id, mocker):
+        mocker.patch(
+            "subprocess.check_output",
+            side_effect=subprocess.CalledProcessError(1, ["docker"]),
+        )
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert runtime.get_cgroup() is None
+
     def test_get_command_line(self):
         cmd = DockerRuntime().get_command_line(["date"], False)
         assert cmd[0:2] == ["docker", "exec"]
@@ -330,6 +493,48 @@ class TestDockerRuntime(TestContainerRuntime):
         volume_opt = runtime.volume_opt("src", "tgt", overlay, ro)
         assert volume_opt == "--volume=src:tgt:ro"
 
+    def test_overlay_on_disk(self, tmp_path):
+        runtime = DockerRuntime()
+        runtime.output_dir = tmp_path
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        assert f"upperdir={tmp_path}/overlay/uppperdir" in volume_opt
+        assert (tmp_path / "overlay" / "workdir").is_dir()
+
+    def test_overlay_on_tmpfs(self, tmp_path, tmpfs, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "tmpfs")
+        runtime = DockerRuntime()
+        runtime.output_dir = tmp_path
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        assert runtime.overlay_dir.parent == tmpfs
+        assert f"upperdir={runtime.overlay_dir}/uppperdir" in volume_opt
+        assert not (tmp_path / "overlay").exists()
+        overlay_dir = runtime.overlay_dir
+        runtime.cleanup()
+        assert not overlay_dir.exists()
+
+    def test_overlay_on_tmpfs_does_not_fit(self, tmp_path, tmpfs, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "tmpfs")
+        monkeypatch.setenv("TUXMAKE_OVERLAY_SIZE", "1T")
+        runtime = DockerRuntime()
+        runtime.output_dir = tmp_path
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        assert f"upperdir={tmp_path}/overlay/uppperdir" in volume_opt
+
+    def test_overlay_read_only(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "ro")
+        runtime = DockerRuntime()
+        runtime.output_dir = tmp_path
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        assert volume_opt == "--volume=src:tgt:ro"
+        assert runtime.overlay_dir is None
+
+    def test_invalid_overlay_backend(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "nfs")
+        runtime = DockerRuntime()
+        runtime.output_dir = tmp_path
+        with pytest.raises(UnsupportedOverlayBackend):
+            runtime.volume_opt("src", "tgt", overlay=True)
+
     def test_korg_gcc_toolchain_full_version(self):
         version = DockerRuntime().get_toolchain_full_version("korg-gcc-14")
         assert version == "14.2.0"
@@ -363,10 +568,16 @@ class TestDockerRuntimeOfflineAvailable(FakeGetImage):
         )
         mocker.patch("tuxmake.runtime.ContainerRuntime.prepare_image")
         r = DockerRuntime()
-        mocker.patch("tuxmake.runtime.Runtime.prepare")
+        mocker.patch("tuxmake.runtime.Runtime.setup")
         r.prepare()
         return r
 
+    @pytest.fixture(autouse=True)
+    def get_image_id(self, mocker):
+        return mocker.patch(
+            "tuxmake.runtime.ContainerRuntime.get_image_id", return_value=None
+        )
+
     def test_offline_available(self, runtime, mocker):
         mocker.patch("subprocess.check_output")
         assert runtime.offline_available
@@ -382,24 +593,454 @@ class TestDockerRuntimeOfflineAvailable(FakeGetImage):
         _, stderr = capsys.readouterr()
         assert re.match("W:.*(some error)", stderr)
 
+    def test_probe_cached_per_image(self, container_id, mocker, get_image_id):
+        get_image_id.return_value = "sha256:0123"
+        check_output = mocker.patch("subprocess.check_output")
+        assert DockerRuntime().offline_available
+        assert DockerRuntime().offline_available
+        assert check_output.call_count == 1
+
+        get_image_id.return_value = "sha256:4567"
+        assert DockerRuntime().offline_available
+        assert check_output.call_count == 2
+
+    def test_negative_probe_cached(self, container_id, mocker, get_image_id, capsys):
+        get_image_id.return_value = "sha256:0123"
+        check_output = mocker.patch(
+            "subprocess.check_output",
+            side_effect=subprocess.CalledProcessError(
+                1, ["true"], output=b"some error"
+            ),
+        )
+        assert not DockerRuntime().offline_available
+        assert not DockerRuntime().offline_available
+        assert check_output.call_count == 1
+        _, stderr = capsys.readouterr()
+        assert len(re.findall("W:.*(some error)", stderr)) == 2
+
+    def test_probe_cache_invalidated_by_userns_settings(
+        self, container_id, mocker, get_image_id
+    ):
+        get_image_id.return_value = "sha256:0123"
+        check_output = mocker.patch("subprocess.check_output")
+        read_sysctl = mocker.patch("tuxmake.runtime.read_sysctl", return_value="1")
+        assert DockerRuntime().offline_available
+        read_sysctl.return_value = "0"
+        assert DockerRuntime().offline_available
+        assert check_output.call_count == 2
+
+
+class TestGetCommandVersion:
+    @pytest.fixture
+    def command(self, tmp_path, monkeypatch):
+        binary = tmp_path / "mydocker"
+        binary.write_text("#!/bin/sh\necho 'mydocker version 1.0'\n")
+        binary.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+        return binary
+
+    def test_version(self, command):
+        assert get_command_version("mydocker") == "mydocker version 1.0"
+
+    def test_cached(self, command, mocker):
+        get_command_version("mydocker")
+        run = mocker.spy(subprocess, "run")
+        assert get_command_version("mydocker") == "mydocker version 1.0"
+        run.assert_not_called()
+
+    def test_invalidated_when_binary_changes(self, command):
+        get_command_version("mydocker")
+        command.write_text("#!/bin/sh\necho 'mydocker version 2.0'\n")
+        os.utime(command, ns=(0, 0))
+        assert get_command_version("mydocker") == "mydocker version 2.0"
+
+    def test_failure_not_cached(self, command, mocker):
+        command.write_text("#!/bin/sh\nexit 1\n")
+        get_command_version("mydocker")
+        run = mocker.spy(subprocess, "run")
+        get_command_version("mydocker")
+        assert run.call_count == 1
+
+    def test_not_installed(self):
+        with pytest.raises(RuntimeNotFoundError):
+            get_command_version("does-not-exist")
+
+
+def test_read_sysctl():
+    assert read_sysctl("kernel/ostype") == "Linux"
+    assert read_sysctl("does/not/exist") == "-"
+
+
+class TestEngineAPI(TestContainerRuntime):
+    @pytest.fixture(autouse=True)
+    def offline_available(self, mocker):
+        return mocker.patch("tuxmake.runtime.Runtime.offline_available", False)
+
+    @pytest.fixture
+    def runtime(self, fake_engine, get_image, container_id):
+        get_image.return_value = "tuxmake/x86_64_gcc"
+        runtime = DockerRuntime()
+        runtime.container_id = container_id
+        return runtime
+
+    def test_disabled_by_default(self, fake_engine, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_ENGINE_API")
+        assert not DockerRuntime().engine
+
+    def test_not_available(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_ENGINE_API", "true")
+        monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/missing.sock")
+        assert not DockerRuntime().engine
+
+    def test_run_cmd(self, runtime, mocker, fake_engine):
+        logger = mocker.Mock()
+        assert runtime.run_cmd(["sh", "-c", "echo foo; echo bar"], logger=logger)
+        logger.assert_has_calls([mocker.call("foo\n"), mocker.call("bar\n")])
+        assert ("POST", "/containers/0123456789abcdef/exec") in fake_engine.requests
+
+    def test_run_cmd_from_several_threads(self, runtime, fake_engine):
+        def run(n):
+            output = []
+            assert runtime.run_cmd(["echo", str(n)], logger=output.append)
+            return output
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(run, range(8)))
+        assert results == [[f"{n}\n"] for n in range(8)]
+
+    def test_engine_probed_once(self, fake_engine, mocker):
+        connect = mocker.spy(EngineClient, "connect")
+        runtime = DockerRuntime()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            engines = list(executor.map(lambda _: runtime.engine, range(8)))
+        assert connect.call_count == 1
+        assert all(e is engines[0] for e in engines)
+        assert engines[0]
+
+    def test_run_cmd_failure(self, runtime):
+        assert not runtime.run_cmd(["false"])
+        assert runtime.run_cmd(["false"], expect_failure=True)
+
+    def test_run_cmd_stdout(self, runtime, tmp_path):
+        output = tmp_path / "output"
+        with output.open("w") as f:
+            assert runtime.run_cmd(["sh", "-c", "echo foo; echo bar >&2"], stdout=f)
+        assert output.read_text() == "foo\nbar\n"
+
+    def test_run_cmd_devnull(self, runtime, mocker):
+        logger = mocker.Mock()
+        assert runtime.run_cmd(
+            ["echo", "foo"], stdout=subprocess.DEVNULL, logger=logger
+        )
+        logger.assert_not_called()
+
+    def test_run_cmd_interactive(self, runtime, mocker):
+        run_cmd = mocker.patch("tuxmake.runtime.Runtime.run_cmd")
+        runtime.run_cmd(["bash"], interactive=True)
+        assert run_cmd.call_args[1]["interactive"]
+
+    def test_run_cmd_fallback(self, runtime, mocker):
+        run_cmd = mocker.patch("tuxmake.runtime.Runtime.run_cmd", return_value=True)
+        runtime.container_id = "missing"
+        assert runtime.run_cmd(["true"])
+        run_cmd.assert_called()
+
+    def test_run_cmd_stream_error(self, runtime, mocker, capsys):
+        mocker.patch(
+            "tuxmake.engine.EngineClient.start_exec",
+            side_effect=EngineError("connection reset"),
+        )
+        assert not runtime.run_cmd(["true"])
+        out, _ = capsys.readouterr()
+        assert "E: connection reset" in out
+
+    def test_pull(self, runtime, mocker, fake_engine):
+        check_call = mocker.patch("subprocess.check_call")
+        runtime.prepare_image()
+        assert fake_engine.pulled == ["tuxmake/x86_64_gcc:latest"]
+        check_call.assert_not_called()
+
+    def test_pull_fallback(self, runtime, mocker, get_image, fake_engine):
+        check_call = mocker.patch("subprocess.check_call")
+        get_image.return_value = "invalid/image"
+        runtime.prepare_image()
+        check_call.assert_called_with(["docker", "pull", "invalid/image"])
+
+    def test_get_image_id(self, runtime, mocker):
+        check_output = mocker.patch("subprocess.check_output")
+        assert runtime.get_image_id() == "sha256:0123456789abcdef"
+        check_output.assert_not_called()
+
+    def test_get_image_size(self, runtime):
+        assert runtime.get_image_size("tuxmake/x86_64_gcc") == 1234567
+
+    def test_get_image_size_fallback(self, runtime, mocker):
+        mocker.patch("subprocess.check_output", return_value=b"7654321\n")
+        assert runtime.get_image_size("tuxmake/missing") == 7654321
+
+    def test_get_image_id_fallback(self, runtime, get_image, mocker):
+        get_image.return_value = "tuxmake/missing"
+        mocker.patch(
+            "subprocess.check_output", return_value=inspect_output("sha256:4567")
+        )
+        assert runtime.get_image_id() == "sha256:4567"
+
+    def test_get_metadata(self, runtime, mocker):
+        check_output = mocker.patch("subprocess.check_output")
+        metadata = runtime.get_metadata()
+        assert metadata["version"] == "Docker version 20.10.5, build 55c4c88"
+        assert metadata["image_digest"] == "tuxmake/x86_64_gcc@sha256:fedcba9876543210"
+        assert metadata["image_tag"] == "tuxmake/x86_64_gcc:20"
+        check_output.assert_not_called()
+
+    def test_get_metadata_fallback(self, runtime, get_image, mocker):
+        get_image.return_value = "tuxmake/missing"
+        mocker.patch("tuxmake.engine.EngineClient.version", side_effect=EngineError())
+        mocker.patch("tuxmake.runtime.get_command_version", return_value="docker 20")
+        mocker.patch(
+            "subprocess.check_output",
+            return_value=inspect_output(digests=["x@sha256:00"]),
+        )
+        metadata = runtime.get_metadata()
+        assert metadata["version"] == "docker 20"
+        assert metadata["image_digest"] == "x@sha256:00"
+
+    def test_cleanup(self, runtime, mocker, fake_engine, container_id):
+        call = mocker.patch("subprocess.call")
+        runtime.cleanup()
+        assert fake_engine.stopped == [container_id]
+        call.assert_not_called()
+
+    def test_cleanup_fallback(self, runtime, mocker, fake_engine):
+        call = mocker.patch("subprocess.call")
+        runtime.container_id = "missing-container"
+        mocker.patch(
+            "tuxmake.engine.EngineClient.stop", side_effect=EngineError("boom")
+        )
+        runtime.cleanup()
+        assert call.call_args[0][0] == ["docker", "stop", "missing-container"]
+
+
+class TestContainerAgent(TestContainerRuntime):
+    @pytest.fixture(autouse=True)
+    def offline_available(self, mocker):
+        return mocker.patch("tuxmake.runtime.Runtime.offline_available", False)
+
+    @pytest.fixture
+    def enabled(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_CONTAINER_AGENT", "true")
+
+    @pytest.fixture
+    def runtime(self, local_agent, container_id):
+        runtime = DockerRuntime()
+        runtime.container_id = container_id
+        runtime.agent = local_agent
+        return runtime
+
+    def test_disabled_by_default(self, spawn_container):
+        runtime = DockerRuntime()
+        runtime.start_container()
+        cmd = spawn_container.call_args[0][0]
+        assert cmd[-2:] == ["sleep", "1d"]
+        assert runtime.agent is None
+
+    def test_start_container(self, enabled, spawn_container, mocker):
+        mocker.patch("tuxmake.agent.AgentClient.wait", return_value=True)
+        runtime = DockerRuntime()
+        runtime.start_container()
+        cmd = spawn_container.call_args[0][0]
+        directory = runtime.agent.directory
+        assert f"--volume={directory}:{directory}:rw" in cmd
+        assert "/tuxmake/tuxmake-agent" in cmd
+        assert str(runtime.agent.socket_path) in cmd
+        assert cmd[-2:] == ["sleep", "1d"]
+        mocker.patch("subprocess.call")
+        runtime.cleanup()
+        assert not directory.exists()
+
+    def test_agent_does_not_start(self, enabled, spawn_container, mocker, capsys):
+        mocker.patch("tuxmake.agent.AgentClient.wait", return_value=False)
+        runtime = DockerRuntime()
+        runtime.start_container()
+        assert runtime.agent is None
+        _, stderr = capsys.readouterr()
+        assert "agent did not start" in stderr
+
+    def test_run_cmd(self, runtime, mocker):
+        logger = mocker.Mock()
+        Popen = mocker.patch("subprocess.Popen")
+        assert runtime.run_cmd(["sh", "-c", "echo foo; echo bar"], logger=logger)
+        logger.assert_has_calls([mocker.call("foo\n"), mocker.call("bar\n")])
+        Popen.assert_not_called()
+
+    def test_run_cmd_failure(self, runtime):
+        assert not runtime.run_cmd(["false"])
+
+    def test_run_cmd_interactive(self, runtime, mocker):
+        run_cmd = mocker.patch("tuxmake.runtime.Runtime.run_cmd")
+        runtime.run_cmd(["bash"], interactive=True)
+        assert run_cmd.call_args[1]["interactive"]
+
+    def test_agent_gone(self, runtime, mocker, tmp_path):
+        run_cmd = mocker.patch("tuxmake.runtime.Runtime.run_cmd", return_value=True)
+        runtime.agent.socket_path = tmp_path / "gone.sock"
+        assert runtime.run_cmd(["true"])
+        run_cmd.assert_called()
+        assert runtime.agent is None
+
+    def test_lost_agent(self, runtime, mocker, capsys):
+        mocker.patch(
+            "tuxmake.agent.AgentClient.run", side_effect=AgentError("lost agent")
+        )
+        assert not runtime.run_cmd(["true"])
+        out, _ = capsys.readouterr()
+        assert "E: lost agent" in out
+
+
+def can_unshare_net():
+    try:
+        subprocess.check_call(
+            ["unshare", "--net", "--map-root-user", "true"],
+            stderr=subprocess.DEVNULL,
+        )
+        return True
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+class TestOfflineSession:
+    @pytest.fixture(autouse=True)
+    def offline_available(self, mocker):
+        return mocker.patch(
+            "tuxmake.runtime.Runtime.offline_available", return_value=True
+        )
+
+    @pytest.fixture
+    def session(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OFFLINE_SESSION", "true")
+
+    @pytest.fixture
+    def start(self, mocker):
+        return mocker.patch(
+            "subprocess.run",
+            return_value=subprocess.CompletedProcess(
+                [], 0, stdout=b"1234 /tmp/tuxmake-offline.xyz\n", stderr=b""
+            ),
+        )
+
+    def test_disabled_by_default(self, start):
+        runtime = NullRuntime()
+        cmd = runtime.get_command_line(["date"], False)
+        assert cmd == [str(runtime.get_go_offline_command()), "date"]
+        start.assert_not_called()
+
+    def test_nsenter(self, session, start):
+        runtime = NullRuntime()
+        cmd = runtime.get_command_line(["date"], False)
+        assert cmd[0] == "nsenter"
+        assert "--target=1234" in cmd
+        assert cmd[-2:] == ["--", "date"]
+
+    def test_started_once(self, session, start):
+        runtime = NullRuntime()
+        runtime.get_command_line(["date"], False)
+        runtime.get_command_line(["date"], False)
+        assert start.call_count == 1
+        assert start.call_args[0][0][-1] == "start"
+
+    def test_started_once_from_several_threads(self, session, start):
+        started = threading.Event()
+
+        def slow_start(*args, **kwargs):
+            started.wait(1)
+            return start.return_value
+
+        start.side_effect = slow_start
+        runtime = NullRuntime()
+        threads = [
+            threading.Thread(target=runtime.get_command_line, args=(["date"], False))
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        started.set()
+        for t in threads:
+            t.join()
+        assert start.call_count == 1
+
+    def test_not_started_for_online_commands(self, session, start):
+        NullRuntime().get_command_line(["date"], False, offline=False)
+        start.assert_not_called()
+
+    def test_fallback(self, session, start, capsys):
+        start.return_value = subprocess.CompletedProcess(
+            [], 1, stdout=b"", stderr=b"boom"
+        )
+        runtime = NullRuntime()
+        cmd = runtime.get_command_line(["date"], False)
+        assert cmd == [str(runtime.get_go_offline_command()), "date"]
+        runtime.get_command_line(["date"], False)
+        assert start.call_count == 1
+        _, stderr = capsys.readouterr()
+        assert re.match("W:.*(boom)", stderr)
+
+    def test_stopped_on_cleanup(self, session, start, mocker):
+        call = mocker.patch("subprocess.call")
+        runtime = NullRuntime()
+        runtime.get_command_line(["date"], False)
+        runtime.cleanup()
+        cmd = call.call_args[0][0]
+        assert cmd[-2:] == ["stop", "/tmp/tuxmake-offline.xyz"]
+
+    def test_not_stopped_when_not_started(self, session, mocker):
+        call = mocker.patch("subprocess.call")
+        NullRuntime().cleanup()
+        call.assert_not_called()
+
+    def test_container_session_goes_away_with_container(
+        self, session, start, mocker, container_id
+    ):
+        call = mocker.patch("subprocess.call")
+        runtime = DockerRuntime()
+        runtime.container_id = container_id
+        runtime.get_command_line(["date"], False)
+        runtime.cleanup()
+        assert call.call_count == 1
+        assert call.call_args[0][0][1] == "stop"
+
+    @pytest.mark.skipif(not can_unshare_net(), reason="no user namespaces")
+    def test_run_cmd(self, session, tmp_path):
+        runtime = NullRuntime()
+        output = tmp_path / "output"
+        with output.open("w") as stdout:
+            assert runtime.run_cmd(["ip", "-o", "link"], stdout=stdout)
+            assert runtime.run_cmd(["ip", "-o", "link"], stdout=stdout)
+        runtime.cleanup()
+        links = output.read_text().splitlines()
+        assert len(links) == 2
+        assert all(link.startswith("1: lo:") for link in links)
+
 
 class TestDockerLocalRuntime(TestContainerRuntime):
     def test_prepare_checks_local_image(self, get_image, mocker, version_check):
         get_image.return_value = "mylocalimage"
-        check_call = mocker.patch("subprocess.check_call")
+        check_output = mocker.patch(
+            "subprocess.check_output", return_value=inspect_output()
+        )
         runtime = DockerLocalRuntime()
 
         runtime.prepare()
-        check_call.assert_called_with(
-            ["docker", "image", "inspect", "mylocalimage"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        assert check_output.call_args[0][0][0:3] == ["docker", "image", "inspect"]
+        assert check_output.call_args[0][0][-1] == "mylocalimage"
+
+        # image information is reused later
+        assert runtime.get_image_id() == "sha256:0123"
+        assert check_output.call_count == 1
 
     def test_prepare_image_not_found(self, get_image, mocker, version_check):
         get_image.return_value = "foobar"
         mocker.patch(
-            "subprocess.check_call",
+            "subprocess.check_output",
             side_effect=subprocess.CalledProcessError(
                 1, ["foo"], stderr="Image not found"
             ),
@@ -418,10 +1059,7 @@ class TestDockerLocalRuntime(TestContainerRuntime):
 class TestPodmanRuntime(TestContainerRuntime):
     def test_podman_not_installed(self, get_image, mocker):
         get_image.return_value = "tuxmake/theimage"
-        mocker.patch(
-            "subprocess.run",
-            side_effect=FileNotFoundError(),
-        )
+        mocker.patch("shutil.which", return_value=None)
         with pytest.raises(RuntimeNotFoundError) as exc:
             PodmanRuntime().prepare()
         assert "podman" in str(exc)
@@ -489,24 +1127,50 @@ class TestPodmanRuntime(TestContainerRuntime):
         volume_opt = runtime.volume_opt("src", "tgt", overlay, ro)
         assert volume_opt == "--volume=src:tgt:ro,z"
 
+    def test_overlay_on_tmpfs(self, tmpfs, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "tmpfs")
+        runtime = PodmanRuntime()
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        overlay_dir = runtime.overlay_dir
+        assert overlay_dir.parent == tmpfs
+        assert volume_opt == (
+            f"--volume=src:tgt:O,upperdir={overlay_dir}/uppperdir,"
+            f"workdir={overlay_dir}/workdir"
+        )
+
+    def test_overlay_on_tmpfs_does_not_fit(self, tmpfs, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "tmpfs")
+        monkeypatch.setenv("TUXMAKE_OVERLAY_SIZE", "1T")
+        runtime = PodmanRuntime()
+        assert runtime.volume_opt("src", "tgt", overlay=True) == "--volume=src:tgt:O"
+
+    def test_overlay_read_only(self, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_OVERLAY_BACKEND", "ro")
+        runtime = PodmanRuntime()
+        volume_opt = runtime.volume_opt("src", "tgt", overlay=True)
+        assert volume_opt == "--volume=src:tgt:ro,z"
+
 
 class TestPodmanLocalRuntime(TestContainerRuntime):
     def test_prepare_checks_local_image(self, get_image, mocker, version_check):
         get_image.return_value = "mylocalimage"
-        check_call = mocker.patch("subprocess.check_call")
+        check_output = mocker.patch(
+            "subprocess.check_output", return_value=inspect_output()
+        )
         runtime = PodmanLocalRuntime()
 
         runtime.prepare()
-        check_call.assert_called_with(
-            ["podman", "image", "inspect", "mylocalimage"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        assert check_output.call_args[0][0][0:3] == ["podman", "image", "inspect"]
+        assert check_output.call_args[0][0][-1] == "mylocalimage"
+
+        # image information is reused later
+        assert runtime.get_image_id() == "sha256:0123"
+        assert check_output.call_count == 1
 
     def test_prepare_image_not_found(self, get_image, mocker, version_check):
         get_image.return_value = "foobar"
         mocker.patch(
-            "subprocess.check_call",
+            "subprocess.check_output",
             side_effect=subprocess.CalledProcessError(
                 1, ["foo"], stderr="Image not found"
             ),
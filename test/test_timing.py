@@ -0,0 +1,98 @@
+import pytest
+
+from tuxmake.timing import parse
+from tuxmake.timing import summarize
+
+
+@pytest.fixture
+def timing_file(tmp_path):
+    path = tmp_path / "timing"
+    path.write_text(
+        "2.000\t1.800\t100000\t0\tkernel/fork.o\n"
+        "1.000\t0.900\t50000\t0\tkernel/exit.o\n"
+        "4.000\t3.500\t400000\t0\tdrivers/gpu/drm/drm_edid.o\n"
+        "0.010\t0.005\t8000\t1\t/dev/null\n"
+        "0.005\t0.002\t7000\t0\t-\n"
+        "0.500\t0.400\t20000\t0\tinit.o\n"
+        "garbage\n"
+        "1.000\tx\t1\t0\tfoo.o\n"
+    )
+    return path
+
+
+class TestParse:
+    def test_records(self, timing_file):
+        invocations = parse(timing_file)
+        assert len(invocations) == 6
+        assert invocations[0].wall_time == 2.0
+        assert invocations[0].cpu_time == 1.8
+        assert invocations[0].peak_rss == 100000 * 1024
+        assert invocations[0].status == 0
+        assert invocations[0].target == "kernel/fork.o"
+
+    def test_in_build_dir(self, timing_file):
+        assert [i.in_build_dir for i in parse(timing_file)] == [
+            True,
+            True,
+            True,
+            False,
+            False,
+            True,
+        ]
+
+    def test_build_dir(self, tmp_path):
+        path = tmp_path / "timing"
+        path.write_text("1.0\t1.0\t1\t0\t/build/kernel/fork.o\n")
+        assert parse(path, "/build")[0].target == "kernel/fork.o"
+        assert parse(path, "/build/")[0].target == "kernel/fork.o"
+        assert parse(path, "/buil")[0].target == "/build/kernel/fork.o"
+
+    def test_missing(self, tmp_path):
+        assert parse(tmp_path / "missing") == []
+
+
+class TestSummarize:
+    def test_totals(self, timing_file):
+        summary = summarize(timing_file, duration=5)
+        assert summary["invocations"] == 6
+        assert summary["failed"] == 1
+        assert summary["wall_time"] == 7.515
+        assert summary["cpu_time"] == 6.607
+        assert summary["peak_rss"] == 400000 * 1024
+        assert summary["concurrency"] == 1.5
+
+    def test_slowest_files(self, timing_file):
+        files = summarize(timing_file)["slowest_files"]
+        assert [f["file"] for f in files] == [
+            "drivers/gpu/drm/drm_edid.o",
+            "kernel/fork.o",
+            "kernel/exit.o",
+            "init.o",
+        ]
+        assert files[0] == {
+            "file": "drivers/gpu/drm/drm_edid.o",
+            "wall_time": 4.0,
+            "cpu_time": 3.5,
+            "peak_rss": 400000 * 1024,
+            "invocations": 1,
+        }
+
+    def test_slowest_directories(self, timing_file):
+        directories = summarize(timing_file)["slowest_directories"]
+        assert directories[1] == {
+            "directory": "kernel",
+            "wall_time": 3.0,
+            "cpu_time": 2.7,
+            "peak_rss": 100000 * 1024,
+            "invocations": 2,
+        }
+        assert directories[-1]["directory"] == "."
+
+    def test_top(self, timing_file):
+        assert len(summarize(timing_file, top=2)["slowest_files"]) == 2
+
+    def test_no_duration(self, timing_file):
+        assert summarize(timing_file)["concurrency"] is None
+
+    def test_no_records(self, tmp_path):
+        assert summarize(tmp_path / "missing") is None
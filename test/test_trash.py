@@ -0,0 +1,190 @@
+import errno
+import os
+import runpy
+import subprocess
+import sys
+import time
+import pytest
+
+from tuxmake import trash
+
+
+@pytest.fixture
+def directory(tmp_path):
+    d = tmp_path / "build"
+    (d / "subdir").mkdir(parents=True)
+    (d / "subdir" / "file").write_text("hello")
+    return d
+
+
+def wait_until_empty(directory, timeout=5):
+    deadline = time.time() + timeout
+    while list(directory.iterdir()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class TestDiscard:
+    def test_removes_in_background(self, directory, home):
+        trash.discard(directory)
+        assert not directory.exists()
+        wait_until_empty(trash.get_trash_dir())
+
+    def test_sweeps_leftovers(self, directory, home):
+        leftover = trash.get_trash_dir() / "leftover"
+        leftover.mkdir(parents=True)
+        trash.discard(directory)
+        wait_until_empty(trash.get_trash_dir())
+
+    def test_reaps_only_its_own_directory(self, directory, mocker):
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        leftover = trash.get_trash_dir() / "leftover"
+        leftover.mkdir(parents=True)
+        trash.discard(directory)
+        [trashed] = [p for p in trash.get_trash_dir().iterdir() if p != leftover]
+        assert spawn_reaper.call_args[0][0] == trashed
+
+    def test_reaper_holds_the_lock(self, directory, mocker):
+        locked = []
+
+        def check(path, fd):
+            locked.append(trash.lock(path))
+
+        mocker.patch("tuxmake.trash.spawn_reaper", side_effect=check)
+        trash.discard(directory)
+        assert locked == [None]
+
+    def test_missing_directory(self, tmp_path, mocker):
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        trash.discard(tmp_path / "missing")
+        spawn_reaper.assert_not_called()
+
+    def test_locked_directory(self, directory, mocker):
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        fd = trash.lock(directory)
+        try:
+            trash.discard(directory)
+        finally:
+            os.close(fd)
+        assert directory.exists()
+        spawn_reaper.assert_not_called()
+
+    def test_disabled(self, directory, monkeypatch, mocker):
+        monkeypatch.setenv("TUXMAKE_ASYNC_CLEANUP", "false")
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        trash.discard(directory)
+        assert not directory.exists()
+        spawn_reaper.assert_not_called()
+
+    def test_trash_in_another_filesystem(self, directory, mocker):
+        rename = mocker.patch("os.rename", side_effect=[OSError(errno.EXDEV), None])
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        trash.discard(directory)
+        hidden = rename.call_args[0][1]
+        assert hidden.parent == directory.parent
+        assert hidden.name.startswith(".build.trash-")
+        assert spawn_reaper.call_args[0][0] == hidden
+
+    def test_cannot_rename(self, directory, mocker):
+        mocker.patch("os.rename", side_effect=OSError(errno.EBUSY))
+        spawn_reaper = mocker.patch("tuxmake.trash.spawn_reaper")
+        trash.discard(directory)
+        assert not directory.exists()
+        spawn_reaper.assert_not_called()
+
+    def test_cannot_spawn_reaper(self, directory, mocker):
+        mocker.patch("tuxmake.trash.spawn_reaper", side_effect=OSError())
+        trash.discard(directory)
+        assert not directory.exists()
+        # left unlocked in the trash, for the next reaper
+        [trashed] = trash.get_trash_dir().iterdir()
+        fd = trash.lock(trashed)
+        assert fd is not None
+        os.close(fd)
+
+
+class TestReap:
+    def test_own_directory_and_leftovers(self, directory):
+        trashed = trash.move_to_trash(directory)
+        leftover = trash.get_trash_dir() / "leftover"
+        leftover.mkdir()
+        trash.reap(trashed)
+        assert list(trash.get_trash_dir().iterdir()) == []
+
+    def test_skips_directories_being_reaped(self, directory):
+        trashed = trash.move_to_trash(directory)
+        other = trash.get_trash_dir() / "other"
+        other.mkdir()
+        fd = trash.lock(other)
+        try:
+            trash.reap(trashed)
+        finally:
+            os.close(fd)
+        assert list(trash.get_trash_dir().iterdir()) == [other]
+
+    def test_only_one_sweep_at_a_time(self, directory):
+        trashed = trash.move_to_trash(directory)
+        leftover = trash.get_trash_dir() / "leftover"
+        leftover.mkdir()
+        fd = trash.lock(trash.get_trash_dir())
+        try:
+            trash.reap(trashed)
+        finally:
+            os.close(fd)
+        assert list(trash.get_trash_dir().iterdir()) == [leftover]
+
+    def test_outside_of_the_trash(self, directory, tmp_path):
+        leftover = trash.get_trash_dir() / "leftover"
+        leftover.mkdir(parents=True)
+        trash.reap(directory)
+        assert not directory.exists()
+        assert leftover.exists()
+
+    def test_main(self, directory, mocker):
+        mocker.patch("sys.argv", ["tuxmake.trash", str(directory)])
+        trash.main()
+        assert not directory.exists()
+
+    def test_run_as_module(self, directory, mocker):
+        mocker.patch("sys.argv", ["tuxmake.trash", str(directory)])
+        runpy.run_path(trash.__file__, run_name="__main__")
+        assert not directory.exists()
+
+
+class TestLock:
+    def test_missing(self, tmp_path):
+        assert trash.lock(tmp_path / "missing") is None
+
+
+class TestGetReaperCommand:
+    def test_low_priority(self, mocker):
+        mocker.patch("shutil.which", return_value="/usr/bin/foo")
+        cmd = trash.get_reaper_command("/path/to/trash/x")
+        assert cmd == [
+            "ionice",
+            "-c",
+            "3",
+            "nice",
+            "-n",
+            "19",
+            sys.executable,
+            "-m",
+            "tuxmake.trash",
+            "/path/to/trash/x",
+        ]
+
+    def test_no_priority_tools(self, mocker):
+        mocker.patch("shutil.which", return_value=None)
+        assert trash.get_reaper_command("/x") == [
+            sys.executable,
+            "-m",
+            "tuxmake.trash",
+            "/x",
+        ]
+
+    def test_detached(self, mocker):
+        popen = mocker.patch("subprocess.Popen")
+        trash.spawn_reaper("/x", 99)
+        assert popen.call_args[1]["start_new_session"]
+        assert popen.call_args[1]["stdin"] == subprocess.DEVNULL
+        assert popen.call_args[1]["pass_fds"] == (99,)
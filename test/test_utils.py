@@ -2,8 +2,10 @@ import os
 import subprocess
 import pytest
 from unittest.mock import patch, MagicMock
+from tuxmake import git
 from tuxmake.utils import get_directory_timestamp
 from tuxmake.utils import retry
+from tuxmake.utils import download_file
 from tuxmake.utils import download_file_with_progress
 from tuxmake.utils import prepare_file_from_source
 from tuxmake.utils import quote_command_line
@@ -11,6 +13,10 @@ from tuxmake.utils import KB, MB, DOWNLOAD_CHUNK_SIZE
 
 
 class TestGetDirectoryTimestamp:
+    @pytest.fixture(autouse=True)
+    def clear_memo(self, mocker):
+        mocker.patch.dict("tuxmake.utils.__git_timestamps__", clear=True)
+
     def test_git(self, tmp_path):
         subprocess.check_call(["git", "init"], cwd=tmp_path)
         subprocess.check_call(["git", "config", "user.name", "Foo Bar"], cwd=tmp_path)
@@ -28,6 +34,50 @@ class TestGetDirectoryTimestamp:
         )
         assert get_directory_timestamp(tmp_path) == "1620918000"
 
+    def create_repo(self, path):
+        subprocess.check_call(["git", "init", "--quiet"], cwd=path)
+        (path / "README.md").write_text("HELLO WORLD")
+        subprocess.check_call(["git", "add", "README.md"], cwd=path)
+        env = dict(os.environ)
+        env["GIT_COMMITTER_DATE"] = "2021-05-13 12:00 -0300"
+        env["GIT_AUTHOR_NAME"] = env["GIT_COMMITTER_NAME"] = "Foo Bar"
+        env["GIT_AUTHOR_EMAIL"] = env["GIT_COMMITTER_EMAIL"] = "foo@bar.com"
+        subprocess.check_call(
+            ["git", "commit", "--quiet", "--message=First commit"], cwd=path, env=env
+        )
+
+    def test_git_without_forking(self, tmp_path, mocker):
+        self.create_repo(tmp_path)
+        check_output = mocker.patch("subprocess.check_output")
+        assert get_directory_timestamp(tmp_path) == "1620918000"
+        check_output.assert_not_called()
+
+    def test_git_fallback_to_subprocess(self, tmp_path, mocker):
+        self.create_repo(tmp_path)
+        mocker.patch("tuxmake.git.get_commit_timestamp", return_value=None)
+        assert get_directory_timestamp(tmp_path) == "1620918000"
+
+    def test_git_memoized(self, tmp_path, mocker):
+        self.create_repo(tmp_path)
+        get_commit_timestamp = mocker.spy(git, "get_commit_timestamp")
+        assert get_directory_timestamp(tmp_path) == "1620918000"
+        assert get_directory_timestamp(tmp_path) == "1620918000"
+        assert get_commit_timestamp.call_count == 1
+
+    def test_git_memo_invalidated_by_new_head(self, tmp_path):
+        self.create_repo(tmp_path)
+        assert get_directory_timestamp(tmp_path) == "1620918000"
+        env = dict(os.environ)
+        env["GIT_COMMITTER_DATE"] = "2021-05-14 12:00 -0300"
+        env["GIT_AUTHOR_NAME"] = env["GIT_COMMITTER_NAME"] = "Foo Bar"
+        env["GIT_AUTHOR_EMAIL"] = env["GIT_COMMITTER_EMAIL"] = "foo@bar.com"
+        subprocess.check_call(
+            ["git", "commit", "--quiet", "--allow-empty", "--message=Second"],
+            cwd=tmp_path,
+            env=env,
+        )
+        assert get_directory_timestamp(tmp_path) == "1621004400"
+
     def test_no_git(self, tmp_path):
         subprocess.check_call(["touch", "-d", "@1620918000", str(tmp_path)])
         assert get_directory_timestamp(tmp_path) == "1620918000"
@@ -194,6 +244,22 @@ class TestDownloadFileWithProgress:
         assert any("Downloading" in call for call in print_calls)
 
 
+class TestDownloadFile:
+    def test_download(self, tmp_path):
+        src = tmp_path / "src"
+        src.write_bytes(b"data")
+        dest = tmp_path / "sub" / "dest"
+        download_file(src.as_uri(), dest)
+        assert dest.read_bytes() == b"data"
+        assert sorted(p.name for p in dest.parent.iterdir()) == ["dest"]
+
+    def test_failure(self, tmp_path):
+        dest = tmp_path / "dest"
+        with pytest.raises(OSError):
+            download_file((tmp_path / "missing").as_uri(), dest)
+        assert list(tmp_path.iterdir()) == []
+
+
 class TestPrepareFileFromSource:
     def test_prepare_local_file(self, tmp_path):
         source_file = tmp_path / "source.txt"
@@ -1,4 +1,15 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from tuxmake.exceptions import InvalidJobs
+from tuxmake.runtime import Runtime
 from tuxmake.wrapper import Wrapper
+from tuxmake.wrapper import evict
+from tuxmake.wrapper import maybe_evict
+from tuxmake.wrapper import parse_distcc_hosts
 
 
 class TestNone:
@@ -24,12 +35,13 @@ class Test_ccache:
         Wrapper("ccache").prepare_host()
         assert (home / ".ccache").exists()
 
-    def test_prepare_runtime(self, mocker):
+    def test_does_not_zero_stats(self, mocker):
         build = mocker.MagicMock()
         Wrapper("ccache").prepare_runtime(build)
-        build.run_cmd.assert_called_with(
-            ["ccache", "--zero-stats"], echo=False, stdout=mocker.ANY
-        )
+        build.run_cmd.assert_not_called()
+
+    def test_stats(self):
+        assert Wrapper("ccache").stats["format"] == "ccache"
 
 
 class Test_sccache:
@@ -47,3 +59,330 @@ class Test_sccache:
     def test_prepare_host(self, home):
         Wrapper("sccache").prepare_host()
         assert (home / ".cache" / "sccache").exists()
+
+    def test_stats(self):
+        assert Wrapper("sccache").stats["format"] == "sccache"
+
+
+class Test_timing:
+    def test_command(self):
+        timing = Wrapper("timing")
+        makevars = timing.wrap({"CROSS_COMPILE": "aarch64-linux-gnu-"}, bindir="/bin")
+        assert makevars["CC"] == "/bin/tuxmake-timing aarch64-linux-gnu-gcc"
+        assert makevars["HOSTCC"] == "/bin/tuxmake-timing gcc"
+
+    def test_environment(self):
+        timing = Wrapper("timing")
+        assert timing.environment["TUXMAKE_TIMING_FILE"].startswith("{build_dir}/")
+
+
+class TestStackedWrapper:
+    def test_get_single(self):
+        wrapper = Wrapper.get("ccache")
+        assert wrapper.name == "ccache"
+        assert wrapper.wrappers == [wrapper]
+
+    def test_get_stacked(self):
+        wrapper = Wrapper.get("timing,ccache")
+        assert wrapper.name == "timing,ccache"
+        assert [w.name for w in wrapper.wrappers] == ["timing", "ccache"]
+
+    def test_environment(self, monkeypatch):
+        monkeypatch.setenv("CCACHE_DIR", "/ccache")
+        wrapper = Wrapper.get("timing,ccache")
+        assert wrapper.environment["CCACHE_DIR"] == "/ccache"
+        assert "TUXMAKE_TIMING_FILE" in wrapper.environment
+
+    def test_wrap(self):
+        wrapper = Wrapper.get("timing,ccache")
+        makevars = wrapper.wrap({"LLVM": "1"}, bindir="/tuxmake")
+        assert makevars["CC"] == "/tuxmake/tuxmake-timing ccache clang"
+
+    def test_with_none(self):
+        wrapper = Wrapper.get("none,ccache")
+        assert wrapper.wrap({})["CC"] == "ccache gcc"
+
+    def test_prepare_runtime(self, mocker):
+        build = mocker.MagicMock()
+        Wrapper.get("timing,ccache").prepare_runtime(build)
+        cmds = [c[0][0] for c in build.run_cmd.call_args_list]
+        assert cmds == [["rm", "-f", "{build_dir}/.tuxmake-timing"]]
+
+    def test_stats(self):
+        wrapper = Wrapper.get("timing,ccache")
+        assert wrapper.stats is None
+        assert [w.stats is not None for w in wrapper.wrappers] == [False, True]
+
+    def test_with_path(self):
+        wrapper = Wrapper.get("timing,/path/to/sccache")
+        assert wrapper.name == "timing,sccache"
+        assert wrapper.wrappers[1].path == "/path/to/sccache"
+
+
+class TestTimingScript:
+    script = str(Runtime.bindir / "tuxmake-timing")
+
+    @pytest.fixture
+    def timing_file(self, tmp_path, monkeypatch):
+        path = tmp_path / "timing"
+        monkeypatch.setenv("TUXMAKE_TIMING_FILE", str(path))
+        return path
+
+    def run(self, *args):
+        return subprocess.call([self.script, *args])
+
+    def records(self, path):
+        return [line.split("\t") for line in path.read_text().splitlines()]
+
+    def test_records_invocation(self, timing_file):
+        assert self.run("sh", "-c", "true", "-o", "kernel/fork.o") == 0
+        [record] = self.records(timing_file)
+        float(record[0])
+        float(record[1])
+        assert int(record[2]) > 0
+        assert record[3:] == ["0", "kernel/fork.o"]
+
+    def test_exit_code(self, timing_file):
+        assert self.run("sh", "-c", "exit 3", "-ofoo.o") == 3
+        assert self.records(timing_file)[0][3:] == ["3", "foo.o"]
+
+    def test_killed(self, timing_file):
+        assert self.run("sh", "-c", "kill -9 $$") == 137
+
+    def test_source_file(self, timing_file):
+        self.run("true", "-E", "foo.c")
+        assert self.records(timing_file)[0][4] == "foo.c"
+
+    def test_no_target(self, timing_file):
+        self.run("true", "--version")
+        assert self.records(timing_file)[0][4] == "-"
+
+    def test_compiler_not_found(self, timing_file):
+        assert self.run("/does/not/exist") == 127
+
+    def test_no_timing_file(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_TIMING_FILE", raising=False)
+        assert self.run("true") == 0
+
+    def test_unwritable_timing_file(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TUXMAKE_TIMING_FILE", str(tmp_path / "x" / "timing"))
+        assert self.run("true") == 0
+
+
+class TestDistributed:
+    @pytest.fixture(autouse=True)
+    def environment(self, monkeypatch, home):
+        monkeypatch.delenv("DISTCC_HOSTS", raising=False)
+        monkeypatch.delenv("DISTCC_DIR", raising=False)
+        monkeypatch.delenv("TUXMAKE_DISTRIBUTED_JOBS", raising=False)
+
+    def test_parse_hosts(self):
+        assert parse_distcc_hosts(
+            "--randomize localhost build1/8 build2:3633/16,lzo @build3 build4/x"
+        ) == [
+            ("localhost", 2),
+            ("build1", 8),
+            ("build2:3633", 16),
+            ("@build3", 4),
+            ("build4", 4),
+        ]
+
+    def test_parse_hosts_file(self):
+        assert parse_distcc_hosts("# hosts\nbuild1/8 # fast\n\nbuild2/2\n") == [
+            ("build1", 8),
+            ("build2", 2),
+        ]
+
+    def test_not_distributed(self):
+        ccache = Wrapper("ccache")
+        assert ccache.offline
+        assert ccache.get_hosts() == []
+        assert ccache.get_slots() is None
+
+    def test_distcc(self, monkeypatch):
+        monkeypatch.setenv("DISTCC_HOSTS", "localhost/4 build1/16")
+        distcc = Wrapper("distcc")
+        assert not distcc.offline
+        assert distcc.get_hosts() == [("localhost", 4), ("build1", 16)]
+        assert distcc.get_slots() == 20
+        assert distcc.wrap({})["CC"] == "distcc gcc"
+
+    def test_distcc_hosts_file(self, home):
+        (home / ".distcc").mkdir(parents=True)
+        (home / ".distcc" / "hosts").write_text("build1/6\n")
+        assert Wrapper("distcc").get_slots() == 6
+
+    def test_distcc_hosts_file_in_environment(self, home):
+        (home / ".distcc").mkdir(parents=True)
+        (home / ".distcc" / "hosts").write_text(
+            "# build hosts\nbuild1/6  # fast\n\nbuild2/8\n"
+        )
+        distcc = Wrapper("distcc")
+        assert distcc.environment["DISTCC_HOSTS"] == "build1/6 build2/8"
+        assert distcc.get_slots() == 14
+
+    def test_distcc_no_hosts(self):
+        distcc = Wrapper("distcc")
+        assert distcc.get_slots() is None
+        assert "DISTCC_HOSTS" not in distcc.environment
+
+    def test_slots_override(self, monkeypatch):
+        monkeypatch.setenv("DISTCC_HOSTS", "build1/16")
+        monkeypatch.setenv("TUXMAKE_DISTRIBUTED_JOBS", "64")
+        assert Wrapper("distcc").get_slots() == 64
+
+    @pytest.mark.parametrize("jobs", ["many", "0", "-1"])
+    def test_invalid_slots_override(self, monkeypatch, jobs):
+        monkeypatch.setenv("TUXMAKE_DISTRIBUTED_JOBS", jobs)
+        with pytest.raises(InvalidJobs):
+            Wrapper("icecc").get_slots()
+
+    def test_icecc(self, monkeypatch):
+        icecc = Wrapper("icecc")
+        assert not icecc.offline
+        assert icecc.get_slots() is None
+        monkeypatch.setenv("TUXMAKE_DISTRIBUTED_JOBS", "32")
+        assert icecc.get_slots() == 32
+
+    def test_stacked(self, monkeypatch):
+        monkeypatch.setenv("DISTCC_HOSTS", "build1/16")
+        wrapper = Wrapper.get("ccache,distcc")
+        assert not wrapper.offline
+        assert wrapper.get_slots() == 16
+        assert wrapper.wrap({})["CC"] == "ccache distcc gcc"
+
+    def test_stats(self, monkeypatch):
+        monkeypatch.setenv("DISTCC_HOSTS", "build1/16")
+        log = (
+            "distcc[1] (dcc_build_somewhere) Warning: failed to distribute "
+            "foo.c to build1, running locally instead\n"
+            "CC foo.o\n"
+        )
+        assert Wrapper("distcc").get_distribution_stats(log) == {
+            "hosts": [{"host": "build1", "slots": 16}],
+            "slots": 16,
+            "local_fallbacks": 1,
+        }
+
+    def test_icecc_stats(self):
+        assert Wrapper("icecc").get_distribution_stats("foo\n") == {
+            "hosts": [],
+            "slots": None,
+            "local_fallbacks": 0,
+        }
+
+
+class TestSharedCache:
+    @pytest.fixture(autouse=True)
+    def shared(self, monkeypatch, home):
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE", "true")
+        monkeypatch.setenv("CCACHE_DIR", "/ccache")
+        monkeypatch.delenv("TUXMAKE_SHARED_CACHE_DIR", raising=False)
+
+    @pytest.fixture
+    def shared_dir(self, tmp_path, monkeypatch):
+        d = tmp_path / "shared"
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE_DIR", str(d))
+        return d
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.delenv("TUXMAKE_SHARED_CACHE")
+        ccache = Wrapper("ccache")
+        assert ccache.shared_dir is None
+        assert ccache.environment["CCACHE_DIR"] == "/ccache"
+
+    def test_environment(self, home):
+        ccache = Wrapper("ccache")
+        shared_dir = home / ".cache" / "tuxmake" / "compiler-cache" / "ccache"
+        assert ccache.shared_dir == shared_dir
+        assert ccache.environment["CCACHE_DIR"] == "{build_dir}/.ccache"
+        assert ccache.environment["CCACHE_REMOTE_STORAGE"] == (
+            f"file:{shared_dir}|update-mtime=true|read-only=false"
+        )
+        assert ccache.environment["TUXMAKE_SHARED_CACHE_DIR"] == str(shared_dir)
+
+    def test_read_only(self, monkeypatch, shared_dir):
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE_READ_ONLY", "true")
+        ccache = Wrapper("ccache")
+        assert ccache.environment["CCACHE_SECONDARY_STORAGE"] == (
+            f"file:{shared_dir}|update-mtime=true|read-only=true"
+        )
+
+    def test_not_supported(self):
+        assert Wrapper("sccache").shared_dir is None
+
+    def test_cleanup(self, mocker, shared_dir, monkeypatch):
+        monkeypatch.setenv("TUXMAKE_SHARED_CACHE_SIZE", "1M")
+        evict = mocker.patch("tuxmake.wrapper.evict")
+        wrapper = Wrapper.get("timing,ccache")
+        wrapper.cleanup()
+        evict.assert_not_called()
+        shared_dir.mkdir()
+        wrapper.cleanup()
+        evict.assert_called_with(shared_dir, 2**20)
+
+
+class TestMaybeEvict:
+    def test_rate_limited(self, tmp_path, mocker):
+        evict = mocker.patch("tuxmake.wrapper.evict", return_value=1)
+        cache = tmp_path / "cache"
+        cache.mkdir()
+        assert maybe_evict(cache, 100) == 1
+        assert maybe_evict(cache, 100) == 0
+        assert evict.call_count == 1
+        old = time.time() - 3600
+        os.utime(str(cache / ".last-eviction"), (old, old))
+        maybe_evict(cache, 100)
+        assert evict.call_count == 2
+
+
+class TestEvict:
+    def populate(self, directory, sizes):
+        directory.mkdir()
+        for i, size in enumerate(sizes):
+            sub = directory / f"{i:02x}"
+            sub.mkdir()
+            f = sub / "entry"
+            f.write_bytes(b"x" * size)
+            os.utime(f, (1000 + i, 1000 + i))
+
+    def test_under_max_size(self, tmp_path):
+        self.populate(tmp_path / "cache", [100, 100])
+        assert evict(tmp_path / "cache", 200) == 0
+
+    def test_removes_least_recently_used(self, tmp_path):
+        cache = tmp_path / "cache"
+        self.populate(cache, [100, 100, 100, 100])
+        assert evict(cache, 300) == 2
+        assert not (cache / "00" / "entry").exists()
+        assert not (cache / "01" / "entry").exists()
+        assert (cache / "02" / "entry").exists()
+        assert (cache / "03" / "entry").exists()
+
+    def test_skips_lock_file(self, tmp_path):
+        cache = tmp_path / "cache"
+        self.populate(cache, [100, 100])
+        (cache / ".lock").write_bytes(b"x" * 100)
+        os.utime(cache / ".lock", (0, 0))
+        assert evict(cache, 250) == 1
+        assert (cache / ".lock").exists()
+
+    def test_file_removed_concurrently(self, tmp_path, mocker):
+        cache = tmp_path / "cache"
+        self.populate(cache, [100, 100])
+        unlink = mocker.patch("os.unlink", side_effect=FileNotFoundError)
+        assert evict(cache, 150) == 1
+        unlink.assert_called_once()
+
+    def test_file_vanishes_during_scan(self, tmp_path, mocker):
+        cache = tmp_path / "cache"
+        self.populate(cache, [100, 100])
+        stat = os.stat
+
+        def vanished(path, *args, **kwargs):
+            if path.endswith("entry"):
+                raise FileNotFoundError(path)
+            return stat(path, *args, **kwargs)
+
+        mocker.patch("os.stat", side_effect=vanished)
+        assert evict(cache, 50) == 0
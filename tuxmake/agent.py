@@ -0,0 +1,96 @@
+"""
+Client for `tuxmake-agent`, which runs as the main process of a build
+container and runs commands sent to it over a Unix socket, avoiding the cost
+of a `docker exec`/`podman exec` per command. See the agent script itself for
+a description of the protocol.
+"""
+
+import json
+import shutil
+import socket
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from tuxmake.engine import EngineClient
+
+OUTPUT = 1
+EXIT = 3
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentClient:
+    def __init__(self, socket_path):
+        self.socket_path = Path(socket_path)
+
+    @classmethod
+    def create(cls):
+        """
+        Creates a client for an agent that is yet to be started, with its
+        socket in a new temporary directory. The directory needs to be made
+        available to the agent under the same path.
+        """
+        directory = tempfile.mkdtemp(prefix="tuxmake-agent-")
+        return cls(Path(directory) / "agent.sock")
+
+    @property
+    def directory(self):
+        return self.socket_path.parent
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError as exc:
+            sock.close()
+            raise AgentError(f"cannot connect to agent: {exc}")
+        return sock
+
+    def wait(self, timeout=5):
+        """
+        Waits until the agent is accepting connections. Returns `False` if
+        that doesn't happen within **timeout** seconds.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.connect().close()
+                return True
+            except AgentError:
+                if time.time() > deadline:
+                    return False
+                time.sleep(0.01)
+
+    def run(self, sock, cmd, output, cwd=None, env=None):
+        """
+        Runs **cmd** through the agent, over the connection **sock** (as
+        returned by `connect`), calling **output** with `(OUTPUT, data)` for
+        each chunk of output. Returns the exit code of the command.
+        """
+        request = {"cmd": cmd, "cwd": cwd and str(cwd), "env": env}
+        exit_code = []
+
+        def handle(kind, data):
+            if kind == EXIT:
+                exit_code.append(struct.unpack(">i", data)[0])
+            else:
+                output(kind, data)
+
+        try:
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as stream:
+                EngineClient.demultiplex(stream, handle)
+        except OSError as exc:
+            raise AgentError(f"lost connection to agent: {exc}")
+        finally:
+            sock.close()
+        if not exit_code:
+            raise AgentError("agent did not report the exit code")
+        return exit_code[0]
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,193 @@
+"""
+Copying of build artifacts into the output directory, and content-addressed
+store for them.
+
+Artifacts are hashed while they are copied, so that their checksums can be
+recorded in the metadata without reading them again. SHA-256 is always
+calculated; other algorithms supported by `hashlib` (e.g. `blake2b`) can be
+added with `TUXMAKE_ARTIFACT_HASHES`.
+
+When enabled with `TUXMAKE_ARTIFACT_STORE=true`, artifacts are not copied
+into the output directory directly. Instead, each artifact is copied once
+into the store as a read-only blob named after its SHA-256 hash, and that
+blob is hard linked into the output directory. Identical artifacts from
+different builds, e.g. `headers.tar.xz` from builds of the same commit, then
+take disk space only once.
+
+The link count of a blob is its reference count: a blob whose only link is
+the one in the store is no longer used by any output directory, and is
+removed by the garbage collection.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from tuxmake import xdg
+from tuxmake.output import locked
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# minimum interval between garbage collection runs, in seconds.
+GC_INTERVAL = 3600
+
+GC_STAMP = ".last-gc"
+
+
+def enabled():
+    return os.getenv("TUXMAKE_ARTIFACT_STORE", "false").lower() == "true"
+
+
+def get_hash_algorithms():
+    """
+    Returns the hash algorithms to calculate for artifacts: `sha256`, plus
+    the ones listed in `TUXMAKE_ARTIFACT_HASHES` that `hashlib` supports.
+    Variable-length algorithms (`shake_128`, `shake_256`) are ignored.
+    """
+    algorithms = ["sha256"]
+    for name in os.getenv("TUXMAKE_ARTIFACT_HASHES", "").replace(",", " ").split():
+        name = name.lower()
+        if name not in hashlib.algorithms_available or name in algorithms:
+            continue
+        if hashlib.new(name).digest_size == 0:
+            continue
+        algorithms.append(name)
+    return algorithms
+
+
+def copy_file(src, dest, algorithms=("sha256",)):
+    """
+    Copies **src** into **dest** (a path or a writable binary file object),
+    hashing the contents on the way, in a single pass. Returns a dict with
+    the `size` of the file and its hash for each of **algorithms**.
+
+    An existing **dest** path is replaced, and not written to: it may be a
+    hard link to a read-only blob in the artifact store, e.g. when an output
+    directory is reused.
+    """
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
+    size = 0
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(str(src), "rb") as f:
+        if isinstance(dest, (str, Path)):
+            if os.path.lexists(str(dest)):
+                os.unlink(str(dest))
+            out = open(str(dest), "wb")
+        else:
+            out = dest
+        try:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                for _, h in hashes:
+                    h.update(view[:n])
+                out.write(view[:n])
+                size += n
+        finally:
+            if out is not dest:
+                out.close()
+    return {"size": size, **{name: h.hexdigest() for name, h in hashes}}
+
+
+def get_store_dir():
+    return Path(
+        os.getenv("TUXMAKE_ARTIFACT_STORE_DIR") or xdg.cache_dir() / "artifacts"
+    )
+
+
+class ArtifactStore:
+    def __init__(self, directory=None, algorithms=("sha256",)):
+        self.directory = Path(directory or get_store_dir())
+        self.blobs = self.directory / "blobs"
+        self.algorithms = algorithms
+
+    def blob(self, sha256):
+        return self.blobs / sha256[:2] / sha256
+
+    def __hash_copy__(self, src):
+        """
+        Copies **src** into a temporary file in the store, hashing it on the
+        way. Returns the name of the temporary file, and the checksums.
+        """
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=str(self.directory))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                checksums = copy_file(src, out, self.algorithms)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        return tmp, checksums
+
+    def publish(self, src, dest):
+        """
+        Adds **src** to the store, unless an identical blob is already there,
+        and makes **dest** a hard link to the blob. Falls back to copying the
+        blob if the store and **dest** are on different filesystems. Returns
+        the checksums of the file, as returned by `copy_file`.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp, checksums = self.__hash_copy__(src)
+        try:
+            # the blob must not be garbage-collected before it is linked
+            with locked(self.directory):
+                blob = self.blob(checksums["sha256"])
+                if not blob.exists():
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    os.chmod(tmp, 0o444)
+                    os.rename(tmp, str(blob))
+                if os.path.lexists(str(dest)):
+                    os.unlink(str(dest))
+                try:
+                    os.link(str(blob), str(dest))
+                except OSError as exc:
+                    if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    shutil.copy(str(blob), str(dest))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return checksums
+
+    def collect_garbage(self):
+        """
+        Removes the blobs that are not linked from anywhere outside of the
+        store, and temporary files left behind by interrupted builds. Returns
+        the number of bytes reclaimed.
+        """
+        reclaimed = 0
+        if not self.directory.exists():
+            return reclaimed
+        with locked(self.directory):
+            for tmp in self.directory.glob(".tmp-*"):
+                st = tmp.stat()
+                if st.st_mtime < time.time() - GC_INTERVAL:
+                    tmp.unlink()
+                    reclaimed += st.st_size
+            for blob in self.blobs.glob("*/*"):
+                try:
+                    st = blob.stat()
+                    if st.st_nlink == 1:
+                        blob.unlink()
+                        reclaimed += st.st_size
+                except FileNotFoundError:
+                    continue
+            (self.directory / GC_STAMP).touch()
+        return reclaimed
+
+    def maybe_collect_garbage(self, interval=GC_INTERVAL):
+        """
+        Runs the garbage collection, unless it already ran in the last
+        **interval** seconds.
+        """
+        try:
+            last = (self.directory / GC_STAMP).stat().st_mtime
+        except FileNotFoundError:
+            last = 0
+        if time.time() - last >= interval:
+            self.collect_garbage()
@@ -2,31 +2,55 @@ from contextlib import contextmanager
 from concurrent import futures
 from collections import OrderedDict
 from pathlib import Path
+import http.client
 import json
 import os
+import re
+import shlex
 import signal
 import shutil
 import subprocess
 import tempfile
 import time
 from tuxmake import __version__
+from tuxmake import cache
 from tuxmake import deprecated
+from tuxmake import trash
 from tuxmake.logging import set_debug, debug
 from tuxmake.arch import Architecture, native_arch
 from tuxmake.toolchain import Toolchain, NoExplicitToolchain
 from tuxmake.wrapper import Wrapper
+from tuxmake.cache_stats import CacheStats
 from tuxmake.output import get_new_output_dir, get_default_korg_toolchains_dir
+from tuxmake.output import create_tmpfs_dir
+from tuxmake.output import release_tmpfs_dir
+from tuxmake.output import record_output_dir_size
+from tuxmake.output import release_output_dir
 from tuxmake.target import Compression
+from tuxmake.target import Config
 from tuxmake.target import default_compression
 from tuxmake.target import create_target
 from tuxmake.runtime import Runtime, DockerRuntime
 from tuxmake.runtime import Terminated
 from tuxmake.metadata import MetadataCollector
+from tuxmake.pipeline import Pipeline
+from tuxmake import pressure
+from tuxmake import prepared_tree
+from tuxmake import kconfig_cache
+from tuxmake import result_cache
+from tuxmake import artifact_store
+from tuxmake import timing
+from tuxmake.jobserver import HostJobserver, JobserverError, get_jobserver_dir
+from tuxmake.jobs import parse as parse_jobs
+from tuxmake.jobs import plan as plan_jobs
+from tuxmake.jobs import peak_rss_key
 from tuxmake.exceptions import DecodeStacktraceMissingVariable
 from tuxmake.exceptions import EnvironmentCheckFailed
+from tuxmake.exceptions import InvalidJobs
 from tuxmake.exceptions import KorgGccPreparationFailed
 from tuxmake.exceptions import KorgGccDownloadAllToolchainFailed
 from tuxmake.exceptions import UnrecognizedSourceTree
+from tuxmake.exceptions import UnsupportedBuildDirBackend
 from tuxmake.exceptions import UnsupportedArchitectureToolchainCombination
 from tuxmake.exceptions import UnsupportedMakeVariable
 from tuxmake.log import LogParser
@@ -35,6 +59,13 @@ from tuxmake.build_utils import defaults
 from tuxmake.utils import quote_command_line
 from tuxmake.utils import get_directory_timestamp
 from tuxmake.utils import prepare_file_from_source
+from tuxmake.utils import download_file
+
+# maximum number of targets whose artifacts are copied at the same time.
+COPY_WORKERS = 4
+
+# where the kernel.org toolchains are downloaded from.
+KORG_GCC_URL = "https://mirrors.edge.kernel.org/pub/tools/crosstool/files/bin"
 
 
 class BuildInfo:
@@ -111,6 +142,13 @@ class Build:
     - **build_dir**: directory where the build will be performed. Defaults to
       a temporary directory under `output_dir`. An existing directory can be
       specified to do an incremental build on top of a previous one.
+    - **build_dir_backend**: where to create the build directory, when
+      *build_dir* is not passed (`str`). "disk" (the default) creates it under
+      `output_dir`; "tmpfs" creates it in tmpfs (`/dev/shm`, or
+      `$TUXMAKE_TMPFS_DIR`) if the size of previous builds with the same
+      configuration indicates that it will fit in the available memory.
+      Otherwise, including for the first build of each configuration, the
+      build directory is created on disk anyway.
     - **korg_toolchains_dir**: directory where the kernel.org toolchain
       tarballs will be cached. Defaults to `~/.cache/tuxmake/korg_toolchains`.
     - **target_arch**: target architecture name (`str`). Defaults to the native
@@ -135,7 +173,11 @@ class Build:
     - **kernel_image**: which kernel image to build, overriding the default
       kernel image name defined for the target architecture.
     - **jobs**: number of concurrent jobs to run (as in `make -j N`). `int`,
-      defaults to the number of available CPU cores.
+      defaults to the number of available CPU cores, taking into account CPU
+      affinity and cgroup CPU quotas. Can also be "auto", or
+      "auto:mem-per-job=SIZE" (e.g. "auto:mem-per-job=1G"), to also take the
+      available memory into account, based on the given memory usage per job
+      or on the peak memory usage of compiler invocations in previous builds.
     - **runtime:** name of the runtime to use (`str`).
     - **verbose**: do a verbose build. The default is to do a silent build
       (i.e.  `make -s`).
@@ -143,6 +185,11 @@ class Build:
       still saved to the output directory, unconditionally.
     - **debug**: produce extra output for debugging tuxmake itself. This output
       will not appear in the build log.
+    - **host_jobserver**: use a GNU make jobserver shared by all the builds
+      on the host that use this option, instead of running up to *jobs* jobs
+      independently. The first build to use it determines the number of job
+      slots, from its *jobs*. Requires GNU make 4.4 or later; if not
+      available, the build uses *jobs* as usual.
     - **auto_cleanup**: whether to automatically remove the build directory
       after the build finishes. Ignored if *build_dir* is passed, in which
       case the build directory *will not be removed*.
@@ -162,6 +209,7 @@ class Build:
         tree=".",
         output_dir=None,
         build_dir=None,
+        build_dir_backend="disk",
         korg_toolchains_dir=None,
         target_arch=None,
         toolchain=None,
@@ -180,6 +228,7 @@ class Build:
         quiet=False,
         debug=False,
         auto_cleanup=True,
+        host_jobserver=False,
     ):
         self.source_tree = Path(tree).absolute()
 
@@ -187,6 +236,10 @@ class Build:
         self.__output_dir_input__ = output_dir
         self.__build_dir__ = None
         self.__build_dir_input__ = build_dir
+        if build_dir_backend not in ("disk", "tmpfs"):
+            raise UnsupportedBuildDirBackend(build_dir_backend)
+        self.build_dir_backend = build_dir_backend
+        self.__build_dir_backend_used__ = None
         self.__korg_toolchains_dir__ = None
         self.__korg_toolchains_dir_input__ = korg_toolchains_dir
         if self.__build_dir_input__:
@@ -202,9 +255,12 @@ class Build:
         if self.toolchain.name.startswith("korg-gcc"):
             self.prepare_korg_gcc = True
 
-        self.wrapper = wrapper and Wrapper(wrapper) or Wrapper("none")
+        self.wrapper = wrapper and Wrapper.get(wrapper) or Wrapper("none")
+        self.cache_stats = [
+            s for s in map(CacheStats.create, self.wrapper.wrappers) if s
+        ]
 
-        self.timestamp = get_directory_timestamp(self.source_tree)
+        self.__timestamp__ = None
         self.__environment__ = None
         self.__environment_input__ = environment or {}
 
@@ -237,10 +293,24 @@ class Build:
         self.cleanup_targets()
         self.extend_kconfig()
 
-        if jobs:
+        self.jobs_plan = None
+        self.host_jobserver = host_jobserver
+        self.jobserver = None
+        self.pressure_monitor = None
+        try:
+            jobs = jobs and parse_jobs(jobs)
+        except ValueError:
+            raise InvalidJobs(jobs)
+        if isinstance(jobs, dict):
+            peak_rss = cache.get(peak_rss_key(self.toolchain, self.target_arch))
+            self.jobs_plan = plan_jobs(jobs["mem_per_job"], peak_rss)
+            self.jobs = self.jobs_plan.jobs
+        elif jobs:
             self.jobs = jobs
         else:
-            self.jobs = defaults.jobs
+            # with distributed compilation, use as many jobs as the
+            # compilation hosts can take
+            self.jobs = max(defaults.jobs, self.wrapper.get_slots() or 0)
 
         self.runtime = Runtime.get(runtime)
         self.runtime.set_image(get_image(self))
@@ -264,12 +334,25 @@ class Build:
         self.offline = False
 
         self.artifacts = {"log": ["build.log", "build-debug.log"]}
+        self.hash_algorithms = artifact_store.get_hash_algorithms()
+        self.artifact_store = artifact_store.enabled() and artifact_store.ArtifactStore(
+            algorithms=self.hash_algorithms
+        )
+        self.artifact_checksums = []
         self.__status__ = {}
         self.__durations__ = {}
         self.metadata_collector = MetadataCollector(self)
         self.metadata = OrderedDict()
         self.cmdline = CommandLine()
 
+        self.result_cache = result_cache.enabled() and result_cache.ResultCache()
+        self.prepared_tree_cache = (
+            prepared_tree.enabled() and prepared_tree.PreparedTreeCache()
+        )
+        self.kconfig_cache = kconfig_cache.enabled() and kconfig_cache.KconfigCache()
+        self.fingerprint = None
+        self.cached = False
+
     @property
     def status(self):
         """
@@ -330,12 +413,14 @@ class Build:
 
     def validate(self):
         source = Path(self.source_tree)
-        files = [str(f.name) for f in source.glob("*")]
-        if "Makefile" in files and "Kconfig" in files and "Kbuild" in files:
+        if all((source / f).exists() for f in ("Makefile", "Kconfig", "Kbuild")):
             return
         raise UnrecognizedSourceTree(source.absolute())
 
     def prepare(self):
+        self.wrapper.environment = {
+            k: self.format_cmd_part(v) for k, v in self.wrapper.environment.items()
+        }
         self.wrapper.prepare_host()
 
         self.runtime.basename = "build"
@@ -345,10 +430,15 @@ class Build:
         self.runtime.add_volume(self.build_dir)
         if self.prepare_korg_gcc:
             self.runtime.add_volume(self.korg_toolchains_dir)
-        if self.wrapper.path:
-            self.runtime.add_volume(
-                str(self.wrapper.path), f"/usr/local/bin/{self.wrapper.name}"
-            )
+        if self.host_jobserver:
+            jobserver_dir = get_jobserver_dir()
+            jobserver_dir.mkdir(parents=True, exist_ok=True)
+            self.runtime.add_volume(jobserver_dir)
+        for wrapper in self.wrapper.wrappers:
+            if wrapper.path:
+                self.runtime.add_volume(
+                    str(wrapper.path), f"/usr/local/bin/{wrapper.name}"
+                )
         wenv = self.wrapper.environment
         env = dict(**wenv, **self.environment, LANG="C")
         self.runtime.environment = env
@@ -356,11 +446,38 @@ class Build:
             if k.endswith("_DIR"):
                 self.runtime.add_volume(v)
 
-        # Prepare files for targets that need them
-        self.prepare_target_files()
-
-        self.runtime.prepare()
-        self.wrapper.prepare_runtime(self)
+        # Steps that don't depend on each other run concurrently, e.g. the
+        # image pull and the downloads of files for the targets.
+        pipeline = Pipeline()
+        for target in self.targets:
+            if isinstance(target, Config):
+                pipeline.add("kconfig", target.prefetch)
+        if self.result_cache:
+            # the fingerprint only needs the kconfig downloads and the image;
+            # on a hit, there is no need to start the container or to get the
+            # toolchain.
+            pipeline.add("image", self.runtime.setup)
+            self.run_pipeline(pipeline)
+            if self.restore_result():
+                return
+            pipeline = Pipeline()
+            pipeline.add("runtime", self.runtime.start)
+        else:
+            pipeline.add("runtime", self.runtime.prepare)
+        pipeline.add("target_files", self.prepare_target_files)
+        pipeline.add("wrapper", self.prepare_wrapper, after=["runtime"])
+        if self.host_jobserver:
+            pipeline.add("jobserver", self.prepare_jobserver, after=["runtime"])
+        if self.prepare_korg_gcc:
+            # the toolchain is downloaded on the host while the image is
+            # pulled; checking and extracting it is done in the container.
+            pipeline.add("korg_gcc_download", self.download_korg_gcc_toolchain)
+            pipeline.add(
+                "korg_gcc",
+                self.prepare_korg_gcc_toolchain,
+                after=["runtime", "korg_gcc_download"],
+            )
+        self.run_pipeline(pipeline)
 
         if self.toolchain.version_suffix and self.runtime.name == "null":
             toolchain = self.toolchain
@@ -369,6 +486,37 @@ class Build:
                 f"W: Requested {toolchain}, but versioned toolchains are not supported by the null runtime. Will use whatever version of {compiler} that you have installed. To ensure {toolchain} is used, try use a container-based runtime instead."
             )
 
+    def run_pipeline(self, pipeline):
+        try:
+            pipeline.run()
+        finally:
+            for name, duration in pipeline.durations.items():
+                self.__durations__[f"prepare_{name}"] = duration
+
+    def prepare_wrapper(self):
+        self.wrapper.prepare_runtime(self)
+        for stats in self.cache_stats:
+            stats.start(self)
+
+    def prepare_jobserver(self):
+        version = self.get_command_output("make --version")
+        m = re.match(r"GNU Make (\d+)\.(\d+)", version)
+        if not m or (int(m.group(1)), int(m.group(2))) < (4, 4):
+            self.log(
+                "W: The host jobserver requires GNU make 4.4 or later; "
+                f"using --jobs={self.jobs} instead"
+            )
+            return
+        jobserver = HostJobserver()
+        try:
+            jobserver.join(self.jobs)
+        except (OSError, JobserverError) as exc:
+            self.log(
+                f"W: Could not use the host jobserver ({exc}); using --jobs={self.jobs} instead"
+            )
+            return
+        self.jobserver = jobserver
+
     @property
     def output_dir(self):
         if self.__output_dir__:
@@ -386,14 +534,51 @@ class Build:
         if self.__build_dir__:
             return self.__build_dir__
 
+        self.__build_dir_backend_used__ = "disk"
         if self.__build_dir_input__:
             self.__build_dir__ = Path(self.__build_dir_input__)
             self.__build_dir__.mkdir(parents=True, exist_ok=True)
-        else:
-            self.__build_dir__ = self.output_dir / "build"
-            self.__build_dir__.mkdir()
+            return self.__build_dir__
+
+        if self.build_dir_backend == "tmpfs":
+            estimate = cache.get(self.build_dir_size_key)
+            self.__build_dir__ = create_tmpfs_dir("tuxmake-build-", estimate)
+            if self.__build_dir__:
+                self.__build_dir_backend_used__ = "tmpfs"
+                return self.__build_dir__
+            debug(
+                "No size estimate for this configuration yet, or not enough "
+                "memory available for a tmpfs build directory"
+            )
+
+        self.__build_dir__ = self.output_dir / "build"
+        self.__build_dir__.mkdir()
         return self.__build_dir__
 
+    @property
+    def build_dir_size_key(self):
+        return [
+            "build-dir-size",
+            self.target_arch.name,
+            self.toolchain.name,
+            self.kconfig,
+            json.dumps(self.kconfig_add),
+            json.dumps(sorted(t.name for t in self.targets)),
+        ]
+
+    def record_build_dir_size(self):
+        if self.build_dir_backend != "tmpfs" or self.__build_dir_input__:
+            return
+        size = self.metadata.get("resources", {}).get("disk_space")
+        if size is not None:
+            cache.set(self.build_dir_size_key, size * 2**20)
+
+    @property
+    def timestamp(self):
+        if self.__timestamp__ is None:
+            self.__timestamp__ = get_directory_timestamp(self.source_tree)
+        return self.__timestamp__
+
     @property
     def korg_toolchains_dir(self):
         if self.__korg_toolchains_dir__:
@@ -427,12 +612,26 @@ class Build:
 
     @contextmanager
     def go_offline(self):
-        self.offline = True
+        self.offline = self.wrapper.offline
         try:
             yield
         finally:
             self.offline = False
 
+    @contextmanager
+    def monitor_pressure(self):
+        if not pressure.enabled():
+            yield
+            return
+        self.pressure_monitor = pressure.PressureMonitor(
+            self.runtime,
+            jobserver=self.jobserver,
+            jobs=self.jobs,
+            threshold=pressure.get_threshold(),
+        )
+        with self.pressure_monitor:
+            yield
+
     def run_cmd(self, origcmd, stdout=None, interactive=False, echo=True, makevars={}):
         """
         Performs the build.
@@ -476,13 +675,19 @@ class Build:
                 self.__durations__[metadata] = duration
             debug(f"{name} finished in {duration} seconds.")
 
+    def get_jobs_args(self):
+        if self.jobserver:
+            return [f"--jobserver-auth={self.jobserver.auth}"]
+        return [f"--jobs={self.jobs}"]
+
     def expand_cmd_part(self, part, makevars):
         if part == "{make}":
             return (
                 ["make"]
                 + self.get_silent()
                 + self.keep_going
-                + [f"--jobs={self.jobs}", f"O={self.build_dir}"]
+                + self.get_jobs_args()
+                + [f"O={self.build_dir}"]
                 + self.make_args(makevars)
             )
         elif part == "{tar_caf}":
@@ -529,13 +734,49 @@ class Build:
         if self.korg_gcc_cross_prefix:
             mvars["CROSS_COMPILE"] = self.korg_gcc_cross_prefix
         mvars.update(self.make_variables)
-        mvars.update(self.wrapper.wrap(mvars))
+        mvars.update(self.wrapper.wrap(mvars, bindir=self.runtime.bindir))
         return mvars
 
     def get_dynamic_makevars(self):
-        for k, v in self.dynamic_make_variables.items():
-            if k not in self.make_variables:
-                self.make_variables[k] = self.get_command_output(v).strip()
+        pending = {
+            k: v
+            for k, v in self.dynamic_make_variables.items()
+            if k not in self.make_variables
+        }
+        if not pending:
+            return
+
+        image_id = self.runtime.get_image_id()
+        if image_id:
+            key = [
+                "dynamic-makevars",
+                self.runtime.name,
+                image_id,
+                self.target_arch.name,
+                self.toolchain.name,
+                json.dumps(pending, sort_keys=True),
+            ]
+            values = cache.get(key)
+            if values is None:
+                values = self.probe_dynamic_makevars(pending)
+                cache.set(key, values)
+        else:
+            values = self.probe_dynamic_makevars(pending)
+        self.make_variables.update(values)
+
+    def probe_dynamic_makevars(self, commands):
+        # Run all probes in a single command, and have it print NUL-separated
+        # name/value pairs.
+        script = "".join(
+            f"printf '%s\\0%s\\0' {shlex.quote(k)} \"$({v})\"\n"
+            for k, v in commands.items()
+        )
+        output = self.get_command_output(script).split("\0")
+        values = {k: "" for k in commands}
+        for k, v in zip(output[0::2], output[1::2]):
+            if k in values:
+                values[k] = v.strip()
+        return values
 
     def get_command_output(self, cmd):
         with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as f:
@@ -552,6 +793,9 @@ class Build:
                 result = BuildInfo("SKIP")
             else:
                 result = self.build(target)
+                if not result.skipped:
+                    for stats in self.cache_stats:
+                        stats.record(self, target.name)
                 if (self.fail_fast and result.failed) or self.interrupted:
                     skip_all = True
             result.duration = time.time() - start
@@ -568,6 +812,9 @@ class Build:
                 debug(f"Skipping {target.name} because precondition failed")
                 return BuildInfo("SKIP")
 
+        if target.name == "default":
+            self.prepare_tree()
+
         target.prepare()
 
         fail = False
@@ -584,8 +831,37 @@ class Build:
         if fail:
             return BuildInfo("FAIL")
 
+        target.finish()
         return BuildInfo("PASS")
 
+    def prepare_tree(self):
+        """
+        Seeds the build directory with the host tools and generated headers
+        from the prepared tree cache, if enabled; on a cache miss, prepares
+        the tree with `make prepare` and stores the result in the cache.
+        """
+        if not self.prepared_tree_cache:
+            return
+        key = prepared_tree.get_key(self)
+        if not key:
+            return
+        start = time.time()
+        if self.prepared_tree_cache.restore(key, self.build_dir):
+            self.log(f"I: Prepared tree restored from the cache ({key})")
+            result = "hit"
+        elif self.run_cmd(["{make}", "prepare"]):
+            self.prepared_tree_cache.store(
+                key, self.build_dir, self.target_arch.source_arch
+            )
+            result = "miss"
+        else:
+            result = "failed"
+        self.metadata["prepared_tree"] = {
+            "cache": result,
+            "key": key,
+            "duration": time.time() - start,
+        }
+
     def check_artifacts(self, target):
         ret = True
         for _, artifact in target.find_artifacts(self.build_dir):
@@ -600,9 +876,20 @@ class Build:
             if not src.exists():
                 continue
             dest = self.output_dir / origdest
-            shutil.copy(src, Path(self.output_dir / dest))
+            if self.artifact_store:
+                checksums = self.artifact_store.publish(src, dest)
+            else:
+                checksums = artifact_store.copy_file(src, dest, self.hash_algorithms)
+                shutil.copymode(src, dest)
+            self.artifact_checksums.append({"name": origdest, **checksums})
             self.artifacts[target.name].append(origdest)
 
+    def copy_all_artifacts(self):
+        # targets are copied in parallel, so that large artifacts (e.g. the
+        # modules tarball) are hashed at the same time as the others.
+        with futures.ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            list(executor.map(self.copy_artifacts, self.targets))
+
     @property
     def passed(self):
         """
@@ -634,11 +921,21 @@ class Build:
             "kconfig": self.kconfig,
             "kconfig_add": self.kconfig_add,
             "jobs": self.jobs,
+            "jobs_plan": self.jobs_plan and self.jobs_plan.as_dict(),
+            "host_jobserver": self.jobserver is not None,
             "runtime": self.runtime.name,
+            "build_dir_backend": self.__build_dir_backend_used__,
             "verbose": self.verbose,
             "reproducer_cmdline": self.cmdline.reproduce(self),
         }
         errors, warnings = self.parse_log()
+        if self.wrapper.distributed is not None:
+            log = (self.output_dir / "build.log").read_text(errors="replace")
+            self.metadata["distributed"] = {
+                "wrapper": self.wrapper.name,
+                "jobs": self.jobs,
+                **self.wrapper.get_distribution_stats(log),
+            }
         self.metadata["results"] = {
             "status": "PASS" if self.passed else "FAIL",
             "targets": {
@@ -649,13 +946,76 @@ class Build:
             "errors": errors,
             "warnings": warnings,
             "duration": self.__durations__,
+            "cached": False,
         }
+        self.metadata["results"]["artifact_checksums"] = sorted(
+            self.artifact_checksums, key=lambda c: c["name"]
+        )
+        timing = self.get_timing()
+        if timing:
+            self.metadata["timing"] = timing
+            cache.set(
+                peak_rss_key(self.toolchain, self.target_arch), timing["peak_rss"]
+            )
+        for stats in self.cache_stats:
+            cache_stats = stats.get_metadata()
+            if cache_stats:
+                self.metadata[stats.name] = cache_stats
+        if self.pressure_monitor:
+            self.metadata["pressure"] = self.pressure_monitor.get_metadata()
         self.metadata["tuxmake"] = {"version": __version__}
         self.metadata["runtime"] = self.runtime.get_metadata()
 
         extracted = self.metadata_collector.collect()
         self.metadata.update(extracted)
 
+    def restore_result(self):
+        """
+        Restores the result of a previous build with the same inputs from the
+        result cache. Returns `True` if there was one, in which case the build
+        itself is skipped.
+        """
+        self.fingerprint = result_cache.fingerprint(self)
+        if not self.fingerprint:
+            return False
+        metadata = self.result_cache.restore(self.fingerprint, self.output_dir)
+        if metadata is None:
+            return False
+        results = metadata["results"]
+        for name, info in results["targets"].items():
+            self.status[name] = BuildInfo(info["status"], info["duration"])
+        self.artifacts.update(
+            {k: v for k, v in results["artifacts"].items() if k != "log"}
+        )
+        results["artifacts"] = self.artifacts
+        results["duration"] = self.__durations__
+        results["cached"] = True
+        results["fingerprint"] = self.fingerprint
+        self.metadata.update(metadata)
+        self.cached = True
+        self.log(f"I: Build result restored from the result cache ({self.fingerprint})")
+        return True
+
+    def store_result(self):
+        if not self.fingerprint or self.interrupted:
+            return
+        if all(t.name in self.status for t in self.targets) and self.passed:
+            self.result_cache.store(self.fingerprint, self.output_dir)
+
+    def get_timing(self):
+        """
+        Returns the summary of the compiler invocation timings recorded by
+        the `timing` wrapper, if used.
+        """
+        path = self.wrapper.environment.get("TUXMAKE_TIMING_FILE")
+        if not path:
+            return None
+        return timing.summarize(
+            self.format_cmd_part(path),
+            build_dir=self.build_dir,
+            duration=self.__durations__.get("build"),
+        )
+
     def save_metadata(self):
         with (self.output_dir / "metadata.json").open("w") as f:
             f.write(json.dumps(self.metadata, indent=4, sort_keys=True))
@@ -667,9 +1027,15 @@ class Build:
         return parser.errors, parser.warnings
 
     def cleanup(self):
+        if self.jobserver:
+            self.jobserver.leave()
         self.runtime.cleanup()
+        self.wrapper.cleanup()
+        if self.artifact_store:
+            self.artifact_store.maybe_collect_garbage()
         if self.clean_build_tree:
-            shutil.rmtree(self.build_dir, ignore_errors=True)
+            release_tmpfs_dir(self.build_dir)
+            trash.discard(self.build_dir)
 
     def check_environment(self):
         self.runtime.prepare()
@@ -691,9 +1057,8 @@ class Build:
         if not result:
             raise EnvironmentCheckFailed()
 
-    def prepare_korg_gcc_toolchain(self):
+    def get_korg_gcc_target(self):
         suffix = self.toolchain.suffix()
-        tc_full_version = self.runtime.get_toolchain_full_version(self.toolchain.name)
         # TODO: Find a better way to avoid the following conditional checks
         target_arch = self.target_arch.name
         if self.target_arch.name == "arm":
@@ -706,6 +1071,40 @@ class Build:
             target_arch = "hppa"
         else:
             target_arch = self.target_arch.name
+        return target_arch, suffix
+
+    def download_korg_gcc_toolchain(self):
+        """
+        Downloads the kernel.org toolchain archive and its signature into the
+        toolchains cache, on the host. This runs while the runtime is being
+        prepared; verifying and extracting the archive needs tools from the
+        container image, so that is left to `prepare_korg_gcc_toolchain`,
+        which also downloads anything that is still missing by itself.
+        """
+        version = self.runtime.get_toolchain_full_version(self.toolchain.name)
+        target_arch, suffix = self.get_korg_gcc_target()
+        host = native_arch.name
+        name = f"{host}-gcc-{version}-nolibc-{target_arch}-{suffix}"
+        url = f"{KORG_GCC_URL}/{host}/{version}/{name}"
+        files = (
+            (f"{url}.tar.gz", self.korg_toolchains_dir / f"{name}.tar.gz"),
+            (
+                f"{url}.tar.sign",
+                self.korg_toolchains_dir / "signatures" / f"{name}.tar.sign",
+            ),
+        )
+        for src, dest in files:
+            if dest.exists():
+                continue
+            try:
+                download_file(src, dest)
+            except (OSError, http.client.HTTPException) as exc:
+                debug(f"Downloading {src} failed ({exc})")
+                return
+
+    def prepare_korg_gcc_toolchain(self):
+        tc_full_version = self.runtime.get_toolchain_full_version(self.toolchain.name)
+        target_arch, suffix = self.get_korg_gcc_target()
 
         # Calculate the cross compile tool prefix
         # TODO: Consider adding cross tools to the PATH and simplifying this
@@ -769,29 +1168,34 @@ class Build:
 
             with self.measure_duration("Preparation", metadata="prepare"):
                 self.prepare()
-                if self.prepare_korg_gcc:
-                    self.prepare_korg_gcc_toolchain()
 
             prepared = True
             self.log(quote_command_line(self.cmdline.reproduce(self)))
 
-            with self.go_offline():
-                with self.measure_duration("Build", metadata="build"):
-                    self.build_all_targets()
+            if not self.cached:
+                with self.go_offline():
+                    with self.measure_duration("Build", metadata="build"):
+                        with self.monitor_pressure():
+                            self.build_all_targets()
         finally:
             with self.measure_duration("Copying Artifacts", metadata="copy"):
-                for target in self.targets:
-                    self.copy_artifacts(target)
+                if not self.cached:
+                    self.copy_all_artifacts()
 
             with self.measure_duration("Metadata Extraction", metadata="metadata"):
-                if prepared:
+                if prepared and not self.cached:
                     self.collect_metadata()
+                    self.record_build_dir_size()
 
             with self.measure_duration("Cleanup", metadata="cleanup"):
                 if self.auto_cleanup:
                     self.cleanup()
 
             self.save_metadata()
+            if prepared and not self.cached:
+                self.store_result()
+            record_output_dir_size(self.output_dir)
+            release_output_dir(self.output_dir)
 
             signal.signal(signal.SIGTERM, old_sigterm)
 
@@ -1,6 +1,6 @@
-import multiprocessing
 from typing import List
 from tuxmake.arch import Architecture
+from tuxmake.jobs import get_cpus
 from tuxmake.target import supported_targets
 from tuxmake.target import Compression
 from tuxmake.target import default_compression
@@ -30,5 +30,5 @@ class defaults:
         "debugkernel",
         "headers",
     ]
-    jobs: int = multiprocessing.cpu_count()
+    jobs: int = get_cpus()
     compression: str = default_compression.name
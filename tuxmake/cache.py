@@ -1,6 +1,14 @@
+import fcntl
 import shelve
+import threading
+from contextlib import contextmanager
 from tuxmake.xdg import cache_dir
 
+# the underlying database does not support concurrent access, be it from
+# several threads (e.g. parallel image pulls), or from several tuxmake
+# processes running at the same time.
+__lock__ = threading.Lock()
+
 
 def __cache__():
     cache = cache_dir() / "cache"
@@ -12,11 +20,23 @@ def __key__(k):
     return "/".join(k)
 
 
+@contextmanager
+def __open__():
+    path = __cache__()
+    with __lock__, open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with shelve.open(path) as db:
+                yield db
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
 def set(key, value):
-    with shelve.open(__cache__()) as db:
+    with __open__() as db:
         db[__key__(key)] = value
 
 
 def get(key):
-    with shelve.open(__cache__()) as db:
+    with __open__() as db:
         return db.get(__key__(key))
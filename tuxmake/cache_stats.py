@@ -0,0 +1,142 @@
+"""
+Per-build statistics for compiler cache wrappers (ccache, sccache).
+
+The counters reported by the compiler caches are global to the cache (ccache)
+or to the server process (sccache). Instead of resetting them at the start of
+each build, which would also reset them for any other builds using the same
+cache, the counters are read before the build and after each target, and the
+statistics for each target and for the whole build are the differences
+between those snapshots.
+
+Those differences still include the activity of other builds using the same
+cache at the same time, so they are only exact for a build that has a cache
+of its own, e.g. the local cache of `TUXMAKE_SHARED_CACHE`.
+"""
+
+import json
+
+# ccache counters for compilations that can't be cached.
+CCACHE_UNCACHEABLE = (
+    "autoconf_test",
+    "bad_compiler_arguments",
+    "bad_input_file",
+    "called_for_link",
+    "called_for_preprocessing",
+    "compiler_produced_empty_output",
+    "compiler_produced_no_output",
+    "compiler_produced_stdout",
+    "could_not_use_modules",
+    "could_not_use_precompiled_header",
+    "multiple_source_files",
+    "no_input_file",
+    "output_to_stdout",
+    "preprocessor_error",
+    "unsupported_code_directive",
+    "unsupported_compiler_option",
+    "unsupported_source_language",
+)
+
+
+def parse_ccache(output):
+    """
+    Parses the output of `ccache --print-stats` (ccache 3.7+).
+    """
+    counters = {}
+    for line in output.splitlines():
+        key, _, value = line.partition("\t")
+        try:
+            counters[key] = int(value)
+        except ValueError:
+            continue
+    if "cache_miss" not in counters:
+        return None
+    return {
+        "cache_hits": counters.get("direct_cache_hit", 0)
+        + counters.get("preprocessed_cache_hit", 0),
+        "cache_misses": counters["cache_miss"],
+        "uncacheable": sum(counters.get(k, 0) for k in CCACHE_UNCACHEABLE),
+        "cache_size": counters.get("cache_size_kibibyte", 0) * 1024,
+    }
+
+
+def parse_sccache(output):
+    """
+    Parses the output of `sccache --show-stats --stats-format=json`.
+    """
+    try:
+        data = json.loads(output)
+        stats = data["stats"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    def total(key):
+        return sum((stats.get(key) or {}).get("counts", {}).values())
+
+    return {
+        "cache_hits": total("cache_hits"),
+        "cache_misses": total("cache_misses"),
+        "uncacheable": stats.get("non_cacheable_compilations", 0)
+        + stats.get("non_cacheable_calls", 0),
+        "cache_size": data.get("cache_size") or 0,
+    }
+
+
+PARSERS = {"ccache": parse_ccache, "sccache": parse_sccache}
+
+
+def diff(after, before):
+    result = {k: after[k] - before[k] for k in after}
+    result["cache_size_delta"] = result.pop("cache_size")
+    lookups = result["cache_hits"] + result["cache_misses"]
+    result["hit_rate"] = round(result["cache_hits"] / lookups, 4) if lookups else None
+    return result
+
+
+class CacheStats:
+    """
+    Collects the statistics of the wrapper **name**, obtained with
+    **command** and parsed with the **parser** function.
+    """
+
+    def __init__(self, name, command, parser):
+        self.name = name
+        self.command = command
+        self.parser = parser
+        self.initial = None
+        self.last = None
+        self.targets = {}
+
+    @staticmethod
+    def create(wrapper):
+        """
+        Returns a `CacheStats` for **wrapper**, or `None` if it doesn't
+        provide statistics.
+        """
+        if not wrapper.stats:
+            return None
+        return CacheStats(
+            wrapper.name, wrapper.stats["command"], PARSERS[wrapper.stats["format"]]
+        )
+
+    def snapshot(self, build):
+        return self.parser(build.get_command_output(self.command))
+
+    def start(self, build):
+        self.initial = self.last = self.snapshot(build)
+
+    def record(self, build, target):
+        """
+        Records the statistics for **target**, which has just been built.
+        """
+        if self.last is None:
+            return
+        current = self.snapshot(build)
+        if current is None:
+            return
+        self.targets[target] = diff(current, self.last)
+        self.last = current
+
+    def get_metadata(self):
+        if self.initial is None:
+            return None
+        return {**diff(self.last, self.initial), "targets": self.targets}
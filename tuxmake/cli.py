@@ -48,6 +48,10 @@ def run_hooks(hooks, cwd):
 def main(*origargv):
     if not origargv:
         origargv = tuple(sys.argv[1:])
+    if origargv[:1] == ("images",):
+        from tuxmake.images import main as images
+
+        return images(origargv[1:])
     argv = read_config("default", missing_ok=True)
     for a in origargv:
         if a.startswith("@"):
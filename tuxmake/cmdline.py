@@ -3,6 +3,7 @@ from pathlib import Path
 import re
 import sys
 
+from tuxmake.jobs import parse as parse_jobs
 from tuxmake.runtime import Runtime
 from tuxmake.build_utils import supported, defaults
 from tuxmake import __version__
@@ -17,6 +18,14 @@ def abspath(path):
     return Path(path).absolute()
 
 
+def jobs(s):
+    try:
+        parse_jobs(s)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+    return int(s) if s.isdigit() else s
+
+
 def build_parser(cls=argparse.ArgumentParser, **kwargs):
     parser = cls(
         prog="tuxmake",
@@ -65,6 +74,12 @@ def build_parser(cls=argparse.ArgumentParser, **kwargs):
         default=None,
         help="Build directory. For incremental builds, specify the same directory on subsequential builds (default: temporary, clean directory).",
     )
+    build_output.add_argument(
+        "--build-dir-backend",
+        choices=["disk", "tmpfs"],
+        default=None,
+        help="Where to create the build directory, when --build-dir is not used. disk: under the output directory. tmpfs: in /dev/shm (or $TUXMAKE_TMPFS_DIR), so that the build does not write the object files to disk; used only if previous builds with the same configuration indicate that the build will fit in the available memory, so the first build of each configuration is done on disk. A build that runs out of space in tmpfs fails, and the following ones with the same configuration use disk. Only the artifacts are copied to the output directory. (default: disk).",
+    )
     build_output.add_argument(
         "-z",
         "--compression-type",
@@ -116,7 +131,7 @@ def build_parser(cls=argparse.ArgumentParser, **kwargs):
         "-w",
         "--wrapper",
         type=str,
-        help=f"Compiler wrapper to use in the build. Default: none. Supported: {', '.join(supported.wrappers)}. When used with containers, either the wrapper binary must be available in the container image, OR you can pass --wrapper=/path/to/WRAPPER and WRAPPER will be bind mounted in /usr/local/bin inside the container (for this to work WRAPPER needs to be a static binary, or have its shared library dependencies available inside the container).",
+        help=f"Compiler wrapper to use in the build. Default: none. Supported: {', '.join(supported.wrappers)}. Several wrappers can be used together by separating them with commas (e.g. timing,ccache); each one wraps the ones after it. When used with containers, either the wrapper binary must be available in the container image, OR you can pass --wrapper=/path/to/WRAPPER and WRAPPER will be bind mounted in /usr/local/bin inside the container (for this to work WRAPPER needs to be a static binary, or have its shared library dependencies available inside the container).",
     )
     buildenv.add_argument(
         "-e",
@@ -128,8 +143,13 @@ def build_parser(cls=argparse.ArgumentParser, **kwargs):
     buildenv.add_argument(
         "-j",
         "--jobs",
-        type=int,
-        help=f"Number of concurrent jobs to run when building (default: {defaults.jobs}).",
+        type=jobs,
+        help=f"Number of concurrent jobs to run when building. `auto` also takes the available memory into account, assuming that each job uses as much memory as the compiler used at most in previous builds with the same toolchain (as recorded with `--wrapper=timing`); use `auto:mem-per-job=SIZE` (e.g. `auto:mem-per-job=1G`) to set the memory needed per job explicitly. (default: number of available CPUs, taking into account CPU affinity and cgroup CPU quotas; currently {defaults.jobs}; or, with the distcc and icecc wrappers, the total number of job slots on the compilation hosts, if larger).",
+    )
+    buildenv.add_argument(
+        "--host-jobserver",
+        action="store_true",
+        help="Share a GNU make jobserver with all the other builds on the same host that also use this option, so that together they don't run more jobs than there are job slots in it. The first build to create the jobserver determines the number of job slots, from its --jobs. Each build holds one of the job slots while it runs, for the first job of its make, and waits for one to be free before starting. Job slots taken by a make process, or a build, that gets killed are only given back once no build is using the jobserver. Requires GNU make 4.4 or later in the build environment; falls back to --jobs if that is not available.",
     )
     buildenv.add_argument(
         "-r",
@@ -250,6 +270,75 @@ def build_parser(cls=argparse.ArgumentParser, **kwargs):
     return parser
 
 
+def comma_separated(s):
+    return [item for item in s.split(",") if item]
+
+
+def positive_int(s):
+    if not s.isdigit() or int(s) < 1:
+        raise argparse.ArgumentTypeError(f"invalid positive integer: {s}")
+    return int(s)
+
+
+def build_images_parser(cls=argparse.ArgumentParser, **kwargs):
+    parser = cls(
+        prog="tuxmake images",
+        description="Manages the container images used by tuxmake builds.",
+        **kwargs,
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    pull = subparsers.add_parser(
+        "pull",
+        help="Pulls the images for the given architectures and toolchains in advance, so that builds don't need to.",
+        description="Pulls the images for the given architectures and toolchains in advance, so that builds don't need to. Images that were already pulled in the last 24 hours are skipped.",
+    )
+    pull.add_argument(
+        "-a",
+        "--target-arch",
+        type=comma_separated,
+        action="append",
+        help=f"Architectures to pull images for. Can be used multiple times, and/or take a comma-separated list. Default: host architecture. Supported: {(', '.join(supported.architectures))}.",
+    )
+    pull.add_argument(
+        "-t",
+        "--toolchain",
+        type=comma_separated,
+        action="append",
+        help="Toolchains to pull images for. Can be used multiple times, and/or take a comma-separated list. Default: gcc.",
+    )
+    pull.add_argument(
+        "--all",
+        action="store_true",
+        help="Pull the images for all the supported combinations of architectures and toolchains.",
+    )
+    pull.add_argument(
+        "-r",
+        "--runtime",
+        default="docker",
+        help="Container runtime to pull images with (default: docker).",
+    )
+    pull.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=4,
+        help="Maximum number of images to pull at the same time (default: 4).",
+    )
+    pull.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Pull images even if they were pulled recently.",
+    )
+    pull.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Only print errors.",
+    )
+    return parser
+
+
 class Option:
     def __init__(self, key, opt, short_opt, **kwargs):
         self.key = key
@@ -305,6 +394,8 @@ class CommandLine:
         "jobs",
         "output_dir",
         "build_dir",
+        "build_dir_backend",
+        "host_jobserver",
         "check_environment",
         "download_all_korg_gcc_toolchains",
     ]
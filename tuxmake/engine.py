@@ -0,0 +1,275 @@
+"""
+Client for the Docker-compatible REST API that both docker and podman expose
+over a Unix socket. Talking to the API directly avoids forking the engine CLI
+(and the extra daemon round trip that each CLI invocation does) for the
+operations that tuxmake does many times per build, most importantly running
+commands inside the build container.
+
+Only the subset of the API used by tuxmake is implemented. Any failure to talk
+to the engine is reported as `EngineError`; callers are expected to fall back
+to using the CLI in that case.
+"""
+
+import codecs
+import http.client
+import io
+import json
+import os
+import socket
+import struct
+import threading
+from pathlib import Path
+from urllib.parse import quote, urlencode
+
+
+class EngineError(Exception):
+    pass
+
+
+def get_socket_path(engine):
+    """
+    Returns the path to the API socket of **engine** ("docker" or "podman"),
+    or `None` if the engine is configured to be reached in some other way
+    (e.g. over TCP or SSH).
+    """
+    if engine == "podman":
+        host = os.getenv("CONTAINER_HOST")
+        if host is None:
+            if os.getuid() == 0:
+                return Path("/run/podman/podman.sock")
+            runtime_dir = os.getenv("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
+            return Path(runtime_dir) / "podman" / "podman.sock"
+    else:
+        host = os.getenv("DOCKER_HOST")
+        if host is None:
+            return Path("/var/run/docker.sock")
+    if host.startswith("unix://"):
+        return Path(host.split("://", 1)[1])
+    return None
+
+
+def split_image_name(image):
+    """
+    Splits **image** into a repository and a tag (or digest), as expected by
+    the image pull API. Not passing a tag at all would pull all tags.
+    """
+    if "@" in image:
+        return tuple(image.split("@", 1))
+    repository, _, tag = image.rpartition(":")
+    if repository and "/" not in tag:
+        return repository, tag
+    return image, "latest"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(str(self.socket_path))
+        self.sock = sock
+
+
+class EngineClient:
+    """
+    Keeps persistent connections to the engine for request/response API
+    calls. A connection can only be used by one request at a time, so the
+    client can be shared between threads: each request takes an idle
+    connection (or opens a new one), and puts it back when done. Streaming
+    the output of a command takes over the connection it is done on until the
+    command finishes, so each of those uses a connection of its own.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.connections = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, engine):
+        """
+        Returns a client for **engine**, or `None` if its API can't be
+        reached.
+        """
+        path = get_socket_path(engine)
+        if not path or not path.is_socket():
+            return None
+        client = cls(path)
+        try:
+            client.request("GET", "/_ping")
+        except EngineError:
+            client.close()
+            return None
+        return client
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+
+    def acquire(self):
+        with self.lock:
+            if self.connections:
+                return self.connections.pop()
+        return UnixHTTPConnection(self.socket_path)
+
+    def release(self, connection):
+        with self.lock:
+            self.connections.append(connection)
+
+    def request(self, method, path, body=None, query=None):
+        if query:
+            path += "?" + urlencode(query)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection = self.acquire()
+        try:
+            for attempt in (1, 2):
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except (OSError, http.client.HTTPException) as exc:
+                    # the engine may have closed an idle connection; reconnect
+                    # once before giving up.
+                    connection.close()
+                    if attempt == 2:
+                        raise EngineError(f"{method} {path}: {exc}")
+        finally:
+            self.release(connection)
+        if response.status >= 400:
+            raise EngineError(
+                f"{method} {path}: {response.status} {self.get_message(data)}"
+            )
+        return data
+
+    @staticmethod
+    def get_message(data):
+        try:
+            return json.loads(data)["message"]
+        except (ValueError, KeyError, TypeError):
+            return data.decode("utf-8", errors="replace").strip()
+
+    def request_json(self, method, path, body=None, query=None):
+        data = self.request(method, path, body=body, query=query)
+        try:
+            return json.loads(data)
+        except ValueError as exc:
+            raise EngineError(f"{method} {path}: invalid response: {exc}")
+
+    def version(self):
+        return self.request_json("GET", "/version")
+
+    def inspect_image(self, image):
+        return self.request_json("GET", f"/images/{quote(image, safe='/:@')}/json")
+
+    def pull(self, image):
+        repository, tag = split_image_name(image)
+        data = self.request(
+            "POST", "/images/create", query={"fromImage": repository, "tag": tag}
+        )
+        # errors during the pull are reported in the progress stream, and not
+        # in the HTTP status.
+        for line in data.splitlines():
+            try:
+                progress = json.loads(line)
+            except ValueError:
+                continue
+            if "error" in progress:
+                raise EngineError(f"pull {image}: {progress['error']}")
+
+    def create_exec(self, container, cmd):
+        """
+        Creates (but doesn't start) an exec instance to run **cmd** in
+        **container**, returning its id.
+        """
+        body = {
+            "AttachStdin": False,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "Cmd": cmd,
+        }
+        response = self.request_json("POST", f"/containers/{container}/exec", body=body)
+        return response["Id"]
+
+    def start_exec(self, exec_id, output):
+        """
+        Starts the exec instance **exec_id**, and calls **output** with
+        `(stream, data)` for each chunk of output it produces, until it
+        finishes. Returns its exit code.
+        """
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            body = json.dumps({"Detach": False, "Tty": False})
+            connection.request(
+                "POST",
+                f"/exec/{exec_id}/start",
+                body=body,
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise EngineError(
+                    f"start exec: {response.status} {self.get_message(response.read())}"
+                )
+            self.demultiplex(response, output)
+        except (OSError, http.client.HTTPException) as exc:
+            raise EngineError(f"start exec: {exc}")
+        finally:
+            connection.close()
+        return self.request_json("GET", f"/exec/{exec_id}/json")["ExitCode"]
+
+    @staticmethod
+    def demultiplex(stream, output):
+        """
+        Reads the stdout/stderr multiplexed stream format: each frame has a
+        8-byte header with the stream type in the first byte, and the frame
+        size as a big-endian integer in the last 4 bytes.
+        """
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                return
+            kind, size = struct.unpack(">B3xI", header)
+            data = stream.read(size)
+            if data:
+                output(kind, data)
+            if len(data) < size:
+                return
+
+    def stop(self, container):
+        self.request("POST", f"/containers/{container}/stop")
+
+
+class LineDecoder:
+    """
+    Turns chunks of bytes into lines of text, the same way reading from a pipe
+    opened with `universal_newlines=True` would.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True
+        )
+        self.pending = ""
+
+    def feed(self, data, final=False):
+        self.pending += self.decoder.decode(data, final=final)
+        *lines, self.pending = self.pending.split("\n")
+        for line in lines:
+            self.callback(line + "\n")
+        if final and self.pending:
+            self.callback(self.pending)
+            self.pending = ""
+
+    def close(self):
+        self.feed(b"", final=True)
@@ -73,6 +73,18 @@ class RuntimeNotFoundError(TuxMakeUserError):
     )
 
 
+class InvalidJobs(TuxMakeUserError):
+    msg = "Invalid number of jobs: {name}"
+
+
+class UnsupportedBuildDirBackend(TuxMakeUserError):
+    msg = "Unsupported build directory backend: {name}"
+
+
+class UnsupportedOverlayBackend(TuxMakeUserError):
+    msg = "Unsupported overlay backend: {name}"
+
+
 class UnsupportedArchitectureToolchainCombination(TuxMakeUserError):
     msg = "Unsupported architecture/toolchain combination: {name}"
 
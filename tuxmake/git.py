@@ -0,0 +1,187 @@
+"""
+Minimal, read-only access to git repositories, for the cases where forking
+`git` would cost more than the information is worth (e.g. finding out the
+commit timestamp of the source tree on every build).
+
+All functions here return `None` when they find anything they don't
+understand (unknown repository format, deltified objects, etc). Callers are
+expected to fall back to calling `git` itself in that case.
+"""
+
+import mmap
+import re
+import struct
+import zlib
+from pathlib import Path
+
+SHA1 = re.compile(r"^[0-9a-f]{40}$")
+
+OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+
+PACK_IDX_MAGIC = b"\377tOc"
+
+
+def find_git_dir(directory):
+    dotgit = Path(directory) / ".git"
+    if dotgit.is_dir():
+        return dotgit
+    if dotgit.is_file():
+        content = dotgit.read_text().strip()
+        if content.startswith("gitdir:"):
+            gitdir = Path(directory) / content.split(":", 1)[1].strip()
+            if gitdir.is_dir():
+                return gitdir
+    return None
+
+
+def get_common_dir(gitdir):
+    commondir = gitdir / "commondir"
+    if commondir.exists():
+        return (gitdir / commondir.read_text().strip()).resolve()
+    return gitdir
+
+
+def read_packed_refs(common):
+    refs = {}
+    try:
+        lines = (common / "packed-refs").read_text().splitlines()
+    except FileNotFoundError:
+        return refs
+    for line in lines:
+        if line.startswith("#") or line.startswith("^"):
+            continue
+        parts = line.split()
+        if len(parts) == 2:
+            refs[parts[1]] = parts[0]
+    return refs
+
+
+def resolve_ref(gitdir, ref="HEAD"):
+    """
+    Returns the commit hash that **ref** points to, or `None`.
+    """
+    common = get_common_dir(gitdir)
+    for _ in range(5):
+        if SHA1.match(ref):
+            return ref
+        for base in (gitdir, common):
+            path = base / ref
+            if path.is_file():
+                content = path.read_text().strip()
+                break
+        else:
+            content = read_packed_refs(common).get(ref)
+            if content is None:
+                return None
+        if content.startswith("ref:"):
+            ref = content.split(":", 1)[1].strip()
+        else:
+            ref = content
+    return None
+
+
+def read_loose_object(common, sha):
+    path = common / "objects" / sha[:2] / sha[2:]
+    try:
+        data = zlib.decompress(path.read_bytes())
+    except FileNotFoundError:
+        return None
+    header, _, content = data.partition(b"\0")
+    objtype, _ = header.decode().split()
+    return objtype, content
+
+
+def find_in_pack_index(idx, sha):
+    """
+    Looks up **sha** in a version 2 pack index, returning the offset of the
+    object in the corresponding pack file, or `None`.
+    """
+    if idx[0:4] != PACK_IDX_MAGIC or struct.unpack_from(">I", idx, 4)[0] != 2:
+        return None
+    binsha = bytes.fromhex(sha)
+    fanout = 8
+    first = binsha[0]
+    lo = first and struct.unpack_from(">I", idx, fanout + (first - 1) * 4)[0]
+    hi = struct.unpack_from(">I", idx, fanout + first * 4)[0]
+    total = struct.unpack_from(">I", idx, fanout + 255 * 4)[0]
+    shas = fanout + 256 * 4
+    while lo < hi:
+        mid = (lo + hi) // 2
+        current = struct.unpack_from("20s", idx, shas + mid * 20)[0]
+        if current == binsha:
+            break
+        if current < binsha:
+            lo = mid + 1
+        else:
+            hi = mid
+    else:
+        return None
+    offsets = shas + total * 20 + total * 4
+    offset = struct.unpack_from(">I", idx, offsets + mid * 4)[0]
+    if offset & 0x80000000:
+        large_offsets = offsets + total * 4
+        n = offset & 0x7FFFFFFF
+        offset = struct.unpack_from(">Q", idx, large_offsets + n * 8)[0]
+    return offset
+
+
+def read_packed_object(pack, offset):
+    pack.seek(offset)
+    byte = pack.read(1)[0]
+    objtype = (byte >> 4) & 0x7
+    while byte & 0x80:
+        byte = pack.read(1)[0]
+    if objtype not in OBJECT_TYPES:
+        # deltified object
+        return None
+    decompressor = zlib.decompressobj()
+    content = b""
+    while not decompressor.eof:
+        chunk = pack.read(8192)
+        if not chunk:
+            return None
+        content += decompressor.decompress(chunk)
+    return OBJECT_TYPES[objtype], content
+
+
+def read_object(gitdir, sha):
+    """
+    Returns a `(type, content)` tuple for the object **sha**, or `None`.
+    """
+    common = get_common_dir(gitdir)
+    obj = read_loose_object(common, sha)
+    if obj:
+        return obj
+    for idxfile in (common / "objects" / "pack").glob("pack-*.idx"):
+        with idxfile.open("rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as idx:
+                offset = find_in_pack_index(idx, sha)
+        if offset is None:
+            continue
+        with idxfile.with_suffix(".pack").open("rb") as pack:
+            return read_packed_object(pack, offset)
+    return None
+
+
+def read_commit(gitdir, sha):
+    """
+    Returns the headers of the commit **sha** (`tree`, `parent`, `author`,
+    `committer` etc) as a `dict`, or `None`.
+    """
+    obj = read_object(gitdir, sha)
+    if not obj or obj[0] != "commit":
+        return None
+    headers = {}
+    for line in obj[1].decode("utf-8", errors="replace").splitlines():
+        if not line:
+            break
+        key, _, value = line.partition(" ")
+        headers.setdefault(key, value)
+    return headers
+
+
+def get_commit_timestamp(gitdir, sha):
+    commit = read_commit(gitdir, sha)
+    if not commit or "committer" not in commit:
+        return None
+    return commit["committer"].split()[-2]
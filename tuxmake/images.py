@@ -0,0 +1,195 @@
+"""
+Implementation of `tuxmake images`, for managing the container images used
+by builds ahead of time.
+
+`tuxmake images pull` pulls the images for a set of architecture/toolchain
+combinations in parallel, so that the first build with each of them doesn't
+have to. Pulled images are recorded in the same way as when a build pulls
+them, so builds in the following 24 hours will not try to pull them again.
+"""
+
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from concurrent import futures
+from datetime import timedelta
+from types import SimpleNamespace
+
+from tuxmake.arch import Architecture, native_arch
+from tuxmake.build import get_image
+from tuxmake.cmdline import build_images_parser
+from tuxmake.engine import split_image_name
+from tuxmake.exceptions import TuxMakeException
+from tuxmake.logging import error, info, set_quiet
+from tuxmake.runtime import ContainerRuntime, LocalMixin, Runtime
+from tuxmake.runtime import get_command_version
+from tuxmake.toolchain import NoExplicitToolchain, Toolchain
+
+
+class PullResult:
+    def __init__(self, image, status, duration=0, image_size=None, error=None):
+        self.image = image
+        self.status = status
+        self.duration = duration
+        # size of the image on disk; not necessarily what was downloaded, as
+        # layers may have been present already, and are compressed when
+        # transferred.
+        self.image_size = image_size
+        self.error = error
+
+    def __str__(self):
+        if self.status == "up-to-date":
+            return f"{self.image}: up to date"
+        if self.status == "fail":
+            return f"{self.image}: failed ({self.error})"
+        duration = timedelta(seconds=round(self.duration))
+        return f"{self.image}: pulled in {duration} (image size: {format_size(self.image_size)})"
+
+
+def format_size(size):
+    if size is None:
+        return "unknown size"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+
+
+def get_images(runtime, architectures, toolchains):
+    """
+    Returns the names of the images for all the supported combinations of
+    **architectures** and **toolchains**, in the same way as builds would
+    resolve them.
+    """
+    images = []
+    for arch in architectures:
+        for toolchain in toolchains:
+            if not runtime.is_supported(arch, toolchain):
+                continue
+            image = get_image(SimpleNamespace(target_arch=arch, toolchain=toolchain))
+            if image not in images:
+                images.append(image)
+    return images
+
+
+def get_base(runtime, image):
+    """
+    Returns the name of the image that **image** is built on top of, if
+    **image** is one of the images provided by tuxmake, or **image** itself
+    otherwise.
+    """
+    repository, _ = split_image_name(image)
+    for name, config in runtime.toolchain_images_map.items():
+        if repository == name or repository.endswith("/" + name):
+            return config.base
+    return image
+
+
+def schedule(runtime, images):
+    """
+    Splits **images** into two batches. The first one has one image for each
+    base image, and the second one has all the others. Pulling the first
+    batch before the second one makes the layers that images share with
+    their base be downloaded only once, instead of by several concurrent
+    pulls.
+    """
+    groups = OrderedDict()
+    for image in images:
+        groups.setdefault(get_base(runtime, image), []).append(image)
+    first = [group[0] for group in groups.values()]
+    rest = [image for group in groups.values() for image in group[1:]]
+    return first, rest
+
+
+def pull(runtime, image, force=False):
+    if not force and runtime.pulled_recently(image):
+        return PullResult(image, "up-to-date")
+    start = time.time()
+    try:
+        runtime.pull_image(image, quiet=True)
+    except (subprocess.CalledProcessError, OSError) as exc:
+        return PullResult(image, "fail", error=str(exc))
+    duration = time.time() - start
+    try:
+        image_size = runtime.get_image_size(image)
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        image_size = None
+    return PullResult(image, "pulled", duration=duration, image_size=image_size)
+
+
+def pull_images(runtime, images, jobs=4, force=False, report=None):
+    """
+    Pulls **images**, using up to **jobs** concurrent pulls. **report** is
+    called with a `PullResult` as each pull finishes. Returns the list of
+    results.
+    """
+    results = []
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for batch in schedule(runtime, images):
+            pending = [executor.submit(pull, runtime, i, force) for i in batch]
+            for future in futures.as_completed(pending):
+                result = future.result()
+                if report:
+                    report(result)
+                results.append(result)
+    return results
+
+
+def flatten(lists):
+    return [item for items in lists or [] for item in items]
+
+
+def get_runtime(name):
+    runtime = Runtime.get(name or "docker")
+    if not isinstance(runtime, ContainerRuntime) or isinstance(runtime, LocalMixin):
+        raise TuxMakeException(f"Runtime {runtime} does not pull images")
+    get_command_version(runtime.command)
+    return runtime
+
+
+def main(argv):
+    parser = build_images_parser()
+    options = parser.parse_args(argv)
+    if not options.command:
+        parser.print_help()
+        sys.exit(1)
+
+    set_quiet(options.quiet)
+    try:
+        runtime = get_runtime(options.runtime)
+        if options.all:
+            architectures = [Architecture(a) for a in Architecture.supported()]
+            toolchains = [Toolchain(t) for t in runtime.toolchains]
+        else:
+            arch_names = flatten(options.target_arch)
+            toolchain_names = flatten(options.toolchain)
+            architectures = [Architecture(a) for a in arch_names] or [native_arch]
+            toolchains = [Toolchain(t) for t in toolchain_names]
+            if not toolchains:
+                toolchains = [NoExplicitToolchain()]
+        images = get_images(runtime, architectures, toolchains)
+        if not images:
+            raise TuxMakeException("No images to pull")
+        start = time.time()
+        results = pull_images(
+            runtime, images, jobs=options.jobs, force=options.force, report=info
+        )
+    except TuxMakeException as exc:
+        error(str(exc))
+        sys.exit(1)
+
+    pulled = [r for r in results if r.status == "pulled"]
+    failed = [r for r in results if r.status == "fail"]
+    total_size = sum(r.image_size or 0 for r in pulled)
+    duration = timedelta(seconds=round(time.time() - start))
+    info(
+        f"{len(pulled)} image(s) pulled (image size: {format_size(total_size)}), "
+        f"{len(results) - len(pulled) - len(failed)} up to date, "
+        f"{len(failed)} failed, in {duration}"
+    )
+    if failed:
+        for result in failed:
+            error(str(result))
+        sys.exit(2)
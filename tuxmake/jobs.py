@@ -0,0 +1,185 @@
+"""
+Planning of the number of concurrent jobs for builds.
+
+The number of CPUs available is limited by the CPU affinity of the process
+(which reflects the cpuset it is in) and by the CPU quota (`cpu.max`) of its
+cgroup and the cgroups above it. With `--jobs=auto`, the amount of memory
+available (`MemAvailable`, and `memory.max` in the cgroup hierarchy) is also
+taken into account, based on the expected memory usage of each job: either
+given explicitly (`--jobs=auto:mem-per-job=1G`), or the peak RSS of a compiler
+invocation in previous builds with the same toolchain, if known.
+"""
+
+import math
+import os
+from pathlib import Path
+
+from tuxmake.output import get_available_memory, parse_size
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+PROC = Path("/proc")
+PROC_SELF_CGROUP = PROC / "self" / "cgroup"
+
+# how much more memory than the peak RSS seen in previous builds to plan for
+# each job.
+PEAK_RSS_MARGIN = 1.25
+
+
+def get_cgroup(pid=None):
+    """
+    Returns the directory of the (cgroup v2) cgroup of the process **pid**
+    (by default, the current process), or `None` if not available.
+    """
+    proc_cgroup = PROC / str(pid) / "cgroup" if pid else PROC_SELF_CGROUP
+    try:
+        lines = proc_cgroup.read_text().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith("0::"):
+            return CGROUP_ROOT / line[3:].lstrip("/")
+    return None
+
+
+def get_cgroup_hierarchy():
+    """
+    Returns the directories of the cgroup of the current process and all of
+    its ancestors, up to the root.
+    """
+    cgroup = get_cgroup()
+    if not cgroup:
+        return []
+    hierarchy = [cgroup]
+    while cgroup != CGROUP_ROOT and CGROUP_ROOT in cgroup.parents:
+        cgroup = cgroup.parent
+        hierarchy.append(cgroup)
+    return hierarchy
+
+
+def read_cgroup_file(cgroup, name):
+    try:
+        return (cgroup / name).read_text().strip()
+    except OSError:
+        return None
+
+
+def get_cpu_limit():
+    """
+    Returns the number of CPUs allowed by the tightest `cpu.max` quota in the
+    cgroup hierarchy, rounded up, or `None` if there is no quota.
+    """
+    limit = None
+    for cgroup in get_cgroup_hierarchy():
+        value = read_cgroup_file(cgroup, "cpu.max")
+        if not value:
+            continue
+        quota, _, period = value.partition(" ")
+        if quota == "max":
+            continue
+        try:
+            cpus = max(1, math.ceil(int(quota) / int(period or 100000)))
+        except (ValueError, ZeroDivisionError):
+            continue
+        limit = cpus if limit is None else min(limit, cpus)
+    return limit
+
+
+def get_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = get_cpu_limit()
+    if limit:
+        cpus = min(cpus, limit)
+    return cpus
+
+
+def get_memory():
+    """
+    Returns the amount of memory available for a build, in bytes: the lowest
+    of `MemAvailable` and the room left under `memory.max` in each level of
+    the cgroup hierarchy. Returns `None` if unknown.
+    """
+    memory = get_available_memory()
+    for cgroup in get_cgroup_hierarchy():
+        limit = read_cgroup_file(cgroup, "memory.max")
+        if not limit or limit == "max":
+            continue
+        try:
+            free = int(limit) - int(read_cgroup_file(cgroup, "memory.current") or 0)
+        except ValueError:
+            continue
+        free = max(free, 0)
+        memory = free if memory is None else min(memory, free)
+    return memory
+
+
+def peak_rss_key(toolchain, arch):
+    return ["peak-rss", toolchain.name, arch.name]
+
+
+class JobPlan:
+    """
+    The number of jobs chosen for a build, and what it was based on.
+    """
+
+    def __init__(self, jobs, cpus, memory=None, mem_per_job=None, limited_by="cpu"):
+        self.jobs = jobs
+        self.cpus = cpus
+        self.memory = memory
+        self.mem_per_job = mem_per_job
+        self.limited_by = limited_by
+
+    def as_dict(self):
+        return {
+            "jobs": self.jobs,
+            "cpus": self.cpus,
+            "memory": self.memory,
+            "mem_per_job": self.mem_per_job,
+            "limited_by": self.limited_by,
+        }
+
+
+def parse(spec):
+    """
+    Parses a `--jobs` value: either a number, or `auto`, optionally followed
+    by `:mem-per-job=SIZE`. Returns an `int` in the first case, or the
+    memory per job (`int`, or `None` if not given) wrapped in a `dict` in the
+    second case. Raises `ValueError` for invalid values.
+    """
+    if isinstance(spec, int) or spec.isdigit():
+        jobs = int(spec)
+        if jobs < 1:
+            raise ValueError(f"invalid number of jobs: {spec}")
+        return jobs
+    mode, _, options = spec.partition(":")
+    if mode != "auto":
+        raise ValueError(f"invalid number of jobs: {spec}")
+    auto = {"mem_per_job": None}
+    for option in [o for o in options.split(",") if o]:
+        key, _, value = option.partition("=")
+        if key != "mem-per-job":
+            raise ValueError(f"invalid option for --jobs=auto: {key}")
+        auto["mem_per_job"] = parse_size(value)
+    return auto
+
+
+def plan(mem_per_job=None, peak_rss=None):
+    """
+    Plans the number of jobs for a build. **mem_per_job** is the amount of
+    memory, in bytes, to reserve for each job; if not given, it is derived
+    from **peak_rss**, the peak RSS of a compiler invocation seen in previous
+    builds. Without either, only the available CPUs are considered.
+    """
+    cpus = get_cpus()
+    if mem_per_job is None and peak_rss:
+        mem_per_job = int(peak_rss * PEAK_RSS_MARGIN)
+    memory = get_memory()
+    result = JobPlan(cpus, cpus, memory, mem_per_job)
+    if mem_per_job and memory is not None:
+        jobs = max(1, memory // mem_per_job)
+        if jobs < cpus:
+            result.jobs = jobs
+            result.limited_by = "memory"
+    return result
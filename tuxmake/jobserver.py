@@ -0,0 +1,230 @@
+"""
+Host-wide GNU make jobserver, shared by concurrent tuxmake builds.
+
+The jobserver is a named FIFO under `~/.cache/tuxmake/jobserver`, filled with
+one token per job slot. GNU make (4.4 or later) can use it directly with
+`--jobserver-auth=fifo:PATH`, so that the total number of jobs run by all the
+builds using it is bounded by the number of slots, while each build can still
+use any slots that the others leave idle.
+
+A make started with `--jobserver-auth` has one implicit job slot, for which
+it doesn't take a token. So that the implicit slots are counted as well, each
+build takes a token when it joins the jobserver (waiting for one if needed),
+and only gives it back when it leaves.
+
+The contents of a FIFO are lost when nobody has it open, so the first build
+to need the jobserver starts a small detached process (this module, run with
+`python -m tuxmake.jobserver`) that keeps it open. Builds hold a shared lock
+on the `clients` file while they use the jobserver; once that has not been
+the case for `IDLE_TIMEOUT` seconds, the process removes the FIFO and exits.
+
+A make (or a build) that is killed (e.g. by the OOM killer) while holding
+tokens never returns them, so the builds running at that time have fewer job slots
+between them. The tokens can't be told apart, so lost ones are only
+reclaimed when there are no clients: the process then resets the FIFO to
+its full number of tokens.
+"""
+
+import fcntl
+import os
+import select
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from tuxmake import xdg
+
+LOCK = "lock"
+CLIENTS = "clients"
+FIFO = "fifo"
+PID = "pid"
+
+# how often the process keeping the FIFO open checks for clients, and how
+# long it waits after the last client is gone before exiting, in seconds.
+POLL_INTERVAL = 1
+IDLE_TIMEOUT = 10
+
+# how long to wait for the process keeping the FIFO open to start.
+START_TIMEOUT = 10
+
+
+class JobserverError(Exception):
+    pass
+
+
+def get_jobserver_dir():
+    return xdg.cache_dir() / "jobserver"
+
+
+@contextmanager
+def locked(directory):
+    with (directory / LOCK).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class HostJobserver:
+    def __init__(self, directory=None):
+        self.directory = Path(directory or get_jobserver_dir())
+        self.clients = None
+        # the FIFO, and the token taken from it for the implicit job slot.
+        self.slot = None
+        self.token = None
+
+    @property
+    def fifo(self):
+        return self.directory / FIFO
+
+    @property
+    def auth(self):
+        """
+        The value to pass to make as `--jobserver-auth`.
+        """
+        return f"fifo:{self.fifo}"
+
+    def running(self):
+        try:
+            pid = int((self.directory / PID).read_text())
+        except (OSError, ValueError):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return self.fifo.exists()
+
+    def join(self, slots):
+        """
+        Starts using the jobserver, creating it with **slots** job slots if
+        it is not running yet, and waits for a free job slot. Raises
+        `JobserverError` if it can't be started.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            with locked(self.directory):
+                if not self.running():
+                    self.start(slots)
+                clients = (self.directory / CLIENTS).open("a")
+                fcntl.flock(clients, fcntl.LOCK_SH)
+                fifo = os.open(str(self.fifo), os.O_RDWR | os.O_NONBLOCK)
+            try:
+                self.token = os.read(fifo, 1)
+            except BlockingIOError:
+                # wait without being a client, so that lost tokens can be
+                # reclaimed if all the other builds are done.
+                clients.close()
+                try:
+                    select.select([fifo], [], [], POLL_INTERVAL)
+                finally:
+                    os.close(fifo)
+                continue
+            self.clients = clients
+            self.slot = fifo
+            return
+
+    def leave(self):
+        if self.clients:
+            # the token must be back before the jobserver can see that there
+            # are no clients, and refill the FIFO.
+            os.write(self.slot, self.token)
+            os.close(self.slot)
+            self.slot = self.token = None
+            self.clients.close()
+            self.clients = None
+
+    def start(self, slots):
+        unlink(self.directory / PID)
+        unlink(self.fifo)
+        os.mkfifo(str(self.fifo), 0o600)
+        env = dict(os.environ)
+        package_dir = str(Path(__file__).parent.parent)
+        env["PYTHONPATH"] = os.pathsep.join(
+            p for p in [package_dir, env.get("PYTHONPATH")] if p
+        )
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "tuxmake.jobserver",
+                str(self.directory),
+                str(slots),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            env=env,
+        )
+        deadline = time.time() + START_TIMEOUT
+        while not (self.directory / PID).exists():
+            if process.poll() is not None or time.time() > deadline:
+                raise JobserverError("could not start the host jobserver")
+            time.sleep(0.01)
+
+
+def serve(directory, slots):
+    """
+    Keeps the jobserver FIFO in **directory** open, with **slots** job
+    slots, until there are no more clients.
+    """
+    directory = Path(directory)
+    fifo = os.open(str(directory / FIFO), os.O_RDWR | os.O_NONBLOCK)
+    refill(fifo, slots)
+    pid = directory / (PID + ".tmp")
+    pid.write_text(str(os.getpid()))
+    os.replace(str(pid), str(directory / PID))
+
+    idle_since = None
+    while True:
+        time.sleep(POLL_INTERVAL)
+        with locked(directory), (directory / CLIENTS).open("a") as clients:
+            try:
+                fcntl.flock(clients, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                idle_since = None
+                continue
+            now = time.time()
+            if idle_since is None:
+                idle_since = now
+                # no make is running, so no tokens should be taken
+                refill(fifo, slots)
+            elif now - idle_since >= IDLE_TIMEOUT:
+                unlink(directory / FIFO)
+                unlink(directory / PID)
+                return
+
+
+def refill(fifo, slots):
+    """
+    Resets the number of tokens in **fifo** (a non-blocking file descriptor)
+    to the one for **slots** job slots. Must only be called when no make is
+    using the jobserver.
+    """
+    try:
+        while os.read(fifo, 4096):
+            pass
+    except BlockingIOError:
+        pass
+    os.write(fifo, b"+" * slots)
+
+
+def main():
+    serve(sys.argv[1], int(sys.argv[2]))
+
+
+if __name__ == "__main__":
+    main()
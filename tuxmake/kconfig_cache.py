@@ -0,0 +1,125 @@
+"""
+Cache of resolved kernel configurations.
+
+Generating the `.config` for a build means running `make defconfig` (or
+copying a config file), merging the fragments with `merge_config.sh`, and
+then running `make olddefconfig`. For the same source tree, toolchain and
+kconfig arguments that always produces the same result.
+
+When enabled with `TUXMAKE_KCONFIG_CACHE=true`, the `config` target stores
+the resolved `.config` under a key calculated from its inputs, and later
+builds with the same inputs copy it from the cache instead of generating it
+again. The inputs are:
+
+- the git object ids of the Kconfig files, of `scripts/` and of the in-tree
+  configs and fragments;
+- the target architecture and toolchain, and the container image id (i.e.
+  the toolchain version);
+- the contents of the base config and of the fragments;
+- the make variables.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+
+from tuxmake import xdg
+from tuxmake.output import parse_size
+from tuxmake.result_cache import get_config_input
+from tuxmake.result_cache import get_tree_hash
+from tuxmake.result_cache import normalize
+from tuxmake.result_cache import sha256
+from tuxmake.wrapper import evict
+
+DEFAULT_MAX_SIZE = "100M"
+
+# parts of the source tree that the resolved .config depends on.
+SOURCES = (
+    "Makefile",
+    "scripts",
+    "arch/{arch}/Makefile",
+    "arch/{arch}/configs",
+    "kernel/configs",
+    ":(glob)**/Kconfig*",
+)
+
+
+def enabled():
+    return os.getenv("TUXMAKE_KCONFIG_CACHE", "false").lower() == "true"
+
+
+def get_cache_dir():
+    return Path(os.getenv("TUXMAKE_KCONFIG_CACHE_DIR") or xdg.cache_dir() / "kconfig")
+
+
+def get_max_size():
+    return parse_size(os.getenv("TUXMAKE_KCONFIG_CACHE_SIZE", DEFAULT_MAX_SIZE))
+
+
+class KconfigCache:
+    def __init__(self, directory=None, max_size=None):
+        self.directory = Path(directory or get_cache_dir())
+        self.max_size = get_max_size() if max_size is None else max_size
+
+    def entry(self, key):
+        return self.directory / f"{key}.config"
+
+    def get_key(self, build, downloads):
+        """
+        Returns the cache key for the `.config` of **build**, or `None` if it
+        can't be cached. **downloads** has the contents of the remote config
+        and fragments, as prefetched by the `config` target.
+        """
+        specs = [build.kconfig, *build.kconfig_add]
+        if any(spec.startswith("imake:") for spec in specs):
+            # interactive configuration
+            return None
+        arch = build.target_arch.source_arch
+        tree = get_tree_hash(build.source_tree, [s.format(arch=arch) for s in SOURCES])
+        image_id = build.runtime.get_image_id()
+        if not tree or not image_id:
+            return None
+        inputs = [
+            tree,
+            build.target_arch.name,
+            build.toolchain.name,
+            image_id,
+            *[get_config_input(s, downloads, build.source_tree) for s in specs],
+            *sorted(f"{k}={v}" for k, v in normalize(build, build.makevars).items()),
+        ]
+        return sha256("\n".join(inputs).encode("utf-8"))
+
+    def restore(self, key, config):
+        """
+        Copies the `.config` stored under **key** into **config**. Returns
+        `False` if there is none.
+        """
+        entry = self.entry(key)
+        try:
+            shutil.copyfile(str(entry), str(config))
+            os.utime(str(entry))
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, config):
+        """
+        Saves **config** under **key**, then evicts the least recently used
+        entries if the cache got too big.
+        """
+        tmp = None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=str(self.directory))
+            os.close(fd)
+            shutil.copyfile(str(config), tmp)
+            os.replace(tmp, str(self.entry(key)))
+        except OSError:
+            if tmp:
+                # might have been evicted by a concurrent build already
+                with suppress(FileNotFoundError):
+                    os.unlink(tmp)
+            return
+        evict(self.directory, self.max_size)
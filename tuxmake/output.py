@@ -1,27 +1,353 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, TextIO
+from contextlib import contextmanager
+from tuxmake import trash
 from tuxmake import xdg
 
+SEQUENCE_FILE = ".sequence"
+LOCK_FILE = ".lock"
+SIZES_FILE = ".sizes"
+
+# maximum number of build directories looked at by each garbage collection
+# run, so that the cost of allocating a new output directory stays bounded.
+GC_BATCH_SIZE = 100
+
+# build directories allocated by this process, and still in use, with the
+# files holding their allocation locks.
+__allocations__: Dict[str, TextIO] = {}
+
+# how much bigger than the estimated size of its contents the free space in
+# tmpfs needs to be, for a directory to be created there.
+TMPFS_SAFETY_MARGIN = 1.25
+
+# tmpfs directories that are not locked, and have not been modified for this
+# many seconds, were left behind by a tuxmake process that was killed.
+STALE_TMPFS_DIR_AGE = 60
+
+# tmpfs directories created by this process, and still in use, with the file
+# descriptors holding their locks.
+__tmpfs_dirs__: Dict[str, int] = {}
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
 
 def get_default_output_basedir():
     return xdg.cache_dir() / "builds"
 
 
-def get_new_output_dir():
+def parse_size(s):
+    m = re.match(r"^\s*(\d+)\s*([KMGT]?)i?B?\s*$", str(s), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"invalid size: {s}")
+    return int(m.group(1)) * SIZE_UNITS[m.group(2).upper()]
+
+
+class RetentionPolicy:
+    """
+    Limits enforced on the default builds directory. Any of the limits can be
+    `None`, meaning that limit is not enforced.
+
+    * **max_age**: maximum age of a build directory, in seconds.
+    * **max_count**: maximum number of build directories to keep.
+    * **max_size**: maximum total size of the build directories, in bytes.
+    """
+
+    def __init__(self, max_age=None, max_count=None, max_size=None):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_size = max_size
+
+    @classmethod
+    def from_environment(cls):
+        max_age = os.getenv("TUXMAKE_BUILDS_MAX_AGE")
+        max_count = os.getenv("TUXMAKE_BUILDS_MAX_COUNT")
+        max_size = os.getenv("TUXMAKE_BUILDS_MAX_SIZE")
+        return cls(
+            max_age=max_age and float(max_age) * 24 * 60 * 60 or None,
+            max_count=max_count and int(max_count) or None,
+            max_size=max_size and parse_size(max_size) or None,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.max_age or self.max_count or self.max_size)
+
+
+@contextmanager
+def locked(base):
+    with (base / LOCK_FILE).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_sequence(base):
+    try:
+        return json.loads((base / SEQUENCE_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        # first run against this directory (or a directory populated by an
+        # older version): find out where to start from. This is the only time
+        # the existing build directories are listed.
+        existing = get_output_dir_numbers(base)
+        if existing:
+            return {"next": max(existing) + 1, "oldest": min(existing)}
+        return {"next": 1, "oldest": 1}
+
+
+def get_output_dir_numbers(base):
+    return [int(f.name) for f in base.glob("[0-9]*") if f.name.isdigit()]
+
+
+def write_sequence(base, sequence):
+    tmp = base / (SEQUENCE_FILE + ".tmp")
+    tmp.write_text(json.dumps(sequence))
+    os.replace(tmp, base / SEQUENCE_FILE)
+
+
+def read_sizes(base):
+    sizes = {}
+    try:
+        lines = (base / SIZES_FILE).read_text().splitlines()
+    except FileNotFoundError:
+        return sizes
+    for line in lines:
+        try:
+            n, size = line.split()
+            sizes[int(n)] = int(size)
+        except ValueError:
+            continue
+    return sizes
+
+
+def write_sizes(base, sizes):
+    tmp = base / (SIZES_FILE + ".tmp")
+    tmp.write_text("".join(f"{n} {size}\n" for n, size in sorted(sizes.items())))
+    os.replace(tmp, base / SIZES_FILE)
+
+
+def get_directory_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for f in files:
+            total += os.lstat(os.path.join(root, f)).st_size
+    return total
+
+
+def allocation_lock(base, n):
+    return base / f".{n}{LOCK_FILE}"
+
+
+def allocate(base, n):
+    """
+    Marks build directory **n** as in use by this process until it is
+    released by `release_output_dir`, so that the garbage collection in
+    other processes leaves it alone.
+    """
+    lock = allocation_lock(base, n).open("a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    __allocations__[str(base / str(n))] = lock
+
+
+def is_allocated(base, n):
+    """
+    Whether build directory **n** is still in use by a running build. Builds
+    that were killed no longer hold their allocation locks.
+    """
+    try:
+        with allocation_lock(base, n).open("r") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    return False
+
+
+def record_output_dir_size(output_dir, policy=None):
+    """
+    Records the final size of a build directory allocated by
+    `get_new_output_dir`, if there is a size limit, so that the garbage
+    collection can enforce that limit without having to walk all of the
+    existing build directories.
+    """
     base = get_default_output_basedir()
-    base.mkdir(parents=True, exist_ok=True)
-    existing = [int(f.name) for f in base.glob("[0-9]*")]
-    if existing:
-        new = max(existing) + 1
-    else:
-        new = 1
-    while True:
-        new_dir = base / str(new)
+    if output_dir.parent != base or not output_dir.name.isdigit():
+        return
+    if policy is None:
+        policy = RetentionPolicy.from_environment()
+    if not policy.max_size:
+        return
+    size = get_directory_size(output_dir)
+    with locked(base):
+        with (base / SIZES_FILE).open("a") as f:
+            f.write(f"{output_dir.name} {size}\n")
+
+
+def release_output_dir(output_dir):
+    """
+    Releases a build directory allocated by `get_new_output_dir`, after the
+    build is finished, so that it can be garbage collected.
+    """
+    lock = __allocations__.pop(str(output_dir), None)
+    if not lock:
+        return
+    base = output_dir.parent
+    with locked(base):
+        allocation_lock(base, output_dir.name).unlink()
+        lock.close()
+
+
+def collect_garbage(base, sequence, policy, keep):
+    """
+    Removes the oldest build directories under **base** until **policy** is
+    satisfied. Build directories are numbered sequentially, so the oldest ones
+    are always at the start of the sequence; each run only looks at up to
+    `GC_BATCH_SIZE` of them, and stops at the first one that can be kept.
+    Build directories numbered **keep** or higher, and the ones still in use
+    by running builds, are never removed.
+
+    Must be called with the builds directory locked. The directories to be
+    removed are only renamed; returns their new names, so that the caller can
+    remove them after releasing the lock.
+    """
+    sizes = read_sizes(base)
+    total = sum(size for n, size in sizes.items() if n >= sequence["oldest"])
+    # the build directories that actually exist; some in the sequence might
+    # have been removed by hand.
+    count = len(get_output_dir_numbers(base)) if policy.max_count else 0
+    now = time.time()
+    sizes_changed = False
+    removed = []
+    for _ in range(GC_BATCH_SIZE):
+        n = sequence["oldest"]
+        if n >= keep:
+            break
+        directory = base / str(n)
         try:
-            new_dir.mkdir()
+            mtime = directory.stat().st_mtime
+        except FileNotFoundError:
+            sequence["oldest"] += 1
+            sizes_changed = sizes.pop(n, None) is not None or sizes_changed
+            continue
+        if is_allocated(base, n):
+            break
+        expired = policy.max_age and mtime < now - policy.max_age
+        too_many = policy.max_count and count > policy.max_count
+        too_big = policy.max_size and total > policy.max_size
+        if not (expired or too_many or too_big):
             break
-        except FileExistsError:
-            new += 1
+        hidden = base / f".{n}.removed"
+        os.rename(directory, hidden)
+        removed.append(hidden)
+        if allocation_lock(base, n).exists():
+            # left behind by a build that was killed
+            allocation_lock(base, n).unlink()
+        total -= sizes.pop(n, 0)
+        count -= 1
+        sizes_changed = True
+        sequence["oldest"] += 1
+    if sizes_changed:
+        write_sizes(base, sizes)
+    return removed
+
+
+def get_new_output_dir(policy=None):
+    base = get_default_output_basedir()
+    base.mkdir(parents=True, exist_ok=True)
+    if policy is None:
+        policy = RetentionPolicy.from_environment()
+    with locked(base):
+        sequence = read_sequence(base)
+        new = sequence["next"]
+        while True:
+            new_dir = base / str(new)
+            try:
+                new_dir.mkdir()
+                break
+            except FileExistsError:
+                new += 1
+        allocate(base, new)
+        sequence["next"] = new + 1
+        removed = []
+        if policy.enabled:
+            removed = collect_garbage(base, sequence, policy, keep=new)
+        write_sequence(base, sequence)
+    for directory in removed:
+        trash.discard(directory)
     return new_dir
 
 
+def get_tmpfs_dir():
+    return Path(os.getenv("TUXMAKE_TMPFS_DIR", "/dev/shm"))
+
+
+def get_available_memory():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def create_tmpfs_dir(prefix, estimate):
+    """
+    Creates a directory in tmpfs, and returns its path. **estimate** is the
+    expected size of what is going to be stored in it, in bytes. Returns
+    `None` if tmpfs is not available, if there is no estimate, or if there
+    isn't enough free space in tmpfs, or available memory, for that.
+
+    The directory is locked until `release_tmpfs_dir` is called on it, or
+    until this process exits. Unlocked directories with the same **prefix**,
+    left behind by processes that were killed, are removed first.
+    """
+    tmpfs = get_tmpfs_dir()
+    sweep_tmpfs_dirs(tmpfs, prefix)
+    try:
+        free = shutil.disk_usage(str(tmpfs)).free
+    except OSError:
+        return None
+    available = get_available_memory()
+    if available is not None:
+        free = min(free, available)
+    if not estimate or estimate * TMPFS_SAFETY_MARGIN > free:
+        return None
+    path = Path(tempfile.mkdtemp(prefix=prefix, dir=str(tmpfs)))
+    __tmpfs_dirs__[str(path)] = trash.lock(path)
+    return path
+
+
+def release_tmpfs_dir(path):
+    fd = __tmpfs_dirs__.pop(str(path), None)
+    if fd is not None:
+        os.close(fd)
+
+
+def sweep_tmpfs_dirs(tmpfs, prefix):
+    """
+    Discards the directories in **tmpfs** whose names start with **prefix**
+    (or that are trashed versions of those) that are no longer in use.
+    """
+    stale = time.time() - STALE_TMPFS_DIR_AGE
+    for entry in [*tmpfs.glob(f"{prefix}*"), *tmpfs.glob(f".{prefix}*")]:
+        try:
+            if entry.stat().st_mtime > stale:
+                continue
+        except OSError:
+            continue
+        trash.discard(entry)
+
+
 def get_default_korg_toolchains_dir():
     return xdg.cache_dir() / "korg_toolchains"
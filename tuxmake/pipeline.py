@@ -0,0 +1,79 @@
+"""
+Runs a set of steps concurrently, respecting explicit dependencies between
+them. Used to overlap the independent parts of build preparation, such as
+pulling the container image and downloading files.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class Step:
+    def __init__(self, name: str, func: Callable, after: Optional[List[str]] = None):
+        self.name = name
+        self.func = func
+        self.after = list(after or [])
+
+
+class Pipeline:
+    """
+    A set of steps. Each step starts as soon as all the steps listed in its
+    **after** have finished successfully, in its own thread.
+
+    If a step fails, steps that have not started yet are not started at all;
+    `run()` waits for the ones already running to finish, and then raises the
+    exception from the first step that failed.
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, Step] = {}
+        self.durations: Dict[str, float] = {}
+
+    def add(self, name, func, after=None):
+        for dep in after or []:
+            if dep not in self.steps:
+                raise ValueError(f"step {name} depends on unknown step {dep}")
+        self.steps[name] = Step(name, func, after)
+
+    def run(self):
+        lock = threading.Condition()
+        pending = dict(self.steps)
+        running = set()
+        done = set()
+        errors = []
+
+        def execute(step):
+            start = time.time()
+            try:
+                step.func()
+            except BaseException as exc:
+                with lock:
+                    errors.append(exc)
+            finally:
+                with lock:
+                    self.durations[step.name] = time.time() - start
+                    running.discard(step.name)
+                    done.add(step.name)
+                    lock.notify()
+
+        with lock:
+            while True:
+                if not errors:
+                    ready = [
+                        s for s in pending.values() if all(d in done for d in s.after)
+                    ]
+                    for step in ready:
+                        del pending[step.name]
+                        running.add(step.name)
+                        thread = threading.Thread(
+                            target=execute, args=(step,), name=f"prepare-{step.name}"
+                        )
+                        thread.daemon = True
+                        thread.start()
+                if not running:
+                    break
+                lock.wait()
+
+        if errors:
+            raise errors[0]
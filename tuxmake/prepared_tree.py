@@ -0,0 +1,143 @@
+"""
+Cache of prepared build trees.
+
+Before compiling anything for the kernel proper, every clean build builds
+the host tools under `scripts/` (fixdep, modpost, genksyms, dtc, etc.) and
+objtool, and generates the headers in `include/generated` and
+`include/config`. That is what `make prepare` does.
+
+When enabled with `TUXMAKE_PREPARED_TREE_CACHE=true`, tuxmake runs
+`make prepare` before the `default` target and saves those outputs in an
+archive. Later builds with the same inputs extract the archive into their
+build directory instead. The inputs are:
+
+- the git object ids of the parts of the source tree involved;
+- the path of the source tree, which appears in dependency files;
+- the target architecture and toolchain, and the container image id;
+- the resolved `.config`;
+- the make variables.
+"""
+
+import os
+import tarfile
+import tempfile
+from pathlib import Path
+
+from tuxmake import xdg
+from tuxmake.output import parse_size
+from tuxmake.result_cache import get_tree_hash
+from tuxmake.result_cache import normalize
+from tuxmake.result_cache import sha256
+from tuxmake.wrapper import evict
+
+DEFAULT_MAX_SIZE = "5G"
+
+# parts of the source tree that the outputs of `make prepare` depend on.
+SOURCES = (
+    "Makefile",
+    "Kbuild",
+    "Kconfig",
+    "scripts",
+    "include",
+    "arch/{arch}",
+    "tools",
+)
+
+# outputs of `make prepare` in the build directory.
+OUTPUTS = (
+    "scripts",
+    "include/config",
+    "include/generated",
+    "arch/{arch}/include/generated",
+    "tools/objtool",
+)
+
+
+def enabled():
+    return os.getenv("TUXMAKE_PREPARED_TREE_CACHE", "false").lower() == "true"
+
+
+def get_cache_dir():
+    return Path(
+        os.getenv("TUXMAKE_PREPARED_TREE_CACHE_DIR")
+        or xdg.cache_dir() / "prepared-trees"
+    )
+
+
+def get_max_size():
+    return parse_size(os.getenv("TUXMAKE_PREPARED_TREE_CACHE_SIZE", DEFAULT_MAX_SIZE))
+
+
+def get_key(build):
+    """
+    Returns the cache key for the prepared tree of **build**, or `None` if
+    it can't be cached. Must be called after the `.config` is generated.
+    """
+    arch = build.target_arch.source_arch
+    tree = get_tree_hash(build.source_tree, [s.format(arch=arch) for s in SOURCES])
+    image_id = build.runtime.get_image_id()
+    config = build.build_dir / ".config"
+    if not tree or not image_id or not config.exists():
+        return None
+    inputs = [
+        tree,
+        str(Path(build.source_tree).absolute()),
+        build.target_arch.name,
+        build.toolchain.name,
+        image_id,
+        sha256(config.read_bytes()),
+        *sorted(f"{k}={v}" for k, v in normalize(build, build.makevars).items()),
+    ]
+    return sha256("\n".join(inputs).encode("utf-8"))
+
+
+class PreparedTreeCache:
+    def __init__(self, directory=None, max_size=None):
+        self.directory = Path(directory or get_cache_dir())
+        self.max_size = get_max_size() if max_size is None else max_size
+
+    def archive(self, key):
+        return self.directory / f"{key}.tar"
+
+    def restore(self, key, build_dir):
+        """
+        Extracts the prepared tree stored under **key** into **build_dir**.
+        Returns `False` if there is none.
+        """
+        archive = self.archive(key)
+        # extraction filters only exist in newer Python versions
+        options = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+        try:
+            with tarfile.open(str(archive)) as tar:
+                members = tar.getmembers()
+                tar.extractall(str(build_dir), **options)
+            os.utime(str(archive))
+        except (OSError, tarfile.TarError):
+            return False
+        # the extracted files must be newer than the sources, otherwise make
+        # would rebuild them.
+        for member in members:
+            if not member.issym():
+                os.utime(str(Path(build_dir) / member.name))
+        return True
+
+    def store(self, key, build_dir, arch):
+        """
+        Saves the outputs of `make prepare` in **build_dir** under **key**,
+        then evicts the least recently used archives if the cache got too
+        big.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=str(self.directory))
+        try:
+            with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w") as tar:
+                for output in OUTPUTS:
+                    output = output.format(arch=arch)
+                    if (Path(build_dir) / output).exists():
+                        tar.add(str(Path(build_dir) / output), arcname=output)
+            os.replace(tmp, str(self.archive(key)))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        evict(self.directory, self.max_size)
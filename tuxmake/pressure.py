@@ -0,0 +1,228 @@
+"""
+Memory pressure aware build throttling.
+
+While the build runs, a monitor thread watches the memory pressure stall
+information (PSI) in `/proc/pressure/memory`, and the `memory.events`
+counters of the cgroup the build runs in (i.e. the one of the container,
+except with the null runtime). Under sustained pressure, it reduces the
+parallelism of the build until the pressure goes away:
+
+- when using the host jobserver (`--host-jobserver`), by withholding job
+  slots from it;
+- otherwise, by periodically pausing the build container (`docker pause`,
+  `podman pause`), which freezes its cgroup.
+
+Each period of throttling is recorded in the build metadata. This is enabled
+with `TUXMAKE_PRESSURE_THROTTLE=true`.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+from tuxmake.jobs import read_cgroup_file
+
+PSI_MEMORY = Path("/proc/pressure/memory")
+
+# memory.events counters that indicate that the cgroup is at its limit.
+LIMIT_EVENTS = ("max", "oom", "oom_kill")
+
+
+def enabled():
+    return os.getenv("TUXMAKE_PRESSURE_THROTTLE", "false").lower() == "true"
+
+
+def get_threshold():
+    return float(os.getenv("TUXMAKE_PRESSURE_THRESHOLD", "10"))
+
+
+def read_psi(path=None):
+    """
+    Returns the contents of a PSI file as a dict, e.g.
+    `{"some": {"avg10": 1.5, ...}, "full": {...}}`, or `None` if not
+    available.
+    """
+    try:
+        lines = Path(path or PSI_MEMORY).read_text().splitlines()
+    except OSError:
+        return None
+    psi = {}
+    for line in lines:
+        kind, *fields = line.split()
+        values = {}
+        for field in fields:
+            key, _, value = field.partition("=")
+            try:
+                values[key] = float(value)
+            except ValueError:
+                continue
+        psi[kind] = values
+    return psi
+
+
+def read_memory_events(cgroup):
+    events = {}
+    content = cgroup and read_cgroup_file(cgroup, "memory.events")
+    for line in (content or "").splitlines():
+        key, _, value = line.partition(" ")
+        try:
+            events[key] = int(value)
+        except ValueError:
+            continue
+    return events
+
+
+class Episode:
+    def __init__(self, start, action):
+        self.start = start
+        self.end = None
+        self.action = action
+        self.peak = 0.0
+
+    def as_dict(self, origin):
+        return {
+            "start": round(self.start - origin, 3),
+            "duration": round((self.end or time.time()) - self.start, 3),
+            "action": self.action,
+            "peak_full_avg10": self.peak,
+        }
+
+
+class PressureMonitor:
+    """
+    Monitors memory pressure while the build runs, throttling it while the
+    `full` avg10 pressure is at or above **threshold** (percent) for
+    **sustain** consecutive samples taken every **interval** seconds, or when
+    the cgroup hits its memory limit. Throttling stops after the pressure
+    stays below half of **threshold** for **sustain** samples.
+
+    **runtime** is used to pause the build; **jobserver** and **jobs**, if
+    given, to withhold job slots instead.
+    """
+
+    def __init__(
+        self,
+        runtime,
+        jobserver=None,
+        jobs=1,
+        threshold=10.0,
+        interval=1.0,
+        sustain=3,
+        pause_duration=5.0,
+    ):
+        self.runtime = runtime
+        self.jobserver = jobserver
+        self.jobs = jobs
+        self.threshold = threshold
+        self.interval = interval
+        self.sustain = sustain
+        self.pause_duration = pause_duration
+        self.cgroup = runtime.get_cgroup()
+        self.episodes = []
+        self.episode = None
+        self.origin = time.time()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.fifo = None
+        self.held = 0
+        self.high = 0
+        self.low = 0
+        self.events = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        self.origin = time.time()
+        self.events = read_memory_events(self.cgroup)
+        self.thread = threading.Thread(target=self.run, name="pressure-monitor")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.release()
+        if self.fifo is not None:
+            os.close(self.fifo)
+            self.fifo = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def hit_limit(self):
+        events = read_memory_events(self.cgroup)
+        hit = any(events.get(e, 0) > self.events.get(e, 0) for e in LIMIT_EVENTS)
+        self.events = events
+        return hit
+
+    def check(self):
+        psi = read_psi() or {}
+        full = psi.get("full", {}).get("avg10", 0.0)
+        limit = self.hit_limit()
+        if full >= self.threshold or limit:
+            self.high += 1
+            self.low = 0
+        elif full < self.threshold / 2:
+            self.low += 1
+            self.high = 0
+        if self.episode:
+            self.episode.peak = max(self.episode.peak, full)
+        if limit or self.high >= self.sustain:
+            self.throttle(full)
+        elif self.episode and self.low >= self.sustain:
+            self.release()
+
+    def throttle(self, full):
+        if not self.episode:
+            action = "jobserver" if self.jobserver else "pause"
+            self.episode = Episode(time.time(), action)
+            self.episode.peak = full
+            self.episodes.append(self.episode)
+        if self.jobserver:
+            self.withhold_slots()
+        elif self.runtime.pause():
+            self.stopped.wait(self.pause_duration)
+            self.runtime.resume()
+        else:
+            self.episode.action = "none"
+
+    def withhold_slots(self):
+        """
+        Takes half of the job slots still in use by the build, if available
+        in the jobserver, keeping at least one.
+        """
+        if self.fifo is None:
+            self.fifo = os.open(str(self.jobserver.fifo), os.O_RDWR | os.O_NONBLOCK)
+        wanted = max(1, (self.jobs - 1 - self.held) // 2)
+        wanted = min(wanted, self.jobs - 1 - self.held)
+        if wanted <= 0:
+            return
+        try:
+            self.held += len(os.read(self.fifo, wanted))
+        except BlockingIOError:
+            pass
+
+    def release(self):
+        if self.held:
+            os.write(self.fifo, b"+" * self.held)
+            self.held = 0
+        if self.episode:
+            self.episode.end = time.time()
+            self.episode = None
+        self.high = 0
+
+    def get_metadata(self):
+        episodes = [e.as_dict(self.origin) for e in self.episodes]
+        return {
+            "episodes": episodes,
+            "throttled_time": round(sum(e["duration"] for e in episodes), 3),
+        }
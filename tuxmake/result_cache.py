@@ -0,0 +1,255 @@
+"""
+Whole-build result cache.
+
+When enabled with `TUXMAKE_RESULT_CACHE=true`, a fingerprint of the inputs
+of the build is calculated as soon as the image is available and the kconfig
+files are downloaded, before starting the container or getting the
+toolchain: the git tree hash of the source tree, the container image id, the
+target architecture, toolchain, targets, compression type, kernel image,
+kconfig and fragments, make variables, environment, and the tuxmake version.
+If a previous successful build had the same fingerprint, its artifacts and
+metadata are restored into the output directory instead of building again.
+
+Only builds of clean git trees (no uncommitted changes or untracked files)
+with a runtime that can identify its image (i.e. not the null runtime) can
+be cached. The cache is shared by all builds of the same user, and its size
+is kept under `TUXMAKE_RESULT_CACHE_SIZE` by evicting the least recently
+used results.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from tuxmake import __version__
+from tuxmake import xdg
+from tuxmake.output import get_directory_size
+from tuxmake.output import locked
+from tuxmake.output import parse_size
+from tuxmake.target import Config
+
+DEFAULT_MAX_SIZE = "20G"
+
+# when over the size limit, evict results until the cache is down to this
+# fraction of it.
+EVICTION_TARGET = 0.9
+
+METADATA = "metadata.json"
+
+# size of the entry in bytes, recorded when it's stored, so that evicting
+# doesn't need to walk all the entries.
+SIZE = ".size"
+
+
+def enabled():
+    return os.getenv("TUXMAKE_RESULT_CACHE", "false").lower() == "true"
+
+
+def get_cache_dir():
+    return Path(os.getenv("TUXMAKE_RESULT_CACHE_DIR") or xdg.cache_dir() / "results")
+
+
+def get_max_size():
+    return parse_size(os.getenv("TUXMAKE_RESULT_CACHE_SIZE", DEFAULT_MAX_SIZE))
+
+
+def get_tree_hash(directory, paths=None):
+    """
+    Returns the git tree hash of the source tree in **directory**, or `None`
+    if it's not a git repository, or has uncommitted changes or untracked
+    files. If **paths** (git pathspecs) is given, only those paths are
+    considered, and a hash of their git object ids is returned instead.
+    """
+    pathspec = ["--", *paths] if paths else []
+    try:
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", *pathspec],
+            cwd=str(directory),
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        if status.strip():
+            return None
+        if paths:
+            # the index matches HEAD, since there are no changes
+            tree = subprocess.check_output(
+                ["git", "ls-files", "--stage", *pathspec],
+                cwd=str(directory),
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+            )
+            return sha256(tree.encode("utf-8"))
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD^{tree}"],
+            cwd=str(directory),
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        ).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_config_input(spec, downloads, source_tree=None):
+    """
+    Returns what identifies the contents of a kconfig or fragment **spec**:
+    a hash of the contents of downloaded and local files, or **spec** itself
+    (e.g. for make targets and inline fragments). In-tree files are only
+    hashed if **source_tree** is given.
+    """
+    if spec in downloads:
+        return sha256(downloads[spec].encode("utf-8"))
+    paths = [Path(spec)]
+    if source_tree:
+        paths.append(Path(source_tree) / spec)
+    for path in paths:
+        if path.is_file():
+            return sha256(path.read_bytes())
+    return spec
+
+
+def normalize(build, variables):
+    """
+    Replaces the build directory in the values of **variables**. It is
+    different for every build, but doesn't affect the results, e.g. in
+    `KCFLAGS=-ffile-prefix-map={build_dir}/=`.
+    """
+    build_dir = str(build.build_dir)
+    return {k: str(v).replace(build_dir, "{build_dir}") for k, v in variables.items()}
+
+
+def fingerprint(build):
+    """
+    Returns the fingerprint of the inputs of **build**, or `None` if its
+    result can't be cached.
+    """
+    if (build.build_dir / ".config").exists():
+        # incremental build on an existing build directory
+        return None
+    tree = get_tree_hash(build.source_tree)
+    image_id = build.runtime.get_image_id()
+    if not tree or not image_id:
+        return None
+
+    downloads = {}
+    for target in build.targets:
+        if isinstance(target, Config):
+            downloads = target.downloads
+
+    inputs = {
+        "tuxmake": __version__,
+        "tree": tree,
+        "runtime": build.runtime.name,
+        "image": image_id,
+        "target_arch": build.target_arch.name,
+        "toolchain": build.toolchain.name,
+        "targets": [t.name for t in build.targets],
+        "compression": build.compression.name,
+        "target_overrides": sorted(build.target_overrides.items()),
+        "kconfig": get_config_input(build.kconfig, downloads),
+        "kconfig_add": [get_config_input(k, downloads) for k in build.kconfig_add],
+        "makevars": normalize(build, build.makevars),
+        "environment": normalize(build, build.environment),
+    }
+    return sha256(json.dumps(inputs, sort_keys=True).encode("utf-8"))
+
+
+class ResultCache:
+    """
+    Stores the results of successful builds in **directory**, one
+    subdirectory per fingerprint, holding the artifacts and the metadata.
+    """
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = Path(directory or get_cache_dir())
+        self.max_size = get_max_size() if max_size is None else max_size
+
+    def restore(self, key, output_dir):
+        """
+        Copies the artifacts of the result stored under **key** into
+        **output_dir**, and returns its metadata; returns `None` if there is
+        no such result.
+        """
+        entry = self.directory / key
+        if not entry.exists():
+            return None
+        with locked(self.directory):
+            try:
+                metadata = json.loads((entry / METADATA).read_text())
+                for name in self.__artifacts__(metadata):
+                    dest = output_dir / name
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy(str(entry / name), str(dest))
+                os.utime(str(entry))
+            except (OSError, ValueError):
+                return None
+        return metadata
+
+    def store(self, key, output_dir):
+        """
+        Stores the artifacts and metadata of the build in **output_dir**
+        under **key**, then evicts the least recently used results if the
+        cache got too big.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if (self.directory / key).exists():
+            return
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=str(self.directory)))
+        try:
+            metadata = json.loads((output_dir / METADATA).read_text())
+            for name in self.__artifacts__(metadata):
+                (tmp / name).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy(str(output_dir / name), str(tmp / name))
+            shutil.copy(str(output_dir / METADATA), str(tmp / METADATA))
+            (tmp / SIZE).write_text(str(get_directory_size(tmp)))
+            with locked(self.directory):
+                os.rename(str(tmp), str(self.directory / key))
+                self.evict(keep=key)
+        except OSError:
+            shutil.rmtree(str(tmp), ignore_errors=True)
+
+    @staticmethod
+    def __artifacts__(metadata):
+        for target, names in metadata["results"]["artifacts"].items():
+            if target == "log":
+                # logs are always from the current build
+                continue
+            yield from names
+
+    @staticmethod
+    def get_size(entry):
+        try:
+            return int((entry / SIZE).read_text())
+        except (OSError, ValueError):
+            # stored by an older version
+            return get_directory_size(entry)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used results until the cache fits in its
+        size limit. Must be called with the cache directory locked.
+        """
+        entries = []
+        total = 0
+        for entry in self.directory.iterdir():
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            size = self.get_size(entry)
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+        if total <= self.max_size:
+            return
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size * EVICTION_TARGET:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(str(entry), ignore_errors=True)
+            total -= size
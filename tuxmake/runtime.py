@@ -2,22 +2,30 @@ import os
 import re
 import json
 import shlex
+import shutil
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime
 from functools import lru_cache
 from pathlib import Path
-from typing import Callable, Optional, TextIO, Union
+from typing import Any, Callable, Optional, TextIO, Union
 
 
 from tuxmake import cache
+from tuxmake import trash
+from tuxmake.agent import AgentClient, AgentError
+from tuxmake.engine import EngineClient, EngineError, LineDecoder
 from tuxmake.logging import debug, warning
 from tuxmake.config import ConfigurableObject, split, splitmap, splitlistmap
 from tuxmake.exceptions import RuntimePreparationFailed
 from tuxmake.exceptions import ImageRequired
 from tuxmake.exceptions import InvalidRuntimeError
 from tuxmake.exceptions import RuntimeNotFoundError
+from tuxmake.exceptions import UnsupportedOverlayBackend
+from tuxmake.jobs import get_cgroup
+from tuxmake.output import create_tmpfs_dir, parse_size, release_tmpfs_dir
 from tuxmake.toolchain import Toolchain
 from tuxmake.arch import native_arch
 from tuxmake.utils import quote_command_line
@@ -26,6 +34,43 @@ from tuxmake.utils import retry
 DEFAULT_RUNTIME = "null"
 DEFAULT_CONTAINER_REGISTRY = "docker.io"
 
+# host settings that control whether unprivileged user namespaces can be
+# created, which is what running commands offline depends on.
+USERNS_SYSCTLS = [
+    "kernel/unprivileged_userns_clone",
+    "kernel/apparmor_restrict_unprivileged_userns",
+    "user/max_user_namespaces",
+]
+
+
+def read_sysctl(name):
+    try:
+        return (Path("/proc/sys") / name).read_text().strip()
+    except OSError:
+        return "-"
+
+
+def get_command_version(command):
+    """
+    Returns the output of `command --version`. This is cached, and only
+    recomputed when the binary that **command** resolves to changes. Raises
+    `RuntimeNotFoundError` if **command** is not installed.
+    """
+    binary = shutil.which(command)
+    if not binary:
+        raise RuntimeNotFoundError(command)
+    st = os.stat(binary)
+    key = ["command-version", binary, str(st.st_mtime_ns), str(st.st_size)]
+    version = cache.get(key)
+    if version is None:
+        result = subprocess.run(
+            [binary, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        version = result.stdout.decode("utf-8").strip()
+        if result.returncode == 0:
+            cache.set(key, version)
+    return version
+
 
 class Terminated(Exception):
     """
@@ -110,6 +155,10 @@ class Runtime(ConfigurableObject):
     def __init__(self) -> None:
         super().__init__(self.name)
         self.__offline_available__ = None
+        self.__offline_session__ = None
+        # commands can be run from several threads at the same time (e.g. by
+        # the preparation pipeline), but only one session must be started.
+        self.__offline_session_lock__ = threading.Lock()
         self.__image__ = None
         self.__user__ = None
         self.__group__ = None
@@ -165,26 +214,122 @@ class Runtime(ConfigurableObject):
     @property
     def offline_available(self):
         if self.__offline_available__ is None:
-            prefix = self.get_command_prefix(False)
-            go_offline = str(self.get_go_offline_command())
-            try:
-                subprocess.check_output(
-                    [*prefix, go_offline, "true"], stderr=subprocess.STDOUT
-                )
-                self.__offline_available__ = True
-            except subprocess.CalledProcessError as exc:
-                error = exc.output.decode("utf-8").strip()
+            key = self.get_offline_probe_cache_key()
+            cached = key and cache.get(key)
+            if cached:
+                available, error = cached
+            else:
+                available, error = self.probe_offline()
+                if key:
+                    cache.set(key, (available, error))
+            if not available:
                 warning(f"Support for running offline not available ({error})")
-                self.__offline_available__ = False
+            self.__offline_available__ = available
         return self.__offline_available__
 
+    def probe_offline(self):
+        prefix = self.get_command_prefix(False)
+        go_offline = str(self.get_go_offline_command())
+        try:
+            subprocess.check_output(
+                [*prefix, go_offline, "true"], stderr=subprocess.STDOUT
+            )
+            return True, None
+        except subprocess.CalledProcessError as exc:
+            return False, exc.output.decode("utf-8").strip()
+
+    def get_offline_probe_cache_key(self):
+        """
+        Returns the key under which the result of the offline support probe is
+        cached, or `None` if it should not be cached. The result depends on the
+        image (for the tools it contains) and on the host kernel and its user
+        namespace settings, so all of those are part of the key.
+        """
+        image_id = self.get_image_id()
+        if not image_id:
+            return None
+        return [
+            "offline-available",
+            self.name,
+            image_id,
+            os.uname().release,
+            *[read_sysctl(s) for s in USERNS_SYSCTLS],
+        ]
+
     def get_command_line(self, cmd, interactive, offline=True):
         prefix = self.get_command_prefix(interactive)
+        return [*prefix, *self.wrap_offline(cmd, offline)]
+
+    def wrap_offline(self, cmd, offline):
         if offline and self.offline_available:
-            go_offline = [str(self.get_go_offline_command())]
+            go_offline = self.get_go_offline_prefix()
         else:
             go_offline = []
-        return [*prefix, *go_offline, *cmd]
+        return [*go_offline, *cmd]
+
+    def get_go_offline_prefix(self):
+        if self.offline_session_enabled:
+            with self.__offline_session_lock__:
+                if self.__offline_session__ is None:
+                    self.__offline_session__ = self.start_offline_session()
+                session = self.__offline_session__
+            if session:
+                pid, _ = session
+                return [
+                    "nsenter",
+                    f"--target={pid}",
+                    "--user",
+                    "--net",
+                    "--preserve-credentials",
+                    "--",
+                ]
+        return [str(self.get_go_offline_command())]
+
+    @property
+    def offline_session_enabled(self):
+        return os.getenv("TUXMAKE_OFFLINE_SESSION", "false").lower() == "true"
+
+    def start_offline_session(self):
+        """
+        Creates a network namespace that is reused by all the commands that
+        are run offline, instead of having each of them create its own.
+        Returns a `(pid, state_dir)` tuple, or `False` if the session could
+        not be started, in which case commands fall back to going offline
+        individually.
+        """
+        prefix = self.get_command_prefix(False)
+        session = str(self.get_offline_session_command())
+        env = dict(**os.environ)
+        env.update(self.environment)
+        result = subprocess.run(
+            [*prefix, session, "start"],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            error = result.stderr.decode("utf-8").strip()
+            warning(f"Could not start offline session ({error})")
+            return False
+        pid, state_dir = result.stdout.decode("utf-8").split()
+        debug(f"Offline session: pid={pid}, state_dir={state_dir}")
+        return (pid, state_dir)
+
+    def stop_offline_session(self):
+        with self.__offline_session_lock__:
+            session = self.__offline_session__
+            self.__offline_session__ = None
+        if not session:
+            return
+        _, state_dir = session
+        prefix = self.get_command_prefix(False)
+        session = str(self.get_offline_session_command())
+        subprocess.call(
+            [*prefix, session, "stop", state_dir],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
 
     def get_command_prefix(self, interactive):
         return []
@@ -206,26 +351,41 @@ class Runtime(ConfigurableObject):
     def prepare(self):
         """
         Initializes the runtime object. Must be called before actually running
-        any commands with `run_cmd`.
+        any commands with `run_cmd`. This is the same as calling `setup()` and
+        then `start()`.
+        """
+        self.setup()
+        self.start()
+
+    def setup(self):
+        """
+        First half of `prepare()`: checks that the runtime is installed, opens
+        the log files, and makes the image available, without starting
+        anything yet. After this, `get_image_id()` identifies the image.
         """
         name = str(self)
-        try:
-            if name != "null":
-                # Call runtime --version to see if runtime is installed
-                runtime = name.split("-")[0] if "local" in name else name
-                cmd = [runtime, "--version"]
-                subprocess.run(cmd, stdout=subprocess.DEVNULL)
-        except FileNotFoundError:
-            raise RuntimeNotFoundError(name)
+        if name != "null":
+            # check that the runtime is installed
+            runtime = name.split("-")[0] if "local" in name else name
+            get_command_version(runtime)
 
         if self.output_dir:
             self.output_dir.mkdir(parents=True, exist_ok=True)
 
         self.init_logging()
 
+    def start(self):
+        """
+        Second half of `prepare()`: starts what is needed to run commands,
+        e.g. a container.
+        """
+
     def get_go_offline_command(self):
         return self.bindir / "tuxmake-run-offline"
 
+    def get_offline_session_command(self):
+        return self.bindir / "tuxmake-offline-session"
+
     def get_check_environment_command(self):
         return self.bindir / "tuxmake-check-environment"
 
@@ -242,6 +402,14 @@ class Runtime(ConfigurableObject):
         """
         return {}
 
+    def get_image_id(self):
+        """
+        Returns an identifier of the exact image that commands are run on, or
+        `None` if that can't be determined (e.g. for the null runtime). Can
+        be used to cache information about the build environment.
+        """
+        return None
+
     def init_logging(self):
         if self.output_dir:
             log = self.output_dir / f"{self.basename}.log"
@@ -268,11 +436,30 @@ class Runtime(ConfigurableObject):
             ts = "{:02}:{:02}:{:02}".format(int(hours), int(minutes), int(seconds))
             self.debug_logfile.write(f"{ts} {item}".encode("utf-8"))
 
+    def get_cgroup(self):
+        """
+        Returns the directory of the (cgroup v2) cgroup that commands run in,
+        or `None` if not available. For the null runtime, that's the cgroup
+        of tuxmake itself.
+        """
+        return get_cgroup()
+
+    def pause(self):
+        """
+        Suspends everything running in the runtime, until `resume()` is
+        called. Returns `False` if that is not supported.
+        """
+        return False
+
+    def resume(self):
+        pass
+
     def cleanup(self):
         """
         Cleans up and returns resources used during execution. You must call
         this methods after you are done with the runtime object.
         """
+        self.stop_offline_session()
         self.log_file.close()
         self.debug_logfile.close()
 
@@ -450,8 +637,14 @@ class ContainerRuntime(Runtime):
             f"tuxmake/{image.name}": image for image in self.toolchain_images
         }
         self.container_id = None
+        self.agent = None
+        # the engine client is shared by commands run from several threads;
+        # probe for it only once.
+        self.__engine_lock__ = threading.Lock()
 
     __volumes__ = None
+    __image_info__ = None
+    __engine__ = None
 
     @property
     def volumes(self):
@@ -476,32 +669,98 @@ class ContainerRuntime(Runtime):
         else:
             return False
 
-    def prepare(self):
-        super().prepare()
+    def setup(self):
+        super().setup()
         try:
             self.prepare_image()
+        except subprocess.CalledProcessError:
+            raise self.preparation_failed()
+
+    def start(self):
+        try:
             self.start_container()
         except subprocess.CalledProcessError:
-            raise RuntimePreparationFailed(
-                self.prepare_failed_msg.format(image=self.get_image())
-            )
+            raise self.preparation_failed()
+
+    def preparation_failed(self):
+        return RuntimePreparationFailed(
+            self.prepare_failed_msg.format(image=self.get_image())
+        )
+
+    @property
+    def engine(self):
+        """
+        Client for the API of the container engine, or `False` if using the
+        API is not enabled (see `TUXMAKE_ENGINE_API`) or the API can't be
+        reached. In that case the engine CLI is used.
+        """
+        with self.__engine_lock__:
+            if self.__engine__ is None:
+                engine = False
+                if os.getenv("TUXMAKE_ENGINE_API", "false").lower() == "true":
+                    client = EngineClient.connect(self.command)
+                    if client:
+                        debug(f"Using {self.command} API at {client.socket_path}")
+                        engine = client
+                    else:
+                        debug(f"{self.command} API not available, using the CLI")
+                self.__engine__ = engine
+        return self.__engine__
 
     def prepare_image(self):
-        pull = [self.command, "pull", self.get_image()]
-        last_pull = cache.get(pull)
-        now = time.time()
-        if last_pull:
-            a_day_ago = now - (24 * 60 * 60)
-            if last_pull > a_day_ago:
-                return
+        image = self.get_image()
+        if not self.pulled_recently(image):
+            self.pull_image(image)
+
+    def pulled_recently(self, image):
+        """
+        Returns whether **image** has been pulled by tuxmake in the last 24
+        hours.
+        """
+        last_pull = cache.get([self.command, "pull", image])
+        a_day_ago = time.time() - (24 * 60 * 60)
+        return bool(last_pull) and last_pull > a_day_ago
+
+    def pull_image(self, image, quiet=False):
+        """
+        Pulls **image**, and records when that happened so that builds in the
+        next 24 hours don't try pulling it again.
+        """
+        pull = [self.command, "pull", image]
 
         @retry(subprocess.CalledProcessError)
         def do_pull():
-            subprocess.check_call(pull)
+            if self.engine:
+                try:
+                    self.engine.pull(image)
+                    return
+                except EngineError as exc:
+                    debug(f"Pulling via the API failed ({exc}), using the CLI")
+            if quiet:
+                subprocess.check_call(
+                    [self.command, "pull", "--quiet", image], stdout=subprocess.DEVNULL
+                )
+            else:
+                subprocess.check_call(pull)
 
         do_pull()
         cache.set(pull, time.time())
 
+    def get_image_size(self, image):
+        """
+        Returns the size of **image** in bytes.
+        """
+        if self.engine:
+            try:
+                return self.engine.inspect_image(image)["Size"]
+            except (EngineError, KeyError) as exc:
+                debug(f"Inspecting image via the API failed ({exc})")
+        return int(
+            subprocess.check_output(
+                [self.command, "image", "inspect", "--format={{.Size}}", image]
+            )
+        )
+
     def start_container(self):
         env = (f"--env={k}={v}" for k, v in self.environment.items())
         caps = (f"--cap-add={cap}" for cap in self.caps)
@@ -509,6 +768,7 @@ class ContainerRuntime(Runtime):
         user_opts = self.get_user_opts() if self.allow_user_opts else []
         network = [f"--network={self.network}"] if self.network else []
         extra_opts = self.__get_extra_opts__()
+        agent_opts, main = self.get_main_command()
         cmd = [
             self.command,
             "run",
@@ -521,16 +781,90 @@ class ContainerRuntime(Runtime):
             *user_opts,
             *network,
             *self.get_volume_opts(),
+            *agent_opts,
             f"--workdir={self.source_dir}",
             *self.get_logging_opts(),
             *extra_opts,
             self.get_image(),
-            "sleep",
-            "1d",
+            *main,
         ]
         debug(f"Starting container: {cmd}")
         self.container_id = self.spawn_container(cmd)
         debug(f"Container ID: {self.container_id}")
+        if self.agent and not self.agent.wait():
+            warning("Command agent did not start; using exec for each command")
+            self.agent.cleanup()
+            self.agent = None
+
+    def get_main_command(self):
+        """
+        Returns the extra options for starting the container, and the command
+        for its main process. By default that is just something that will
+        keep the container running; if `TUXMAKE_CONTAINER_AGENT` is enabled,
+        it's the command agent (falling back to the default if the agent
+        fails to run in the container).
+        """
+        keepalive = ["sleep", "1d"]
+        if os.getenv("TUXMAKE_CONTAINER_AGENT", "false").lower() != "true":
+            return [], keepalive
+        self.agent = AgentClient.create()
+        directory = self.agent.directory
+        agent = str(self.bindir / "tuxmake-agent")
+        return (
+            [self.volume_opt(directory, directory)],
+            [
+                "sh",
+                "-c",
+                '"$0" "$1" || exec "$2" "$3"',
+                agent,
+                str(self.agent.socket_path),
+                *keepalive,
+            ],
+        )
+
+    def get_image_id(self):
+        try:
+            return self.inspect_image()["Id"]
+        except (subprocess.CalledProcessError, EngineError, KeyError):
+            return None
+
+    def inspect_image(self):
+        """
+        Returns a dictionary with the `Id`, `RepoDigests` and `RepoTags` of
+        the image. The image is inspected once per build, through the engine
+        API if available (see `TUXMAKE_ENGINE_API`); the tag may have been
+        pulled or rebuilt outside of tuxmake, so the result is not kept
+        across builds.
+        """
+        if self.__image_info__ is None:
+            self.__image_info__ = self.inspect_image_uncached(self.get_image())
+        return self.__image_info__
+
+    def inspect_image_uncached(self, image):
+        if self.engine:
+            try:
+                info = self.engine.inspect_image(image)
+                return {
+                    "Id": info["Id"],
+                    "RepoDigests": info["RepoDigests"] or [],
+                    "RepoTags": info["RepoTags"] or [],
+                }
+            except (EngineError, KeyError) as exc:
+                debug(f"Inspecting image via the API failed ({exc})")
+        output = subprocess.check_output(
+            [
+                self.command,
+                "image",
+                "inspect",
+                '--format={"Id": {{json .Id}}, "RepoDigests": {{json .RepoDigests}}, "RepoTags": {{json .RepoTags}}}',
+                image,
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+        info = json.loads(output)
+        info["RepoDigests"] = info["RepoDigests"] or []
+        info["RepoTags"] = info["RepoTags"] or []
+        return info
 
     def spawn_container(self, cmd):
         return subprocess.check_output(cmd).strip().decode("utf-8")
@@ -542,12 +876,145 @@ class ContainerRuntime(Runtime):
             interactive_opts = []
         return [self.command, "exec", *interactive_opts, self.container_id]
 
+    def run_cmd(
+        self,
+        cmd,
+        interactive: bool = False,
+        offline: bool = True,
+        expect_failure: bool = False,
+        stdout: Optional[TextIO] = None,
+        echo: bool = True,
+        logger: Optional[Callable] = None,
+    ):
+        final_cmd = self.wrap_offline(cmd, offline)
+        start = None if interactive else self.get_streamed_command(final_cmd)
+        if not start:
+            return super().run_cmd(
+                cmd,
+                interactive=interactive,
+                offline=offline,
+                expect_failure=expect_failure,
+                stdout=stdout,
+                echo=echo,
+                logger=logger,
+            )
+
+        if echo:
+            self.log(quote_command_line(cmd))
+
+        output: Optional[Callable[[bytes], Any]]
+        if stdout is None:
+            decoder = LineDecoder(logger or self.log)
+            output = decoder.feed
+        elif stdout == subprocess.DEVNULL:
+            decoder = None
+            output = None
+        else:
+            decoder = None
+            fd = stdout if isinstance(stdout, int) else stdout.fileno()
+            sink = os.fdopen(os.dup(fd), "wb", buffering=0)
+            output = sink.write
+
+        self.start_time = datetime.now()
+        try:
+            returncode = start(lambda _, data: output and output(data))
+        except (AgentError, EngineError) as exc:
+            self.log(f"E: {exc}")
+            returncode = None
+        finally:
+            if decoder:
+                decoder.close()
+            elif output:
+                sink.close()
+
+        if expect_failure:
+            return returncode != 0
+        else:
+            return returncode == 0
+
+    def get_streamed_command(self, cmd):
+        """
+        Prepares to run **cmd** without the engine CLI, i.e. via the agent
+        or via the engine API. Returns a function that takes an output
+        callback, runs the command and returns its exit code; or `None` if
+        the CLI has to be used.
+        """
+        if self.agent:
+            try:
+                sock = self.agent.connect()
+                debug(f"Command (agent): {cmd}")
+                return lambda output: self.agent.run(sock, cmd, output)
+            except AgentError as exc:
+                debug(f"{exc}; not using the agent anymore")
+                self.agent = None
+        if self.engine:
+            try:
+                exec_id = self.engine.create_exec(self.container_id, cmd)
+                debug(f"Command (exec {exec_id}): {cmd}")
+                return lambda output: self.engine.start_exec(exec_id, output)
+            except EngineError as exc:
+                debug(f"Running command via the API failed ({exc}), using the CLI")
+        return None
+
+    def get_cgroup(self):
+        if not self.container_id:
+            return None
+        try:
+            pid = subprocess.check_output(
+                [self.command, "inspect", "--format={{.State.Pid}}", self.container_id],
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+            ).strip()
+        except (subprocess.CalledProcessError, OSError):
+            return None
+        if not pid.isdigit() or pid == "0":
+            # not running
+            return None
+        return get_cgroup(pid)
+
+    def pause(self):
+        if not self.container_id:
+            return False
+        return self.__pause__("pause")
+
+    def resume(self):
+        self.__pause__("unpause")
+
+    def __pause__(self, cmd):
+        return (
+            subprocess.call(
+                [self.command, cmd, self.container_id],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            == 0
+        )
+
     def cleanup(self):
+        if self.overlay_dir:
+            release_tmpfs_dir(self.overlay_dir)
+            trash.discard(self.overlay_dir)
+            self.overlay_dir = None
         if not self.container_id:
             return
-        subprocess.call(
-            [self.command, "stop", self.container_id], stdout=subprocess.DEVNULL
-        )
+        stopped = False
+        if self.engine:
+            try:
+                self.engine.stop(self.container_id)
+                stopped = True
+            except EngineError as exc:
+                debug(f"Stopping container via the API failed ({exc})")
+            self.engine.close()
+        if not stopped:
+            subprocess.call(
+                [self.command, "stop", self.container_id], stdout=subprocess.DEVNULL
+            )
+        # anything running in the container, including an offline session,
+        # is gone with it
+        self.__offline_session__ = None
+        if self.agent:
+            self.agent.cleanup()
+            self.agent = None
         super().cleanup()
 
     def __get_extra_opts__(self):
@@ -570,27 +1037,21 @@ class ContainerRuntime(Runtime):
 
         return volumes
 
+    def get_engine_version(self):
+        if self.engine:
+            try:
+                return self.version_format.format(**self.engine.version())
+            except (EngineError, KeyError) as exc:
+                debug(f"Getting version via the API failed ({exc})")
+        return get_command_version(self.command)
+
     def get_metadata(self):
-        version = (
-            subprocess.check_output([self.command, "--version"]).decode("utf-8").strip()
-        )
         image_name = self.get_image()
-        image_info = (
-            subprocess.check_output(
-                [
-                    self.command,
-                    "image",
-                    "inspect",
-                    "--format={{json .RepoDigests}}||{{json .RepoTags}}",
-                    image_name,
-                ]
-            )
-            .decode("utf-8")
-            .strip()
-        )
-        digests, tags = map(json.loads, image_info.split("||"))
+        version = self.get_engine_version()
+        image = self.inspect_image()
+        digests = image["RepoDigests"]
         image_tag = None
-        for tag in tags:
+        for tag in image["RepoTags"]:
             if tag.split(":")[-1] != "latest":
                 image_tag = tag
                 break
@@ -602,16 +1063,40 @@ class ContainerRuntime(Runtime):
             "image_tag": image_tag,
         }
 
+    overlay_dir = None
+
     @property
     def skip_overlayfs(self):
         return os.getenv("SKIP_OVERLAYFS", "false").lower() == "true"
 
+    @property
+    def overlay_backend(self):
+        backend = os.getenv("TUXMAKE_OVERLAY_BACKEND", "disk").lower()
+        if backend not in ("disk", "tmpfs", "ro"):
+            raise UnsupportedOverlayBackend(backend)
+        return backend
+
+    def create_tmpfs_overlay_dir(self):
+        """
+        Creates a directory in tmpfs for the upper and work directories of the
+        source tree overlay, and returns it. Returns `None` if there is not
+        enough memory for `$TUXMAKE_OVERLAY_SIZE` (default: 1G) in tmpfs.
+        """
+        size = parse_size(os.getenv("TUXMAKE_OVERLAY_SIZE", "1G"))
+        overlay_dir = create_tmpfs_dir("tuxmake-overlay-", size)
+        if not overlay_dir:
+            warning("Not enough memory for a tmpfs overlay; using disk instead")
+            return None
+        (overlay_dir / "uppperdir").mkdir()
+        (overlay_dir / "workdir").mkdir()
+        return overlay_dir
+
 
 class DockerRuntime(ContainerRuntime):
     name = "docker"
     command = "docker"
     extra_opts_env_variable = "TUXMAKE_DOCKER_RUN"
-    overlay_dir = None
+    version_format = "Docker version {Version}, build {GitCommit}"
 
     def get_user_opts(self):
         if self.__user__:
@@ -642,13 +1127,19 @@ class DockerRuntime(ContainerRuntime):
         return []
 
     def volume_opt(self, source, target, overlay=False, ro=False, device=False):
+        if overlay and not self.skip_overlayfs and self.overlay_backend == "ro":
+            overlay = False
+            ro = True
         if overlay and self.output_dir and not self.skip_overlayfs:
-            self.overlay_dir = self.output_dir / "overlay"
-            self.overlay_dir.mkdir()
+            if self.overlay_backend == "tmpfs":
+                self.overlay_dir = self.create_tmpfs_overlay_dir()
+            if not self.overlay_dir:
+                self.overlay_dir = self.output_dir / "overlay"
+                self.overlay_dir.mkdir()
+                (self.overlay_dir / "uppperdir").mkdir()
+                (self.overlay_dir / "workdir").mkdir()
             upperdir = self.overlay_dir / "uppperdir"
-            upperdir.mkdir(parents=True)
             workdir = self.overlay_dir / "workdir"
-            workdir.mkdir(parents=True)
             return (",").join(
                 [
                     "--mount=type=volume",
@@ -664,16 +1155,12 @@ class DockerRuntime(ContainerRuntime):
             mode = "ro" if ro else "rw"
             return f"--{option}={source}:{target}:{mode}"
 
-    def cleanup(self):
-        if self.overlay_dir:
-            subprocess.check_call(["rm", "-rf", str(self.overlay_dir)])
-        super().cleanup()
-
 
 class PodmanRuntime(ContainerRuntime):
     name = "podman"
     command = "podman"
     extra_opts_env_variable = "TUXMAKE_PODMAN_RUN"
+    version_format = "podman version {Version}"
 
     def get_user_opts(self):
         return ["--userns=keep-id"]
@@ -685,8 +1172,17 @@ class PodmanRuntime(ContainerRuntime):
         option = "device" if device else "volume"
         mode = "ro" if ro else "rw"
         v = f"--{option}={source}:{target}"
+        if overlay and not self.skip_overlayfs and self.overlay_backend == "ro":
+            overlay = False
+            mode = "ro"
         if overlay and not self.skip_overlayfs:
             v += ":O"
+            if self.overlay_backend == "tmpfs":
+                self.overlay_dir = self.create_tmpfs_overlay_dir()
+            if self.overlay_dir:
+                upperdir = self.overlay_dir / "uppperdir"
+                workdir = self.overlay_dir / "workdir"
+                v += f",upperdir={upperdir},workdir={workdir}"
         else:
             v += f":{mode}"
             if not device:
@@ -699,11 +1195,8 @@ class LocalMixin:
     prepare_failed_msg = "image {image} not found locally"
 
     def prepare_image(self):
-        subprocess.check_call(
-            [self.command, "image", "inspect", self.get_image()],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        # checks that the image exists, and keeps the results for later
+        self.inspect_image()
 
 
 class DockerLocalRuntime(LocalMixin, DockerRuntime):
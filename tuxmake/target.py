@@ -18,6 +18,10 @@ def supported_targets():
     return Target.supported()
 
 
+def is_url(s):
+    return s.startswith("http://") or s.startswith("https://")
+
+
 class Command(list):
     interactive = False
 
@@ -119,6 +123,12 @@ class Target(ConfigurableObject):
     def prepare(self):
         pass
 
+    def finish(self):
+        """
+        Called after the target is built successfully.
+        """
+        pass
+
     def find_artifacts(self, build_dir: Path) -> List[Tuple[str, Path]]:
         results = []
         for dest, src in self.artifacts.items():
@@ -142,6 +152,19 @@ class Target(ConfigurableObject):
 class Config(Target):
     def __init_config__(self):
         super().__init_config__()
+        self.downloads = {}
+        self.cache_key = None
+
+    def prefetch(self):
+        """
+        Downloads the remote config and fragments in advance, so that
+        `prepare()` does not have to.
+        """
+        if (self.build.build_dir / ".config").exists():
+            return
+        for url in [self.build.kconfig, *self.build.kconfig_add]:
+            if is_url(url) and url not in self.downloads:
+                self.downloads[url] = self.download(url)
 
     def prepare(self):
         olddefconfig = False
@@ -150,6 +173,8 @@ class Config(Target):
         conf = self.build.kconfig
         if config.exists():
             return
+        if self.restore_from_cache(config):
+            return
         if (
             self.handle_url(config, conf)
             or self.handle_local_file(config, conf)
@@ -199,19 +224,50 @@ class Config(Target):
         if olddefconfig:
             self.add_command(["{make}", "olddefconfig"])
 
+    def restore_from_cache(self, config):
+        cache = self.build.kconfig_cache
+        if not cache:
+            return False
+        self.prefetch()
+        key = cache.get_key(self.build, self.downloads)
+        if not key:
+            return False
+        hit = cache.restore(key, config)
+        self.build.metadata["kconfig_cache"] = {
+            "cache": "hit" if hit else "miss",
+            "key": key,
+        }
+        if hit:
+            self.build.log(f"# {config} restored from the kconfig cache ({key})")
+        else:
+            self.cache_key = key
+        return hit
+
+    def finish(self):
+        if self.cache_key:
+            self.build.kconfig_cache.store(
+                self.cache_key, self.build.build_dir / ".config"
+            )
+
     def handle_url(self, config, url):
-        if not url.startswith("http://") and not url.startswith("https://"):
+        if not is_url(url):
             return False
 
+        text = self.downloads.pop(url, None)
+        if text is None:
+            text = self.download(url)
+        with config.open("w") as f:
+            f.write(text)
+        return True
+
+    def download(self, url):
         header = {"User-Agent": "tuxmake/{}".format(__version__)}
         try:
             req = urllib.request.Request(url, headers=header)
             download = urllib.request.urlopen(req)
         except urllib.error.URLError as error:
             raise InvalidKConfig(f"{url} - {error}")
-        with config.open("w") as f:
-            f.write(download.read().decode("utf-8"))
-        return True
+        return download.read().decode("utf-8")
 
     def handle_local_file(self, config, filename):
         path = Path(filename)
@@ -0,0 +1,107 @@
+"""
+Aggregation of the compiler invocation timings recorded by the `timing`
+wrapper (see `tuxmake/runtime/bin/tuxmake-timing`) into a report of the
+slowest files and directories.
+"""
+
+import os
+from collections import defaultdict
+from pathlib import Path
+
+# number of entries in the lists of slowest files and directories.
+TOP = 20
+
+
+class Invocation:
+    def __init__(self, wall_time, cpu_time, peak_rss, status, target):
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_rss = peak_rss
+        self.status = status
+        self.target = target
+
+    @property
+    def in_build_dir(self):
+        """
+        Whether the invocation built a file in the build directory, as
+        opposed to e.g. a compiler feature test building to `/dev/null`.
+        """
+        return self.target != "-" and not os.path.isabs(self.target)
+
+
+def parse(path, build_dir=None):
+    """
+    Reads the timing records in **path**; returns a list of `Invocation`
+    objects. Targets under **build_dir** are made relative to it. Malformed
+    records (e.g. one being written when the build was interrupted) are
+    skipped.
+    """
+    prefix = build_dir and os.path.join(str(build_dir), "")
+    invocations = []
+    try:
+        lines = Path(path).read_text().splitlines()
+    except OSError:
+        return invocations
+    for line in lines:
+        fields = line.split("\t")
+        if len(fields) != 5:
+            continue
+        if prefix and fields[4].startswith(prefix):
+            fields[4] = os.path.relpath(fields[4], prefix)
+        try:
+            invocations.append(
+                Invocation(
+                    float(fields[0]),
+                    float(fields[1]),
+                    int(fields[2]) * 1024,
+                    int(fields[3]),
+                    fields[4],
+                )
+            )
+        except ValueError:
+            continue
+    return invocations
+
+
+def __aggregate__(invocations, key):
+    totals = defaultdict(lambda: {"wall_time": 0.0, "cpu_time": 0.0, "invocations": 0})
+    peak_rss = defaultdict(int)
+    for invocation in invocations:
+        k = key(invocation)
+        totals[k]["wall_time"] += invocation.wall_time
+        totals[k]["cpu_time"] += invocation.cpu_time
+        totals[k]["invocations"] += 1
+        peak_rss[k] = max(peak_rss[k], invocation.peak_rss)
+    for k, total in totals.items():
+        total["wall_time"] = round(total["wall_time"], 3)
+        total["cpu_time"] = round(total["cpu_time"], 3)
+        total["peak_rss"] = peak_rss[k]
+    return sorted(totals.items(), key=lambda item: -item[1]["wall_time"])
+
+
+def summarize(path, build_dir=None, duration=None, top=TOP):
+    """
+    Summarizes the timing records in **path**, for a build in **build_dir**.
+    **duration** is the duration of the build, in seconds, used to calculate
+    the average number of concurrent compiler invocations. Returns `None` if
+    there are no records.
+    """
+    invocations = parse(path, build_dir)
+    if not invocations:
+        return None
+    wall_time = sum(i.wall_time for i in invocations)
+    built = [i for i in invocations if i.in_build_dir]
+    files = __aggregate__(built, lambda i: i.target)
+    directories = __aggregate__(built, lambda i: os.path.dirname(i.target) or ".")
+    return {
+        "invocations": len(invocations),
+        "failed": len([i for i in invocations if i.status != 0]),
+        "wall_time": round(wall_time, 3),
+        "cpu_time": round(sum(i.cpu_time for i in invocations), 3),
+        "peak_rss": max(i.peak_rss for i in invocations),
+        "concurrency": round(wall_time / duration, 2) if duration else None,
+        "slowest_files": [{"file": name, **totals} for name, totals in files[:top]],
+        "slowest_directories": [
+            {"directory": name, **totals} for name, totals in directories[:top]
+        ],
+    }
@@ -0,0 +1,170 @@
+"""
+Deferred removal of directories.
+
+Removing a large build tree can take a long time, so instead of removing
+them right away, directories are atomically renamed into a trash directory
+in the same filesystem, and actually removed by a detached background
+process running with low CPU and I/O priority.
+
+Each reaper only removes the directory it was started for. A directory is
+locked (with `flock`) from before it is moved into the trash until its
+reaper finishes, so anything in the trash that is not locked was left
+behind, e.g. because its reaper was killed. After removing its own
+directory, a reaper removes those leftovers as well; a lock on the trash
+directory itself makes sure that only one reaper at a time does that.
+
+Set `TUXMAKE_ASYNC_CLEANUP=false` to remove directories synchronously
+instead.
+"""
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+from tuxmake import xdg
+
+
+def enabled():
+    return os.getenv("TUXMAKE_ASYNC_CLEANUP", "true").lower() != "false"
+
+
+def get_trash_dir():
+    return xdg.cache_dir() / "trash"
+
+
+def lock(path):
+    """
+    Locks **path**, and returns the file descriptor holding the lock, or
+    `None` if **path** is already locked (or doesn't exist). The lock is held
+    until the file descriptor is closed in all processes that have it.
+    """
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def get_priority_prefix():
+    cmd = []
+    if shutil.which("ionice"):
+        cmd += ["ionice", "-c", "3"]
+    if shutil.which("nice"):
+        cmd += ["nice", "-n", "19"]
+    return cmd
+
+
+def get_reaper_command(path):
+    return get_priority_prefix() + [sys.executable, "-m", "tuxmake.trash", str(path)]
+
+
+def spawn_reaper(path, fd):
+    """
+    Starts a reaper for **path**. The reaper inherits **fd**, which holds the
+    lock on **path**, and so keeps **path** locked until it is done.
+    """
+    subprocess.Popen(
+        get_reaper_command(path),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        pass_fds=(fd,),
+    )
+
+
+def move_to_trash(path):
+    """
+    Renames **path** into the trash directory, and returns its new path. If
+    the trash directory is on a different filesystem, **path** is renamed to
+    a hidden name in its own parent directory instead. Raises `OSError` if
+    neither is possible.
+    """
+    unique = uuid.uuid4().hex
+    trash = get_trash_dir()
+    try:
+        trash.mkdir(parents=True, exist_ok=True)
+        new = trash / f"{path.name}-{unique}"
+        os.rename(path, new)
+    except OSError:
+        new = path.parent / f".{path.name}.trash-{unique}"
+        os.rename(path, new)
+    return new
+
+
+def discard(path):
+    """
+    Removes the directory **path**. By the time this function returns,
+    **path** no longer exists, but the removal of its contents might still
+    be in progress in the background. Nothing is done if **path** is locked,
+    i.e. if it is still in use, or already being removed.
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    if enabled():
+        fd = lock(path)
+        if fd is None:
+            return
+        try:
+            trashed = move_to_trash(path)
+        except OSError:
+            pass
+        else:
+            try:
+                spawn_reaper(trashed, fd)
+            except OSError:
+                pass  # will be removed by the next reaper
+            return
+        finally:
+            os.close(fd)
+    subprocess.call(["rm", "-rf", "--", str(path)])
+
+
+def sweep(directory):
+    """
+    Removes everything in **directory** that is not locked. Does nothing if
+    another process is already doing the same.
+    """
+    fd = lock(directory)
+    if fd is None:
+        return
+    try:
+        for entry in sorted(directory.iterdir()):
+            entry_fd = lock(entry)
+            if entry_fd is None:
+                continue
+            try:
+                subprocess.call(["rm", "-rf", "--", str(entry)])
+            finally:
+                os.close(entry_fd)
+    finally:
+        os.close(fd)
+
+
+def reap(path):
+    """
+    Removes **path**, and then any leftovers from previous reapers, if
+    **path** was in the trash directory.
+    """
+    subprocess.call(["rm", "-rf", "--", str(path)])
+    trash = get_trash_dir()
+    if path.parent == trash:
+        sweep(trash)
+
+
+def main():
+    reap(Path(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
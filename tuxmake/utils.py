@@ -3,10 +3,12 @@ import os
 import subprocess
 import shlex
 import shutil
+import tempfile
 import time
 import urllib.request
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
+from tuxmake import git
 
 # Constants for file operations
 KB = 1024
@@ -19,16 +21,30 @@ def quote_command_line(cmd: List[str]) -> str:
     return " ".join([shlex.quote(c) for c in cmd])
 
 
+__git_timestamps__: Dict[Tuple[str, str], str] = {}
+
+
 def get_directory_timestamp(directory):
     if (directory / ".git").exists():
-        try:
-            return subprocess.check_output(
-                ["git", "log", "--date=unix", "--format=%cd", "--max-count=1"],
-                cwd=str(directory),
-                encoding="utf-8",
-            ).strip()
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(e)
+        gitdir = git.find_git_dir(directory)
+        head = gitdir and git.resolve_ref(gitdir)
+        key = (str(directory), head)
+        if head and key in __git_timestamps__:
+            return __git_timestamps__[key]
+        timestamp = head and git.get_commit_timestamp(gitdir, head)
+        if not timestamp:
+            try:
+                timestamp = subprocess.check_output(
+                    ["git", "log", "--date=unix", "--format=%cd", "--max-count=1"],
+                    cwd=str(directory),
+                    encoding="utf-8",
+                ).strip()
+            except (subprocess.CalledProcessError, FileNotFoundError) as e:
+                print(e)
+        if timestamp:
+            if head:
+                __git_timestamps__[key] = timestamp
+            return timestamp
 
     s = os.stat(directory)
     return str(int(s.st_mtime))
@@ -97,6 +113,24 @@ def download_file_with_progress(url, output_path, logger=None):
             log(f"Download complete: {total_size // MB}MB")
 
 
+def download_file(url, dest):
+    """
+    Downloads **url** into **dest**. The data is written to a temporary file
+    next to **dest** first, so **dest** is never seen incomplete.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{dest.name}.", dir=str(dest.parent))
+    try:
+        req = urllib.request.Request(url, headers={"User-Agent": "tuxmake"})
+        with os.fdopen(fd, "wb") as f, urllib.request.urlopen(req) as response:
+            shutil.copyfileobj(response, f, DOWNLOAD_CHUNK_SIZE)
+        os.replace(tmp, str(dest))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
 def prepare_file_from_source(src, dest_path, logger=None):
     dest_path = Path(dest_path)
 
@@ -1,8 +1,24 @@
+import fcntl
 import os
 import subprocess
+import time
 from pathlib import Path
-from tuxmake.config import ConfigurableObject, split_commands
+from tuxmake import xdg
+from tuxmake.config import ConfigurableObject, split, split_commands
+from tuxmake.exceptions import InvalidJobs
 from tuxmake.exceptions import UnsupportedWrapper
+from tuxmake.output import parse_size
+
+# when the shared cache storage gets bigger than its maximum size, files are
+# removed until it's down to this fraction of the maximum size, so that
+# eviction doesn't need to run after every build.
+EVICTION_TARGET = 0.9
+
+# minimum interval between evictions in the shared cache storage, in seconds.
+# Each eviction walks the whole directory, with it locked.
+EVICTION_INTERVAL = 600
+
+EVICTION_STAMP = ".last-eviction"
 
 
 def expand(k, s):
@@ -12,6 +28,89 @@ def expand(k, s):
     return str(v)
 
 
+def shared_cache_enabled():
+    return os.getenv("TUXMAKE_SHARED_CACHE", "false").lower() == "true"
+
+
+def get_shared_cache_size():
+    return parse_size(os.getenv("TUXMAKE_SHARED_CACHE_SIZE", "10G"))
+
+
+def evict(directory, max_size):
+    """
+    If the total size of the files in **directory** is larger than
+    **max_size**, removes the least recently used ones (by modification time)
+    until it's down to `EVICTION_TARGET` of it. Returns the number of files
+    removed.
+    """
+    directory = Path(directory)
+    with (directory / ".lock").open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        files = []
+        total = 0
+        for root, _, names in os.walk(str(directory)):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= max_size:
+            return 0
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= max_size * EVICTION_TARGET:
+                break
+            if path in (str(directory / ".lock"), str(directory / EVICTION_STAMP)):
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def maybe_evict(directory, max_size, interval=EVICTION_INTERVAL):
+    """
+    Runs `evict`, unless it already ran in the last **interval** seconds.
+    Returns the number of files removed.
+    """
+    stamp = Path(directory) / EVICTION_STAMP
+    try:
+        last = stamp.stat().st_mtime
+    except FileNotFoundError:
+        last = 0
+    if time.time() - last < interval:
+        return 0
+    stamp.touch()
+    return evict(directory, max_size)
+
+
+def parse_distcc_hosts(spec):
+    """
+    Parses a distcc host list (see distcc(1)), e.g.
+    `localhost/2 build1/8 build2:3633/16,lzo`. Returns a list of
+    `(host, slots)` tuples; the number of slots defaults to 2 for localhost
+    and 4 for other hosts, like in distcc itself.
+    """
+    hosts = []
+    for line in spec.splitlines():
+        for item in line.partition("#")[0].split():
+            if item.startswith("--"):
+                continue
+            host, _, limit = item.partition(",")[0].partition("/")
+            if limit.isdigit():
+                slots = int(limit)
+            else:
+                slots = 2 if host == "localhost" else 4
+            hosts.append((host, slots))
+    return hosts
+
+
 class Wrapper(ConfigurableObject):
     basedir = "wrapper"
     exception = UnsupportedWrapper
@@ -22,13 +121,118 @@ class Wrapper(ConfigurableObject):
             self.path = name
             name = str(Path(name).name)
         super().__init__(name)
+        self.wrappers = [self]
+
+    @staticmethod
+    def get(name):
+        """
+        Returns the wrapper called **name**, which can also be a
+        comma-separated list of wrappers to use together.
+        """
+        names = split(name)
+        if len(names) > 1:
+            return StackedWrapper([Wrapper(n) for n in names])
+        return Wrapper(name)
 
     def __init_config__(self):
-        self.environment = {
-            k: expand(k, v) for k, v in self.config["environment"].items()
-        }
+        self.shared_dir = None
+        if self.config.has_section("shared") and shared_cache_enabled():
+            self.shared_dir = Path(
+                os.getenv("TUXMAKE_SHARED_CACHE_DIR")
+                or xdg.cache_dir() / "compiler-cache" / self.name
+            )
+            read_only = os.getenv("TUXMAKE_SHARED_CACHE_READ_ONLY", "false")
+            values = {
+                "shared_dir": self.shared_dir,
+                "read_only": "true" if read_only.lower() == "true" else "false",
+                "build_dir": "{build_dir}",
+            }
+            self.environment = {
+                k: v.format(**values) for k, v in self.config["shared"].items()
+            }
+        else:
+            self.environment = {
+                k: expand(k, v) for k, v in self.config["environment"].items()
+            }
         self.prepare_cmds = split_commands(self.config["commands"].get("prepare", ""))
         self.command = self.config["commands"].get("wrapper")
+        if self.config.has_section("distributed"):
+            self.distributed = dict(self.config["distributed"])
+            # the hosts files are not visible from inside a container, so
+            # the host list is always passed in the environment.
+            variable = self.distributed.get("hosts")
+            spec = self.get_hosts_spec()
+            if variable and spec:
+                self.environment[variable] = spec
+        else:
+            self.distributed = None
+        if self.config.has_section("stats"):
+            self.stats = dict(self.config["stats"])
+        else:
+            self.stats = None
+
+    @property
+    def offline(self):
+        """
+        Whether the build can run offline; distributed compilation needs
+        network access to reach the compilation hosts.
+        """
+        return self.distributed is None
+
+    def get_hosts(self):
+        """
+        Returns the compilation hosts for a distributed compilation wrapper,
+        as `(host, slots)` tuples, taken from the environment variable named
+        in `hosts`, or else from the first existing file in `hosts_files`.
+        """
+        if self.distributed is None:
+            return []
+        return parse_distcc_hosts(self.get_hosts_spec())
+
+    def get_hosts_spec(self):
+        """
+        Returns the compilation host list of a distributed compilation
+        wrapper, in a single line, or an empty string if there is none.
+        """
+        variable = self.distributed.get("hosts")
+        spec = variable and os.getenv(variable)
+        if not spec:
+            for f in split(self.distributed.get("hosts_files", "")):
+                path = Path(f.format(**self.environment)).expanduser()
+                if path.exists():
+                    spec = path.read_text()
+                    break
+        lines = (line.partition("#")[0] for line in (spec or "").splitlines())
+        return " ".join(" ".join(lines).split())
+
+    def get_slots(self):
+        """
+        Returns the number of jobs that the compilation hosts of a
+        distributed compilation wrapper can take in total, or `None` if
+        unknown. `TUXMAKE_DISTRIBUTED_JOBS` overrides the value calculated
+        from the host list.
+        """
+        if self.distributed is None:
+            return None
+        jobs = os.getenv("TUXMAKE_DISTRIBUTED_JOBS")
+        if jobs:
+            if not jobs.isdigit() or int(jobs) < 1:
+                raise InvalidJobs(f"TUXMAKE_DISTRIBUTED_JOBS={jobs}")
+            return int(jobs)
+        return sum(slots for _, slots in self.get_hosts()) or None
+
+    def get_distribution_stats(self, log):
+        """
+        Returns statistics about the distributed compilation, given the
+        build log in **log**.
+        """
+        fallback = self.distributed.get("fallback")
+        lines = log.splitlines()
+        return {
+            "hosts": [{"host": h, "slots": n} for h, n in self.get_hosts()],
+            "slots": self.get_slots(),
+            "local_fallbacks": len([x for x in lines if fallback and fallback in x]),
+        }
 
     def prepare_host(self):
         for k, v in self.environment.items():
@@ -39,8 +243,26 @@ class Wrapper(ConfigurableObject):
         for cmd in self.prepare_cmds:
             build.run_cmd(cmd, echo=False, stdout=subprocess.DEVNULL)
 
-    def wrap(self, makevars):
+    def cleanup(self):
+        """
+        Keeps the shared cache storage, if used, within its maximum size.
+        """
+        for wrapper in self.wrappers:
+            if wrapper.shared_dir and wrapper.shared_dir.exists():
+                maybe_evict(wrapper.shared_dir, get_shared_cache_size())
+
+    def get_command(self, bindir=None):
+        """
+        Returns the wrapper command. **bindir** is the directory where the
+        tuxmake helper scripts are available in the runtime.
+        """
         if not self.command:
+            return None
+        return self.command.format(bindir=bindir)
+
+    def wrap(self, makevars, bindir=None):
+        command = self.get_command(bindir)
+        if not command:
             return makevars
         cross = makevars.get("CROSS_COMPILE", "")
         llvm = makevars.get("LLVM")
@@ -52,11 +274,37 @@ class Wrapper(ConfigurableObject):
             else:
                 compiler = "clang"
             return {
-                "CC": f"{self.command} {compiler}",
-                "HOSTCC": f"{self.command} {compiler}",
+                "CC": f"{command} {compiler}",
+                "HOSTCC": f"{command} {compiler}",
             }
         compilers = {
             "CC": makevars.get("CC") or f"{cross}gcc",
             "HOSTCC": makevars.get("HOSTCC") or "gcc",
         }
-        return {k: f"{self.command} {v}" for k, v in compilers.items()}
+        return {k: f"{command} {v}" for k, v in compilers.items()}
+
+
+class StackedWrapper(Wrapper):
+    """
+    Several wrappers used together, e.g. `timing,ccache`: each wrapper wraps
+    the ones after it.
+    """
+
+    def __init__(self, wrappers):
+        self.wrappers = wrappers
+        self.name = ",".join(w.name for w in wrappers)
+        self.environment = {}
+        self.prepare_cmds = []
+        self.distributed = None
+        self.shared_dir = None
+        self.stats = None
+        for wrapper in wrappers:
+            self.environment.update(wrapper.environment)
+            self.prepare_cmds += wrapper.prepare_cmds
+            if self.distributed is None:
+                self.distributed = wrapper.distributed
+        self.command = " ".join(w.command for w in wrappers if w.command)
+
+    def get_command(self, bindir=None):
+        commands = [w.get_command(bindir) for w in self.wrappers]
+        return " ".join(c for c in commands if c)